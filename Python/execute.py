@@ -9,31 +9,27 @@ import numpy as np
 import time
 
 import ogusa
-from ogusa import calibrate, wealth
+from ogusa import calibrate, wealth, manifest, warmstart
 ogusa.parameters.DATASET = 'REAL'
 
+# List of parameter names that will not be changing (unless we decide to
+# change them for a tax experiment)
+PARAM_NAMES = ['S', 'J', 'T', 'BW', 'lambdas', 'starting_age', 'ending_age',
+               'beta', 'sigma', 'alpha', 'nu', 'Z', 'delta', 'E',
+               'ltilde', 'g_y', 'maxiter', 'mindist_SS', 'mindist_TPI',
+               'analytical_mtrs', 'b_ellipse', 'k_ellipse', 'upsilon',
+               'chi_b_guess', 'chi_n_guess','etr_params','mtrx_params',
+               'mtry_params','tau_payroll', 'tau_bq',
+               'retire', 'mean_income_data', 'g_n_vector',
+               'h_wealth', 'p_wealth', 'm_wealth',
+               'omega', 'g_n_ss', 'omega_SS', 'surv_rate', 'imm_rates', 'e', 'rho', 'omega_S_preTP']
 
-def runner(output_base, baseline_dir, baseline=False, analytical_mtrs=True,
-           age_specific=False, reform=0, fix_transfers=False, user_params={}, guid='',
-           run_micro=True, calibrate_model=False):
-
-    from ogusa import parameters, demographics, income, utils
-
-    tick = time.time()
-
-    #Create output directory structure
-    saved_moments_dir = os.path.join(output_base, "Saved_moments")
-    ss_dir = os.path.join(output_base, "SS")
-    tpi_dir = os.path.join(output_base, "TPI")
-    dirs = [saved_moments_dir, ss_dir, tpi_dir]
-    for _dir in dirs:
-        try:
-            print "making dir: ", _dir
-            os.makedirs(_dir)
-        except OSError as oe:
-            pass
 
-    print ("in runner, baseline is ", baseline)
+def get_run_params(baseline, reform, guid, user_params, analytical_mtrs):
+    '''
+    Returns the parameters of a run: the default parameters of the
+    policy, updated with the user's parameters.
+    '''
     run_params = ogusa.parameters.get_parameters(baseline=baseline, reform=reform,
                           guid=guid, user_modifiable=True)
     run_params['analytical_mtrs'] = analytical_mtrs
@@ -53,124 +49,221 @@ def runner(output_base, baseline_dir, baseline=False, analytical_mtrs=True,
         run_params['sigma'] = user_params['sigma']
         run_params.update(user_params)
 
+    return run_params
 
-    from ogusa import SS, TPI
 
+def ss_stage_key(run_params, param_names, baseline_dir, baseline=False,
+                 reform=0, fix_transfers=False, user_params={}):
+    '''
+    Returns the run manifest key of the SS stage of a run: a hash of the
+    effective parameters, the run options, the SS results of other runs
+    it reads and the model code version.
+    '''
+    run_options = {'params': dict((key, run_params[key])
+                                  for key in param_names),
+                   'baseline': baseline, 'reform': reform,
+                   'fix_transfers': fix_transfers,
+                   'user_params': user_params}
+    input_files = []
+    if not baseline:
+        input_files.append(os.path.join(baseline_dir, 'SS', 'SS_vars.pkl'))
+    if reform == 1:
+        input_files.append(os.path.join(
+            "./OUTPUT_WEALTH_REFORM" + '/sigma' + str(run_params['sigma']),
+            'SS', 'SS_vars.pkl'))
+    return manifest.run_key(run_options, input_files)
 
-    calibrate_model = False
-    # List of parameter names that will not be changing (unless we decide to
-    # change them for a tax experiment)
 
-    param_names = ['S', 'J', 'T', 'BW', 'lambdas', 'starting_age', 'ending_age',
-                'beta', 'sigma', 'alpha', 'nu', 'Z', 'delta', 'E',
-                'ltilde', 'g_y', 'maxiter', 'mindist_SS', 'mindist_TPI',
-                'analytical_mtrs', 'b_ellipse', 'k_ellipse', 'upsilon',
-                'chi_b_guess', 'chi_n_guess','etr_params','mtrx_params',
-                'mtry_params','tau_payroll', 'tau_bq',
-                'retire', 'mean_income_data', 'g_n_vector',
-                'h_wealth', 'p_wealth', 'm_wealth',
-                'omega', 'g_n_ss', 'omega_SS', 'surv_rate', 'imm_rates','e', 'rho', 'omega_S_preTP']
+def tpi_stage_key(ss_key, stage_dir, baseline_dir, baseline=False):
+    '''
+    Returns the run manifest key of the TPI stage of a run: the SS stage
+    key and a hash of the SS and (for reforms) baseline TPI results it
+    reads.
+    '''
+    input_files = [os.path.join(stage_dir, 'SS', 'SS_vars.pkl')]
+    if not baseline:
+        input_files += [os.path.join(baseline_dir, 'SS', 'SS_vars.pkl'),
+                        os.path.join(baseline_dir, 'TPI', 'TPI_vars.pkl')]
+    return manifest.run_key({'ss_key': ss_key}, input_files)
 
 
+def stage_key(stage, output_base, baseline_dir, baseline=False,
+              analytical_mtrs=True, reform=0, fix_transfers=False,
+              user_params={}, guid=''):
     '''
-    ------------------------------------------------------------------------
-        If using income tax reform, need to determine parameters that yield
-        same SS revenue as the wealth tax reform.
-    ------------------------------------------------------------------------
+    Returns the run manifest key that runner_SS (stage 'SS') or runner
+    (stage 'TPI') would record for a run with these arguments, without
+    running it, or None if results the stage reads are not on disk.  A
+    stage is up to date if manifest.is_complete() finds this key.
     '''
-    if reform == 1:
-        sim_params = {}
-        for key in param_names:
-            sim_params[key] = run_params[key]
+    run_params = get_run_params(baseline, reform, guid, user_params,
+                                analytical_mtrs)
+    try:
+        key = ss_stage_key(run_params, PARAM_NAMES, baseline_dir, baseline,
+                           reform, fix_transfers, user_params)
+        if stage == 'TPI':
+            stage_dir = baseline_dir if baseline else output_base
+            key = tpi_stage_key(key, stage_dir, baseline_dir, baseline)
+    except IOError:
+        return None
+    return key
+
+
+def match_reform_income_tax(sim_params, baseline_dir, baseline=False,
+                            fix_transfers=False, baseline_solution=None):
+    '''
+    For the income tax reform (reform 1), finds the d parameter of the
+    income tax functions at which SS net tax receipts equal those of the
+    wealth tax reform at the same sigma (see
+    revenue.match_income_tax()).  The income tax parameters in
+    sim_params are set to it, and the SS solution found at it is
+    returned, so it does not need to be solved again.
+    '''
+    from ogusa import SS, revenue
+
+    income_tax_params, ss_params, iterative_params, chi_params = \
+        SS.create_steady_state_parameters(**sim_params)
+    if baseline_solution is None:
+        baseline_solution = SS.load_SS_solution(baseline_dir)
+
+    # find SS revenue from wealth tax reform
+    reform3_ss_solutions = SS.load_SS_solution(
+        "./OUTPUT_WEALTH_REFORM" + '/sigma' + str(sim_params['sigma']))
+    receipts_to_match = reform3_ss_solutions['net_tax_receipts']
+
+    # find d for the income tax that raises the same revenue, starting
+    # from the value found with default parameters (0.453 if
+    # fix_transfers=False, 0.503 if True)
+    d_guess = 0.5025 if fix_transfers else 0.453
+    match_params = (income_tax_params, ss_params, iterative_params,
+                    chi_params, baseline, fix_transfers, baseline_dir,
+                    baseline_solution)
+    new_d_inc, ss_match = revenue.match_income_tax(receipts_to_match,
+                                                   d_guess, match_params)
+    print '\tOld income tax:', d_guess
+    print '\tNew income tax:', new_d_inc
+    analytical_mtrs, etr_params, mtrx_params, mtry_params = \
+        revenue.set_income_tax_d(income_tax_params, new_d_inc)
+
+    sim_params['etr_params'] = np.reshape(etr_params, (etr_params.shape[0], 1, etr_params.shape[1]))
+    sim_params['mtrx_params'] = np.reshape(mtrx_params, (mtrx_params.shape[0], 1, mtrx_params.shape[1]))
+    sim_params['mtry_params'] = np.reshape(mtry_params, (mtry_params.shape[0], 1, mtry_params.shape[1]))
+
+    return ss_match
 
-        sim_params['output_dir'] = output_base
-        sim_params['run_params'] = run_params
-        income_tax_params, ss_params, iterative_params, chi_params= SS.create_steady_state_parameters(**sim_params)
-
-        # find SS revenue from wealth tax reform
-        reform3_ss_dir = os.path.join(
-        "./OUTPUT_WEALTH_REFORM"    + '/sigma' + str(run_params['sigma']), "SS/SS_vars.pkl")
-        reform3_ss_solutions = pickle.load(open(reform3_ss_dir, "rb"))
-        receipts_to_match = reform3_ss_solutions['net_tax_receipts']
-
-        # create function to match SS revenue
-        # def matcher(d_guess, params):
-        #     income_tax_params, receipts_to_match, ss_params, iterative_params,\
-        #                       chi_params, baseline, baseline_dir = params
-        #     analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
-        #     etr_params[:,3] = d_guess
-        #     mtrx_params[:,3] = d_guess
-        #     mtry_params[:,3] = d_guess
-        #     income_tax_params = analytical_mtrs, etr_params, mtrx_params, mtry_params
-        #     ss_outputs = SS.run_SS(income_tax_params, ss_params, iterative_params,
-        #                       chi_params, baseline ,baseline_dir=baseline_dir, output_base=output_base)
-        #
-        #     receipts_new = ss_outputs['T_Hss'] + ss_outputs['Gss']
-        #     error = abs(receipts_to_match - receipts_new)
-        #     if d_guess <= 0:
-        #         error = 1e14
-        #     print 'Error in taxes:', error
-        #     return error
-
-        # print 'Computing new income tax to match wealth tax'
-        d_guess= 0.413 # initial guess
-        # import scipy.optimize as opt
-        # params = [income_tax_params, receipts_to_match, ss_params, iterative_params,
-        #                   chi_params, baseline, baseline_dir]
-        # new_d_inc = opt.fsolve(matcher, d_guess, args=params, xtol=1e-6)
-        new_d_inc = 0.413  # this value comes out given default parameter values (if fix_transfers=True this is 0.503 if False then 0.453)
-
-        print '\tOld income tax:', d_guess
-        print '\tNew income tax:', new_d_inc
-        analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
-
-        etr_params[:,3] = new_d_inc
-        mtrx_params[:,3] = new_d_inc
-        mtry_params[:,3] = new_d_inc
-
-        run_params['etr_params'] = np.tile(np.reshape(etr_params,(run_params['S'],1, etr_params.shape[1])),(1,run_params['BW'],1))
-        run_params['mtrx_params'] = np.tile(np.reshape(mtrx_params,(run_params['S'],1,mtrx_params.shape[1])),(1,run_params['BW'],1))
-        run_params['mtry_params'] = np.tile(np.reshape(mtry_params,(run_params['S'],1,mtry_params.shape[1])),(1,run_params['BW'],1))
 
+def runner(output_base, baseline_dir, baseline=False, analytical_mtrs=True,
+           age_specific=False, reform=0, fix_transfers=False, user_params={}, guid='',
+           run_micro=True, calibrate_model=False, ss_guesses=None,
+           tpi_guesses=None, run_ss=True, force=False, library_dir=None):
     '''
-    ------------------------------------------------------------------------
-        Run SS
-    ------------------------------------------------------------------------
+    Solves the SS and the transition path and saves them to output_base.
+    ss_guesses and tpi_guesses are SS and TPI results (e.g. at a nearby
+    sigma) to start from, in place of the default starting values.  If
+    library_dir is given, runs without guesses start from the closest
+    solutions in the warm start library there, and the solutions of the
+    run are added to it.  If
+    run_ss is False, the SS saved by an earlier run (e.g. runner_SS) is
+    used and only the transition path is solved.  Stages that the run
+    manifest shows were already run with the same inputs and code are
+    loaded from disk unless force is True.
+    Returns the SS and TPI results.
     '''
 
-    sim_params = {}
-    for key in param_names:
-        sim_params[key] = run_params[key]
+    from ogusa import parameters, demographics, income, utils
 
-    sim_params['output_dir'] = output_base
-    sim_params['run_params'] = run_params
+    tick = time.time()
+
+    #Create output directory structure
+    saved_moments_dir = os.path.join(output_base, "Saved_moments")
+    ss_dir = os.path.join(output_base, "SS")
+    tpi_dir = os.path.join(output_base, "TPI")
+    dirs = [saved_moments_dir, ss_dir, tpi_dir]
+    for _dir in dirs:
+        try:
+            print "making dir: ", _dir
+            os.makedirs(_dir)
+        except OSError as oe:
+            pass
 
-    income_tax_params, ss_parameters, iterative_params, chi_params = SS.create_steady_state_parameters(**sim_params)
+    print ("in runner, baseline is ", baseline)
+    run_params = get_run_params(baseline, reform, guid, user_params,
+                                analytical_mtrs)
 
-    analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
-    print('ETR param shape = ', etr_params.shape)
 
-    ss_outputs = SS.run_SS(income_tax_params, ss_parameters, iterative_params,
-                           chi_params, baseline, fix_transfers=fix_transfers,
-                           baseline_dir=baseline_dir)
+    from ogusa import SS, TPI
 
-    '''
-    ------------------------------------------------------------------------
-        Pickle SS results and parameters of run
-    ------------------------------------------------------------------------
-    '''
-    if baseline:
-        utils.mkdirs(os.path.join(baseline_dir, "SS"))
-        ss_dir = os.path.join(baseline_dir, "SS/SS_vars.pkl")
-        pickle.dump(ss_outputs, open(ss_dir, "wb"))
-        param_dir = os.path.join(baseline_dir, "run_parameters.pkl")
-        pickle.dump(sim_params, open(param_dir, "wb"))
+
+    calibrate_model = False
+    param_names = PARAM_NAMES
+
+    # skip the SS if it was already solved with the same inputs
+    stage_dir = baseline_dir if baseline else output_base
+    ss_key = ss_stage_key(run_params, param_names, baseline_dir, baseline,
+                          reform, fix_transfers, user_params)
+    if run_ss and not force and manifest.is_complete(stage_dir, 'SS', ss_key):
+        print 'SS results in ', stage_dir, ' are up to date'
+        run_ss = False
+
+    if run_ss:
+        sim_params = {}
+        for key in param_names:
+            sim_params[key] = run_params[key]
+
+        sim_params['output_dir'] = output_base
+        sim_params['run_params'] = run_params
+
+        '''
+        ------------------------------------------------------------------------
+            If using income tax reform, need to determine parameters that yield
+            same SS revenue as the wealth tax reform.
+        ------------------------------------------------------------------------
+        '''
+        if reform == 1:
+            # the SS at the matching income tax is solved in finding it
+            ss_outputs = match_reform_income_tax(sim_params, baseline_dir,
+                                                 baseline, fix_transfers)
+        else:
+            '''
+            ------------------------------------------------------------------------
+                Run SS
+            ------------------------------------------------------------------------
+            '''
+            income_tax_params, ss_parameters, iterative_params, chi_params = SS.create_steady_state_parameters(**sim_params)
+
+            analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
+            print('ETR param shape = ', etr_params.shape)
+
+            if library_dir is not None and ss_guesses is None:
+                ss_guesses = warmstart.warm_start(library_dir, sim_params, 'SS')
+
+            ss_outputs = SS.run_SS(income_tax_params, ss_parameters, iterative_params,
+                                   chi_params, baseline, fix_transfers=fix_transfers,
+                                   baseline_dir=baseline_dir,
+                                   initial_guesses=ss_guesses)
+
+        '''
+        ------------------------------------------------------------------------
+            Pickle SS results and parameters of run
+        ------------------------------------------------------------------------
+        '''
+        if baseline:
+            SS.save_SS_solution(ss_outputs, baseline_dir)
+            param_dir = os.path.join(baseline_dir, "run_parameters.pkl")
+            pickle.dump(sim_params, open(param_dir, "wb"))
+        else:
+            SS.save_SS_solution(ss_outputs, output_base)
+            param_dir = os.path.join(output_base, "run_parameters.pkl")
+            pickle.dump(sim_params, open(param_dir, "wb"))
+        manifest.record_stage(stage_dir, 'SS', ss_key)
+        if library_dir is not None:
+            warmstart.add_run(library_dir, stage_dir)
     else:
-        utils.mkdirs(os.path.join(output_base, "SS"))
-        ss_dir = os.path.join(output_base, "SS/SS_vars.pkl")
-        pickle.dump(ss_outputs, open(ss_dir, "wb"))
-        param_dir = os.path.join(output_base, "run_parameters.pkl")
-        pickle.dump(sim_params, open(param_dir, "wb"))
+        # the SS was solved before (e.g. by runner_SS), start the
+        # transition path from its saved parameters and solution
+        sim_params = pickle.load(open(os.path.join(stage_dir,
+                                                   "run_parameters.pkl"), "rb"))
+        ss_outputs = SS.load_SS_solution(stage_dir)
 
 
     '''
@@ -179,6 +272,14 @@ def runner(output_base, baseline_dir, baseline=False, analytical_mtrs=True,
     ------------------------------------------------------------------------
     '''
 
+    # skip the TPI if it was already solved with the same inputs
+    tpi_key = tpi_stage_key(ss_key, stage_dir, baseline_dir, baseline)
+    if not force and manifest.is_complete(output_base, 'TPI', tpi_key):
+        print 'TPI results in ', output_base, ' are up to date'
+        tpi_output = pickle.load(open(os.path.join(output_base, "TPI",
+                                                   "TPI_vars.pkl"), "rb"))
+        return ss_outputs, tpi_output
+
     sim_params['baseline'] = baseline
     sim_params['input_dir'] = output_base
     sim_params['baseline_dir'] = baseline_dir
@@ -186,9 +287,13 @@ def runner(output_base, baseline_dir, baseline=False, analytical_mtrs=True,
 
     income_tax_params, tpi_params, iterative_params, initial_values, SS_values = TPI.create_tpi_params(**sim_params)
 
+    if library_dir is not None and tpi_guesses is None:
+        tpi_guesses = warmstart.warm_start(library_dir, sim_params, 'TPI')
+
     tpi_output, macro_output = TPI.run_TPI(income_tax_params,
         tpi_params, iterative_params, initial_values, SS_values,
-        fix_transfers=fix_transfers, output_dir=output_base)
+        fix_transfers=fix_transfers, output_dir=output_base,
+        initial_guesses=tpi_guesses)
 
 
     '''
@@ -205,15 +310,32 @@ def runner(output_base, baseline_dir, baseline=False, analytical_mtrs=True,
     utils.mkdirs(tpi_dir)
     tpi_vars = os.path.join(tpi_dir, "TPI_macro_vars.pkl")
     pickle.dump(macro_output, open(tpi_vars, "wb"))
+    manifest.record_stage(output_base, 'TPI', tpi_key)
+    if library_dir is not None:
+        warmstart.add_run(library_dir, output_base)
 
 
     print "Time path iteration complete.  It"
     print "took {0} seconds to get that part done.".format(time.time() - tick)
 
+    return ss_outputs, tpi_output
+
 
 def runner_SS(output_base, baseline_dir, baseline=False, analytical_mtrs=True,
               age_specific=False, reform=0, fix_transfers=False, user_params={}, guid='',
-              calibrate_model=False, run_micro=True):
+              calibrate_model=False, run_micro=True, ss_guesses=None,
+              force=False, library_dir=None, chi_std_errors=False):
+    '''
+    Solves the SS and saves it to output_base.  ss_guesses are SS
+    results (e.g. at a nearby sigma) to start from, in place of the
+    default starting values, or if library_dir is given, from the
+    closest solutions in the warm start library there (the solution is
+    then added to the library).  If the run manifest shows the SS was
+    already solved with the same inputs and code, it is loaded from disk
+    unless force is True.  With calibrate_model, chi is estimated first,
+    and its standard errors are computed if chi_std_errors is True
+    (2(J+S) more SS solves).  Returns the SS results.
+    '''
 
     from ogusa import parameters, demographics, income, utils
 
@@ -232,42 +354,13 @@ def runner_SS(output_base, baseline_dir, baseline=False, analytical_mtrs=True,
             pass
 
     print ("in runner, baseline is ", baseline)
-    run_params = ogusa.parameters.get_parameters(baseline=baseline, reform=reform,
-                          guid=guid, user_modifiable=True)
-    run_params['analytical_mtrs'] = analytical_mtrs
-
-
-
-    # Modify ogusa parameters based on user input
-    if 'frisch' in user_params:
-        print "updating fricsh and associated"
-        b_ellipse, upsilon = ogusa.elliptical_u_est.estimation(user_params['frisch'],
-                                                               run_params['ltilde'])
-        run_params['b_ellipse'] = b_ellipse
-        run_params['upsilon'] = upsilon
-        run_params.update(user_params)
-
-    # Modify ogusa parameters based on user input
-    if 'sigma' in user_params:
-        print "updating sigma"
-        run_params['sigma'] = user_params['sigma']
-        run_params.update(user_params)
+    run_params = get_run_params(baseline, reform, guid, user_params,
+                                analytical_mtrs)
 
     from ogusa import SS, TPI, SS_alt
 
 
-    # List of parameter names that will not be changing (unless we decide to
-    # change them for a tax experiment)
-
-    param_names = ['S', 'J', 'T', 'BW', 'lambdas', 'starting_age', 'ending_age',
-                'beta', 'sigma', 'alpha', 'nu', 'Z', 'delta', 'E',
-                'ltilde', 'g_y', 'maxiter', 'mindist_SS', 'mindist_TPI',
-                'analytical_mtrs', 'b_ellipse', 'k_ellipse', 'upsilon',
-                'chi_b_guess', 'chi_n_guess','etr_params','mtrx_params',
-                'mtry_params','tau_payroll', 'tau_bq',
-                'retire', 'mean_income_data', 'g_n_vector',
-                'h_wealth', 'p_wealth', 'm_wealth',
-                'omega', 'g_n_ss', 'omega_SS', 'surv_rate', 'imm_rates', 'e', 'rho', 'omega_S_preTP']
+    param_names = PARAM_NAMES
 
 
     sim_params = {}
@@ -277,6 +370,27 @@ def runner_SS(output_base, baseline_dir, baseline=False, analytical_mtrs=True,
     sim_params['output_dir'] = output_base
     sim_params['run_params'] = run_params
 
+    # skip the SS if it was already solved with the same inputs
+    stage_dir = baseline_dir if baseline else output_base
+    ss_key = ss_stage_key(run_params, param_names, baseline_dir, baseline,
+                          reform, fix_transfers, user_params)
+    # (a calibration run always solves, since it changes chi)
+    if (not force and not calibrate_model and
+            manifest.is_complete(stage_dir, 'SS', ss_key)):
+        print 'SS results in ', stage_dir, ' are up to date'
+        return SS.load_SS_solution(stage_dir)
+
+    if library_dir is not None and ss_guesses is None:
+        ss_guesses = warmstart.warm_start(library_dir, sim_params, 'SS')
+
+    # baseline SS results are read once here and passed to every SS solve
+    # (a baseline started from ss_guesses does not need them)
+    if baseline and ss_guesses is not None:
+        baseline_solution = None
+    else:
+        baseline_solution = SS.load_SS_solution(baseline_dir)
+    ss_match = None
+
     '''
     ------------------------------------------------------------------------
         If using income tax reform, need to determine parameters that yield
@@ -284,159 +398,9 @@ def runner_SS(output_base, baseline_dir, baseline=False, analytical_mtrs=True,
     ------------------------------------------------------------------------
     '''
     if reform == 1:
-
-        income_tax_params, ss_params, iterative_params, chi_params= SS.create_steady_state_parameters(**sim_params)
-
-        # find SS revenue from wealth tax reform
-        reform3_ss_dir = os.path.join(
-        "./OUTPUT_WEALTH_REFORM"    + '/sigma' + str(run_params['sigma']), "SS/SS_vars.pkl")
-        reform3_ss_solutions = pickle.load(open(reform3_ss_dir, "rb"))
-        receipts_to_match = reform3_ss_solutions['T_Hss'] + reform3_ss_solutions['Gss']
-
-        # create function to match SS revenue
-        def matcher(d_guess, params):
-            income_tax_params, receipts_to_match, ss_params, iterative_params,\
-                              chi_params, baseline, baseline_dir = params
-            analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
-            etr_params[:,3] = d_guess
-            mtrx_params[:,3] = d_guess
-            mtry_params[:,3] = d_guess
-            income_tax_params = analytical_mtrs, etr_params, mtrx_params, mtry_params
-            ss_outputs = SS.run_SS(income_tax_params, ss_params, iterative_params,
-                              chi_params, baseline, fix_transfers=fix_transfers,
-                              baseline_dir=baseline_dir)
-
-            receipts_new = ss_outputs['T_Hss'] + ss_outputs['Gss']
-            error = abs(receipts_to_match - receipts_new)
-            if d_guess <= 0:
-                error = 1e14
-            print 'Error in taxes:', error
-            return error
-
-        print 'Computing new income tax to match wealth tax'
-        # d_guess= .452 # initial guess 0.452 works for sigma = 2, frisch 1.5
-        # new_d_inc = d_guess
-        # import scipy.optimize as opt
-        # params = [income_tax_params, receipts_to_match, ss_params, iterative_params,
-        #                   chi_params, baseline, baseline_dir]
-        # new_d_inc = opt.fsolve(matcher, d_guess, args=params, xtol=1e-8)
-        # print '\tOld income tax:', d_guess
-        # print '\tNew income tax:', new_d_inc
-
-        def samesign(a, b):
-            return a * b > 0
-
-        def bisect_method(func, params, low, high):
-            'Find root of continuous function where f(low) and f(high) have opposite signs'
-
-            #assert not samesign(func(params,low), func(params,high))
-
-            for i in range(54):
-                midpoint = (low + high) / 2.0
-                if samesign(func(params,low), func(params,midpoint)):
-                    low = midpoint
-                else:
-                    high = midpoint
-
-            return midpoint
-
-        def solve_model(params,d):
-            income_tax_params, ss_params, iterative_params,\
-                              chi_params, baseline ,baseline_dir = params
-            analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
-            etr_params[:,3] = d
-            mtrx_params[:,3] = d
-            mtry_params[:,3] = d
-            income_tax_params = analytical_mtrs, etr_params, mtrx_params, mtry_params
-            ss_outputs = SS.run_SS(income_tax_params, ss_params, iterative_params,
-                              chi_params, baseline, fix_transfers=fix_transfers,
-                              baseline_dir=baseline_dir)
-            ss_dir = os.path.join("./OUTPUT_INCOME_REFORM/sigma2.0", "SS/SS_vars.pkl")
-            pickle.dump(ss_outputs, open(ss_dir, "wb"))
-            receipts_new = ss_outputs['T_Hss'] + ss_outputs['Gss']
-            new_error = receipts_to_match - receipts_new
-            print 'Error in taxes:', error
-            print 'New income tax:', d
-            return new_error
-
-        # print 'Computing new income tax to match wealth tax'
-        # d_guess= 0.5025 # initial guess
-        # # income_tax_params, receipts_to_match, ss_params, iterative_params,\
-        # #                   chi_params, baseline, baseline_dir = params
-        # analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
-        # etr_params[:,3] = d_guess
-        # mtrx_params[:,3] = d_guess
-        # mtry_params[:,3] = d_guess
-        # income_tax_params = analytical_mtrs, etr_params, mtrx_params, mtry_params
-        # ss_outputs = SS.run_SS(income_tax_params, ss_params, iterative_params,
-        #                   chi_params, baseline, fix_transfers=fix_transfers,
-        #                   baseline_dir=baseline_dir)
-        # ss_dir = os.path.join("./OUTPUT_INCOME_REFORM/sigma2.0", "SS/SS_vars.pkl")
-        # pickle.dump(ss_outputs, open(ss_dir, "wb"))
-        # receipts_new = ss_outputs['T_Hss'] + ss_outputs['Gss']
-        # error = receipts_to_match - receipts_new
-        # new_error = error
-        # print "ERROR: ", error
-        # max_loop_iter = 1
-        # output_list = np.zeros((max_loop_iter,3))
-        # loop_iter = 0
-        # bisect = 0
-        # d_guess_old = d_guess
-        # # while np.abs(new_error) > 1e-8 and loop_iter < max_loop_iter:
-        # while loop_iter < max_loop_iter:
-        #     # if new_error > 0 and new_error > 0 and bisect == 0:
-        #     #     d_guess_old = d_guess
-        #     #     d_guess+=0.001
-        #     # elif new_error < 0 and new_error < 0 and bisect == 0:
-        #     #     d_guess_old = d_guess
-        #     #     d_guess-=0.001
-        #     #     d_guess = max(0.0,d_guess) # constrain so not negative
-        #     # else:
-        #     #     bisect = 1
-        #     #     print 'Entering bisection method'
-        #     #     params = income_tax_params, ss_params, iterative_params,\
-        #     #                       chi_params, baseline ,baseline_dir
-        #     #     high = max(d_guess,d_guess_old)
-        #     #     low = min(d_guess,d_guess_old)
-        #     #     d_guess = bisect_method(solve_model, params, low, high)
-        #     #     loop_iter = max_loop_iter
-        #     d_guess_old = d_guess
-        #     d_guess+=0.0005
-        #
-        #     error = new_error
-        #     etr_params[:,3] = d_guess
-        #     mtrx_params[:,3] = d_guess
-        #     mtry_params[:,3] = d_guess
-        #     income_tax_params = analytical_mtrs, etr_params, mtrx_params, mtry_params
-        #     print 'now here$$$'
-        #     ss_outputs = SS.run_SS(income_tax_params, ss_params, iterative_params,
-        #                       chi_params, baseline, fix_transfers=fix_transfers,
-        #                       baseline_dir=baseline_dir)
-        #     ss_dir = os.path.join("./OUTPUT_INCOME_REFORM/sigma2.0", "SS/SS_vars.pkl")
-        #     pickle.dump(ss_outputs, open(ss_dir, "wb"))
-        #     receipts_new = ss_outputs['T_Hss'] + ss_outputs['Gss']
-        #     new_error = (receipts_to_match - receipts_new)
-        #     print "ERROR: ", new_error
-        #     output_list[loop_iter,0]=new_error
-        #     output_list[loop_iter,1]=d_guess
-        #     output_list[loop_iter,2]=ss_outputs['Yss']-ss_outputs['Iss']-ss_outputs['Css']-ss_outputs['Gss']
-        #     np.savetxt('inc_tax_out.csv',output_list, delimiter=",")
-        #     pickle.dump(output_list, open("output_list.pkl", "wb"))
-        #     print 'Error in taxes:', error
-        #     print 'Old income tax:', d_guess_old
-        #     print 'New income tax:', d_guess
-        #     print 'iteration: ', loop_iter
-        #     loop_iter += 1
-
-        analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
-        new_d_inc = 0.5025 # this is 0.453 if fix_transfers=False, 0.503 if True
-        etr_params[:,3] = new_d_inc
-        mtrx_params[:,3] = new_d_inc
-        mtry_params[:,3] = new_d_inc
-
-        sim_params['etr_params'] = np.tile(np.reshape(etr_params,(run_params['S'],1,etr_params.shape[1])),(1,run_params['BW'],1))
-        sim_params['mtrx_params'] = np.tile(np.reshape(mtrx_params,(run_params['S'],1,mtrx_params.shape[1])),(1,run_params['BW'],1))
-        sim_params['mtry_params'] = np.tile(np.reshape(mtry_params,(run_params['S'],1,mtry_params.shape[1])),(1,run_params['BW'],1))
+        ss_match = match_reform_income_tax(sim_params, baseline_dir,
+                                           baseline, fix_transfers,
+                                           baseline_solution)
 
 
     '''
@@ -453,15 +417,31 @@ def runner_SS(output_base, baseline_dir, baseline=False, analytical_mtrs=True,
     ****
     '''
     if calibrate_model:
-        chi_params = calibrate.chi_estimate(income_tax_params, ss_params,
-                      iterative_params, chi_params, baseline_dir=baseline_dir)
+        chi_estimate = calibrate.chi_estimate(income_tax_params, ss_params,
+                      iterative_params, chi_params, baseline_dir=baseline_dir,
+                      baseline_solution=baseline_solution,
+                      std_errors=chi_std_errors)
+        J = sim_params['J']
+        chi_params = (np.array(chi_estimate[:J]), np.array(chi_estimate[J:]))
+        # the solution is saved and recorded with the estimated chi
+        run_params['chi_b_guess'], run_params['chi_n_guess'] = chi_params
+        sim_params['chi_b_guess'], sim_params['chi_n_guess'] = chi_params
+        ss_key = ss_stage_key(run_params, param_names, baseline_dir,
+                              baseline, reform, fix_transfers, user_params)
 
     # ss_outputs = SS_alt.run_SS(income_tax_params, ss_params, iterative_params,
     #                   chi_params, baseline, baseline_dir=baseline_dir)
     print 'Fix transfers = ', fix_transfers
-    ss_outputs = SS.run_SS(income_tax_params, ss_params, iterative_params,
-                      chi_params, baseline, fix_transfers=fix_transfers,
-                      baseline_dir=baseline_dir)
+    if ss_match is not None and not calibrate_model:
+        # the SS at the matching income tax was solved in finding it
+        ss_outputs = ss_match
+    else:
+        ss_outputs = SS.run_SS(income_tax_params, ss_params, iterative_params,
+                          chi_params, baseline, fix_transfers=fix_transfers,
+                          baseline_dir=baseline_dir,
+                          initial_guesses=(ss_match if ss_match is not None
+                                           else ss_guesses),
+                          baseline_solution=baseline_solution)
 
 
 
@@ -483,14 +463,143 @@ def runner_SS(output_base, baseline_dir, baseline=False, analytical_mtrs=True,
     ------------------------------------------------------------------------
     '''
     if baseline:
-        utils.mkdirs(os.path.join(baseline_dir, "SS"))
-        ss_dir = os.path.join(baseline_dir, "SS/SS_vars.pkl")
-        pickle.dump(ss_outputs, open(ss_dir, "wb"))
+        SS.save_SS_solution(ss_outputs, baseline_dir)
         param_dir = os.path.join(baseline_dir, "run_parameters.pkl")
         pickle.dump(sim_params, open(param_dir, "wb"))
     else:
-        utils.mkdirs(os.path.join(output_base, "SS"))
-        ss_dir = os.path.join(output_base, "SS/SS_vars.pkl")
-        pickle.dump(ss_outputs, open(ss_dir, "wb"))
+        SS.save_SS_solution(ss_outputs, output_base)
         param_dir = os.path.join(output_base, "run_parameters.pkl")
         pickle.dump(sim_params, open(param_dir, "wb"))
+    manifest.record_stage(stage_dir, 'SS', ss_key)
+    if library_dir is not None:
+        warmstart.add_run(library_dir, stage_dir)
+
+    return ss_outputs
+
+
+def runner_sweep(scenarios, baseline_dir, output_file=None, analytical_mtrs=True,
+                 fix_transfers=True, user_params={}, guid='wealth_tax_sweep',
+                 num_workers=1, batch_size=None):
+    '''
+    Solves the SS of many wealth tax (and income tax) policies, e.g. from
+    ogusa.sweep.scenario_grid(), against the baseline in baseline_dir.
+    The parameters are set up and the baseline SS is loaded once for all
+    the policies, and with batch_size the policies are solved batch_size
+    at a time by ogusa.SS.run_SS_batch().  Returns the table of outcomes (revenue, K, r, w, gini
+    and top shares of wealth), also saved to output_file if given, and
+    the SS results of each policy.
+    '''
+    from ogusa import sweep
+
+    params, sim_params = sweep_setup(baseline_dir, analytical_mtrs,
+                                     fix_transfers, user_params, guid)
+    table, ss_outputs = sweep.policy_sweep(scenarios, params,
+                                           num_workers=num_workers,
+                                           batch_size=batch_size)
+    if output_file is not None:
+        table.to_csv(output_file, index=False)
+
+    return table, ss_outputs
+
+
+def sweep_setup(baseline_dir, analytical_mtrs=True, fix_transfers=True,
+                user_params={}, guid='wealth_tax_sweep'):
+    '''
+    Sets up the parameters and loads the baseline SS solution shared by
+    the policies of a sweep.  Returns the params tuple passed to
+    ogusa.sweep.policy_sweep() and the sim_params dictionary they were
+    made from.
+    '''
+    from ogusa import SS
+
+    run_params = get_run_params(False, 2, guid, user_params, analytical_mtrs)
+
+    param_names = PARAM_NAMES
+
+    sim_params = {}
+    for key in param_names:
+        sim_params[key] = run_params[key]
+    sim_params['output_dir'] = baseline_dir
+    sim_params['run_params'] = run_params
+
+    income_tax_params, ss_params, iterative_params, chi_params = \
+        SS.create_steady_state_parameters(**sim_params)
+    params = (income_tax_params, ss_params, iterative_params, chi_params,
+              fix_transfers, baseline_dir, SS.load_SS_solution(baseline_dir))
+
+    return params, sim_params
+
+
+def runner_static_score(policies, baseline_dir, output_file=None,
+                        use_tpi=True):
+    '''
+    Scores wealth tax (and income tax) policies, e.g. from
+    ogusa.sweep.scenario_grid(), statically on the baseline solution in
+    baseline_dir: the revenue change holding the baseline distribution
+    of wealth and labor supply fixed, in the SS and (if the baseline TPI
+    was solved and use_tpi is True) over the budget window.  Returns the
+    table of policies, also saved to output_file if given, and the
+    incidence by age, ability and year.
+    '''
+    from ogusa import scoring
+
+    sim_params, ss_solution, tpi_solution = score_setup(baseline_dir,
+                                                        use_tpi)
+    table, incidence = scoring.static_score(policies, sim_params,
+                                            ss_solution, tpi_solution)
+    if output_file is not None:
+        table.to_csv(output_file, index=False)
+
+    return table, incidence
+
+
+def score_setup(baseline_dir, use_tpi=True):
+    '''
+    Loads the parameters and the SS (and, if it was solved and use_tpi
+    is True, TPI) results of the baseline in baseline_dir that policies
+    are scored on.  Returns sim_params, the SS results and the TPI
+    results (None if not used).
+    '''
+    from ogusa import SS
+
+    sim_params = pickle.load(open(os.path.join(baseline_dir,
+                                               "run_parameters.pkl"), "rb"))
+    ss_solution = SS.load_SS_solution(baseline_dir)
+    tpi_path = os.path.join(baseline_dir, "TPI", "TPI_vars.pkl")
+    tpi_solution = None
+    if use_tpi and os.path.exists(tpi_path):
+        tpi_solution = pickle.load(open(tpi_path, "rb"))
+
+    return sim_params, ss_solution, tpi_solution
+
+
+def runner_sensitivity(param_names, output_dir, baseline=False,
+                       fix_transfers=False, outcomes=None, output_file=None):
+    '''
+    Computes the derivatives of SS outcomes (K, revenue, gini
+    coefficient of wealth, ...) with respect to the parameters in
+    param_names, e.g. ['h_wealth', 'p_wealth', 'sigma'], at the SS saved
+    in output_dir, by implicit differentiation (see
+    ogusa.sensitivity).  baseline and fix_transfers must be those the SS
+    was solved with.  Returns the table of derivatives, also saved to
+    output_file if given, and the derivatives of the SS solution.
+    '''
+    from ogusa import SS, sensitivity
+
+    sim_params = pickle.load(open(os.path.join(output_dir,
+                                               "run_parameters.pkl"), "rb"))
+    ss_solution = SS.load_SS_solution(output_dir)
+    income_tax_params, ss_params, iterative_params, chi_params = \
+        SS.create_steady_state_parameters(**sim_params)
+    # the chi parameters the SS was solved with (e.g. after calibration)
+    chi_params = (ss_solution['chi_b'], ss_solution['chi_n'])
+    if outcomes is None:
+        outcomes = sensitivity.OUTCOMES
+
+    table, solution_derivs = sensitivity.ss_sensitivities(
+        param_names, income_tax_params, ss_params, chi_params, ss_solution,
+        baseline=baseline, fix_transfers=fix_transfers, outcomes=outcomes)
+    if output_file is not None:
+        table.to_csv(output_file)
+
+    return table, solution_derivs
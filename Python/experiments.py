@@ -0,0 +1,563 @@
+'''
+------------------------------------------------------------------------
+Runs the grid of baseline and reform experiments (sigma values x
+{baseline, wealth, income} x {SS, TPI}) as a graph of dependent runs.
+
+The dependencies between runs are:
+    baseline SS  before baseline TPI and both reforms
+    wealth SS    before income SS (the income tax reform matches the SS
+                 revenue of the wealth tax reform)
+    reform SS    before reform TPI
+    baseline TPI before reform TPI (reforms use the baseline transfers)
+
+Runs whose dependencies are done are handed to an execution backend:
+LocalBackend runs them in separate processes on this machine, up to
+num_workers at a time, and SharedDirBackend puts them in a queue in a
+shared directory that workers on any number of machines take them from
+(run_worker()).  Failed runs can be retried.  A run is skipped if its
+run manifest (ogusa/manifest.py) records it as complete with the key
+it would run with now, i.e. with the same parameters, code and results
+of the runs it depends on.  Each
+run starts from the solution of the same policy at the closest value of
+sigma already solved.
+
+This py-file calls the following other file(s):
+            execute.py
+            ogusa/SS.py
+            ogusa/manifest.py
+------------------------------------------------------------------------
+'''
+
+# Packages
+import cPickle as pickle
+import errno
+import multiprocessing
+import os
+import socket
+import time
+
+'''
+------------------------------------------------------------------------
+    Experiment definitions
+------------------------------------------------------------------------
+POLICIES   = dictionary, for each policy the directory results are saved
+             under and the runner arguments
+STAGES     = tuple, stages of each experiment, in the order they are run
+QUEUE_DIRS = tuple, subdirectories of a SharedDirBackend queue
+------------------------------------------------------------------------
+'''
+POLICIES = {'baseline': {'dir': "./OUTPUT_BASELINE", 'baseline': True,
+                         'reform': 0, 'fix_transfers': False,
+                         'guid': 'baseline_sigma_'},
+            'wealth': {'dir': "./OUTPUT_WEALTH_REFORM", 'baseline': False,
+                       'reform': 2, 'fix_transfers': True,
+                       'guid': 'wealth_tax_reform2'},
+            'income': {'dir': "./OUTPUT_INCOME_REFORM", 'baseline': False,
+                       'reform': 1, 'fix_transfers': True,
+                       'guid': 'wealth_tax_reform1'}}
+STAGES = ('SS', 'TPI')
+QUEUE_DIRS = ('pending', 'running', 'done', 'failed')
+
+
+'''
+------------------------------------------------------------------------
+    Functions
+------------------------------------------------------------------------
+'''
+
+
+def node_dir(sigma, policy):
+    '''
+    Returns the directory the results of a policy at sigma are saved in.
+    '''
+    return POLICIES[policy]['dir'] + '/sigma' + str(sigma)
+
+
+def node_outputs(node):
+    '''
+    Returns the list of files written by a run.
+
+    Inputs:
+        node = length 3 tuple, (sigma, policy, stage)
+
+    Returns: list of file paths
+    '''
+    sigma, policy, stage = node
+    output_dir = node_dir(sigma, policy)
+    if stage == 'SS':
+        return [os.path.join(output_dir, 'SS', 'SS_vars.pkl'),
+                os.path.join(output_dir, 'run_parameters.pkl')]
+    return [os.path.join(output_dir, 'TPI', 'TPI_vars.pkl'),
+            os.path.join(output_dir, 'TPI', 'TPI_macro_vars.pkl')]
+
+
+def build_grid(sigma_list, policies=('baseline', 'wealth', 'income'),
+               stages=STAGES, decimals=8):
+    '''
+    Builds the graph of runs for a grid of experiments.  Runs needed by
+    the requested runs (e.g. the baseline SS of a reform) are added to
+    the graph.
+
+    Inputs:
+        sigma_list = list, values of sigma, duplicates are dropped
+        policies   = tuple, policies to run ('baseline', 'wealth',
+                     'income')
+        stages     = tuple, stages to run ('SS', 'TPI')
+        decimals   = integer, values of sigma equal to this many
+                     decimals are duplicates
+
+    Functions called: None
+
+    Objects in function:
+        requires = dictionary, runs each run depends on
+
+    Returns: dictionary, list of runs each run depends on, keyed by run
+             (sigma, policy, stage)
+    '''
+    def requires(node):
+        sigma, policy, stage = node
+        if stage == 'TPI':
+            deps = [(sigma, policy, 'SS')]
+            if policy != 'baseline':
+                deps.append((sigma, 'baseline', 'TPI'))
+        elif policy == 'baseline':
+            deps = []
+        elif policy == 'wealth':
+            deps = [(sigma, 'baseline', 'SS')]
+        else:
+            deps = [(sigma, 'baseline', 'SS'), (sigma, 'wealth', 'SS')]
+        return deps
+
+    graph = {}
+    to_add = [(round(sigma, decimals), policy, stage)
+              for sigma in sigma_list for policy in policies
+              for stage in stages]
+    while len(to_add) > 0:
+        node = to_add.pop()
+        if node not in graph:
+            graph[node] = requires(node)
+            to_add.extend(graph[node])
+
+    return graph
+
+
+def node_args(node, user_params={}):
+    '''
+    Returns the keyword arguments of the runner of a run.
+
+    Inputs:
+        node        = length 3 tuple, (sigma, policy, stage)
+        user_params = dictionary, parameters other than sigma passed to
+                      the runner
+
+    Returns: dictionary
+    '''
+    sigma, policy, stage = node
+    policy_args = POLICIES[policy]
+    params = {'frisch': 1.5}
+    params.update(user_params)
+    params['sigma'] = sigma
+    guid = policy_args['guid']
+    if policy == 'baseline':
+        guid += str(sigma)
+    return {'output_base': node_dir(sigma, policy),
+            'baseline_dir': node_dir(sigma, 'baseline'),
+            'baseline': policy_args['baseline'],
+            'reform': policy_args['reform'],
+            'fix_transfers': policy_args['fix_transfers'],
+            'user_params': params, 'guid': guid}
+
+
+def up_to_date(node, user_params={}):
+    '''
+    Returns True if the run manifest records the run as complete under
+    the key it would be run with now (see execute.stage_key).
+    '''
+    from execute import stage_key
+    from ogusa import manifest
+
+    kwargs = node_args(node, user_params)
+    key = stage_key(node[2], **kwargs)
+    if key is None:
+        return False
+    return manifest.is_complete(kwargs['output_base'], node[2], key)
+
+
+def nearest_solution(node):
+    '''
+    Loads the solution of the same policy and stage at the closest value
+    of sigma that has been solved, to start the run from.
+
+    Inputs:
+        node = length 3 tuple, (sigma, policy, stage)
+
+    Returns: dictionary, SS or TPI results, or None if there are none
+    '''
+    sigma, policy, stage = node
+    base_dir = POLICIES[policy]['dir']
+    if not os.path.isdir(base_dir):
+        return None
+    solved = []
+    for name in os.listdir(base_dir):
+        if not name.startswith('sigma'):
+            continue
+        try:
+            other = float(name[len('sigma'):])
+        except ValueError:
+            continue
+        if other != sigma and os.path.exists(
+                node_outputs((other, policy, stage))[0]):
+            solved.append(other)
+    if len(solved) == 0:
+        return None
+    other = min(solved, key=lambda x: abs(x - sigma))
+    print 'Starting ', node, ' from sigma = ', other
+    with open(node_outputs((other, policy, stage))[0], "rb") as f:
+        return pickle.load(f)
+
+
+def run_node(node, user_params={}):
+    '''
+    Runs one stage of one experiment: runner_SS for the SS stage and
+    runner (from the saved SS) for the TPI stage.
+
+    Inputs:
+        node        = length 3 tuple, (sigma, policy, stage)
+        user_params = dictionary, parameters other than sigma passed to
+                      the runner
+
+    Functions called:
+        node_args
+        nearest_solution
+        execute.runner_SS
+        execute.runner
+
+    Returns: None
+    '''
+    from execute import runner, runner_SS
+
+    sigma, policy, stage = node
+    kwargs = node_args(node, user_params)
+    kwargs['calibrate_model'] = False
+    guesses = nearest_solution(node)
+    if stage == 'SS':
+        if guesses is None and policy == 'baseline':
+            # no baseline solved yet, start from the default values
+            from ogusa import SS
+            guesses = SS.default_start_values()
+        runner_SS(ss_guesses=guesses, **kwargs)
+    else:
+        runner(tpi_guesses=guesses, run_ss=False, **kwargs)
+
+
+class LocalBackend(object):
+    '''
+    Runs each experiment in a separate process on this machine.
+
+    Attributes:
+        capacity = integer, number of runs at the same time
+    '''
+
+    def __init__(self, num_workers=None):
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        self.capacity = num_workers
+
+    def submit(self, node, user_params):
+        '''
+        Starts a run, returns a handle to poll.
+        '''
+        proc = multiprocessing.Process(target=run_node,
+                                       args=(node, user_params))
+        proc.start()
+        return proc
+
+    def poll(self, proc):
+        '''
+        Returns None while the run is going, then 'done' or 'failed'.
+        '''
+        if proc.is_alive():
+            return None
+        proc.join()
+        return 'done' if proc.exitcode == 0 else 'failed'
+
+
+class SharedDirBackend(object):
+    '''
+    Sends each experiment to worker processes, on this or other machines,
+    through a queue kept in a directory they all share (e.g. on NFS).
+    Workers are started with run_worker() (or
+    "python experiments.py worker queue_dir") from a directory where the
+    OUTPUT_* directories are shared, so results are saved in the same
+    place for every machine.
+
+    The queue is a set of subdirectories of queue_dir:
+        pending = runs waiting for a worker
+        running = runs claimed by a worker, by renaming the file from
+                  pending; while the run goes the worker rewrites a
+                  heartbeat file (the task file name + '.alive') with a
+                  count of its beats
+        done    = runs that finished
+        failed  = runs that raised an error or lost their worker
+
+    A claimed run whose heartbeat has not changed for stale_time seconds,
+    timed on the scheduler's own clock (so clock differences between
+    machines do not matter), is moved to failed.  A worker that finds its
+    run moved stops it, so a retry of the run does not run alongside it.
+
+    Attributes:
+        queue_dir     = string, directory of the queue
+        capacity      = integer, maximum number of runs queued at once
+        stale_time    = scalar, seconds after which a claimed run whose
+                        heartbeat did not change is taken to have lost
+                        its worker and failed
+        beats         = dictionary, last heartbeat seen of each claimed
+                        run and the time it was first seen
+    '''
+
+    def __init__(self, queue_dir, capacity=1000, stale_time=600.0):
+        self.queue_dir = queue_dir
+        self.capacity = capacity
+        self.stale_time = stale_time
+        self.n_submitted = 0
+        self.beats = {}
+        for name in QUEUE_DIRS:
+            try:
+                os.makedirs(os.path.join(queue_dir, name))
+            except OSError:
+                pass
+
+    def submit(self, node, user_params):
+        '''
+        Adds a run to the queue, returns the name of its task file.
+        '''
+        self.n_submitted += 1
+        task = '%s_%s_%s_%d_%d.pkl' % (node[1], str(node[0]), node[2],
+                                       os.getpid(), self.n_submitted)
+        path = os.path.join(self.queue_dir, 'pending', task)
+        with open(path + '.tmp', "wb") as f:
+            pickle.dump((node, user_params), f)
+        os.rename(path + '.tmp', path)
+        return task
+
+    def poll(self, task):
+        '''
+        Returns None while the run is queued or going, then 'done' or
+        'failed'.
+        '''
+        if os.path.exists(os.path.join(self.queue_dir, 'done', task)):
+            return 'done'
+        if os.path.exists(os.path.join(self.queue_dir, 'failed', task)):
+            return 'failed'
+        claimed = os.path.join(self.queue_dir, 'running', task)
+        try:
+            with open(claimed + '.alive', "r") as f:
+                beat = f.read()
+        except IOError:
+            beat = None
+        if not os.path.exists(claimed):
+            # not claimed yet
+            self.beats.pop(task, None)
+            return None
+        now = time.time()
+        if task not in self.beats or self.beats[task][0] != beat:
+            self.beats[task] = (beat, now)
+            return None
+        if now - self.beats[task][1] <= self.stale_time:
+            return None
+        print 'Lost the worker of ', task
+        try:
+            os.rename(claimed, os.path.join(self.queue_dir, 'failed', task))
+        except OSError:
+            # the worker finished it meanwhile
+            return None
+        del self.beats[task]
+        return 'failed'
+
+
+def write_heartbeat(path, beat):
+    '''
+    Writes the heartbeat file of a claimed run: the worker's host and
+    process id and a count of its beats.  The file is written to a
+    temporary file and then renamed, so it is never read half written.
+    '''
+    with open(path + '.alive.tmp', "w") as f:
+        f.write('%s %d %d\n' % (socket.gethostname(), os.getpid(), beat))
+    os.rename(path + '.alive.tmp', path + '.alive')
+
+
+def run_worker(queue_dir, poll_time=5.0, max_tasks=None, idle_time=None):
+    '''
+    Takes runs from a SharedDirBackend queue and runs them, one at a
+    time, each in a child process.  The heartbeat file of the run is
+    rewritten every poll_time seconds while the run goes so the scheduler
+    knows the worker is alive.  If the scheduler has taken the run to be
+    lost (its task file is no longer in running), the run is stopped.
+
+    Inputs:
+        queue_dir = string, directory of the queue
+        poll_time = scalar, seconds between checks of the queue
+        max_tasks = integer, stop after this many runs (None for no limit)
+        idle_time = scalar, stop after the queue has been empty for this
+                    many seconds (None to wait forever)
+
+    Functions called:
+        run_node
+        write_heartbeat
+
+    Returns: integer, number of runs done or failed (not counting runs
+             whose claim was lost)
+    '''
+    n_tasks = 0
+    idle_since = time.time()
+    while max_tasks is None or n_tasks < max_tasks:
+        pending = sorted(os.listdir(os.path.join(queue_dir, 'pending')))
+        pending = [task for task in pending if task.endswith('.pkl')]
+        claimed = None
+        for task in pending:
+            # renaming is atomic, only one worker can claim a run
+            try:
+                os.rename(os.path.join(queue_dir, 'pending', task),
+                          os.path.join(queue_dir, 'running', task))
+                claimed = task
+                break
+            except OSError as oe:
+                if oe.errno != errno.ENOENT:
+                    raise
+                # another worker claimed it first
+                continue
+        if claimed is None:
+            if idle_time is not None and time.time() - idle_since > idle_time:
+                break
+            time.sleep(poll_time)
+            continue
+
+        path = os.path.join(queue_dir, 'running', claimed)
+        with open(path, "rb") as f:
+            node, user_params = pickle.load(f)
+        print 'Worker ', os.getpid(), ' starting run: ', node
+        proc = multiprocessing.Process(target=run_node,
+                                       args=(node, user_params))
+        proc.start()
+        beat = 0
+        while proc.is_alive():
+            if not os.path.exists(path):
+                print 'Lost the claim on ', claimed, ', stopping the run'
+                proc.terminate()
+                proc.join()
+                break
+            beat += 1
+            write_heartbeat(path, beat)
+            proc.join(poll_time)
+        result = 'done' if proc.exitcode == 0 else 'failed'
+        try:
+            os.rename(path, os.path.join(queue_dir, result, claimed))
+            n_tasks += 1
+        except OSError:
+            print 'Lost the claim on ', claimed, ', not recorded as ', result
+        try:
+            os.remove(path + '.alive')
+        except OSError:
+            pass
+        idle_since = time.time()
+
+    return n_tasks
+
+
+def run_grid(graph, num_workers=None, user_params={}, force=False,
+             poll_time=1.0, backend=None, max_retries=0):
+    '''
+    Runs the graph of experiments, running independent runs at the same
+    time.  Runs that depend on a failed run are not started.
+
+    Inputs:
+        graph       = dictionary, from build_grid()
+        num_workers = integer, number of runs at the same time with the
+                      default backend (default is the number of CPUs)
+        user_params = dictionary, parameters passed to each run
+        force       = boolean, rerun runs that are up to date
+        poll_time   = scalar, seconds between checks on running runs
+        backend     = object with capacity, submit() and poll(), e.g.
+                      LocalBackend or SharedDirBackend (default is
+                      LocalBackend(num_workers))
+        max_retries = integer, number of times a failed run is retried
+
+    Functions called:
+        up_to_date
+
+    Objects in function:
+        status   = dictionary, status of each run ('pending', 'running',
+                   'done', 'skipped', 'failed' or 'blocked')
+        running  = dictionary, backend handle of each running run
+        attempts = dictionary, number of times each run was started
+
+    Returns: status
+    '''
+    if backend is None:
+        backend = LocalBackend(num_workers)
+    status = dict((node, 'pending') for node in graph)
+    attempts = dict((node, 0) for node in graph)
+    running = {}
+    finished = ('done', 'skipped')
+
+    while True:
+        # collect finished runs
+        for node, handle in running.items():
+            result = backend.poll(handle)
+            if result is None:
+                continue
+            del running[node]
+            if result == 'done':
+                status[node] = 'done'
+            elif attempts[node] <= max_retries:
+                print 'Run failed, retrying: ', node
+                status[node] = 'pending'
+            else:
+                status[node] = 'failed'
+                print 'Run failed: ', node
+
+        # runs that depend on a failed run can not be started
+        changed = True
+        while changed:
+            changed = False
+            for node in graph:
+                if status[node] == 'pending' and any(
+                        status[dep] in ('failed', 'blocked')
+                        for dep in graph[node]):
+                    status[node] = 'blocked'
+                    changed = True
+
+        # start runs whose dependencies are done, in order of sigma and
+        # stage so that nearby solutions are available for warm starts
+        ready = sorted(node for node in graph if status[node] == 'pending'
+                       and all(status[dep] in finished
+                               for dep in graph[node]))
+        for node in ready:
+            if not force and attempts[node] == 0 and up_to_date(
+                    node, user_params):
+                status[node] = 'skipped'
+                continue
+            if len(running) >= backend.capacity:
+                break
+            print 'Starting run: ', node
+            running[node] = backend.submit(node, user_params)
+            attempts[node] += 1
+            status[node] = 'running'
+
+        if len(running) == 0:
+            if not any(status[node] == 'pending' and all(
+                    status[dep] in finished for dep in graph[node])
+                    for node in graph):
+                break
+            continue
+        time.sleep(poll_time)
+
+    return status
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) >= 3 and sys.argv[1] == 'worker':
+        run_worker(sys.argv[2])
+    else:
+        print 'Usage: python experiments.py worker queue_dir'
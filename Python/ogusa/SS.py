@@ -9,6 +9,8 @@ This py-file calls the following other file(s):
             tax.py
             household.py
             firm.py
+            aggregates.py
+            revenue.py
             utils.py
             OUTPUT/SS/ss_vars.pkl
 
@@ -26,6 +28,7 @@ import cPickle as pickle
 from . import tax
 from . import household
 import firm
+import aggregates as aggr
 import utils
 import os
 
@@ -47,8 +50,15 @@ Grab some values from prior run to serve as starting values
 #START_VALUES = pickle.load(open("./ogusa/SS_vars_sigma2.0_wealth.pkl", "rb"))
 #START_VALUES = pickle.load(open("./ogusa/SS_vars_sigma3.0_baseline.pkl", "rb"))
 # START_VALUES = pickle.load(open("./OUTPUT_INCOME_REFORM/sigma2.0/SS/SS_vars.pkl", "rb"))
-START_VALUES = pickle.load(open("./OUTPUT_WEALTH_REFORM/sigma2.0/SS/SS_vars.pkl", "rb"))
 # START_VALUES = pickle.load(open("./OUTPUT_BASELINE/sigma2.0/SS/SS_vars.pkl", "rb"))
+START_VALUES_FILE = "./OUTPUT_WEALTH_REFORM/sigma2.0/SS/SS_vars.pkl"
+
+
+def default_start_values():
+    '''
+    Returns the starting values in START_VALUES_FILE.
+    '''
+    return utils.read_start_values(START_VALUES_FILE)
 
 
 '''
@@ -106,6 +116,8 @@ def create_steady_state_parameters(**sim_params):
                         of wealth tax function
     ellipse_params    = [2,] vector, vector with b_ellipse and upsilon
                         paramters of elliptical utility
+    agg_weights       = dictionary, population weight tensors from
+                        aggregates.get_weights()
     parameters        = length 3 tuple, ([15,] vector of general model
                         params, wealth_tax_params, ellipse_params)
     iterative_params  = [2,] vector, vector with max iterations and tolerance
@@ -128,13 +140,20 @@ def create_steady_state_parameters(**sim_params):
     wealth_tax_params = [sim_params['h_wealth'], sim_params['p_wealth'], sim_params['m_wealth']]
     ellipse_params = [sim_params['b_ellipse'], sim_params['upsilon']]
 
+    # Population weights used to aggregate household distributions are
+    # the same for every iteration, so build them once here
+    weights_params = (sim_params['omega_SS'], sim_params['lambdas'],
+                      sim_params['imm_rates'][-1,:], sim_params['rho'],
+                      sim_params['e'], sim_params['g_n_ss'], 'SS')
+    agg_weights = aggr.get_weights(weights_params)
+
     ss_params = [sim_params['J'], sim_params['S'], sim_params['T'], sim_params['BW'],
                   sim_params['beta'], sim_params['sigma'], sim_params['alpha'],
                   sim_params['Z'], sim_params['delta'], sim_params['ltilde'],
                   sim_params['nu'], sim_params['g_y'], sim_params['g_n_ss'],
                   sim_params['tau_payroll'], sim_params['tau_bq'], sim_params['rho'], sim_params['omega_SS'],
                   sim_params['lambdas'], sim_params['imm_rates'][-1,:], sim_params['e'], sim_params['retire'], sim_params['mean_income_data']] + \
-                  wealth_tax_params + ellipse_params
+                  wealth_tax_params + ellipse_params + [agg_weights]
     iterative_params = [sim_params['maxiter'], sim_params['mindist_SS']]
     chi_params = (sim_params['chi_b_guess'], sim_params['chi_n_guess'])
     return (income_tax_params, ss_params, iterative_params, chi_params)
@@ -169,10 +188,13 @@ def euler_equation_solver(guesses, params):
                        labor income function
     mtry_params     = [S,BW,#tax params] array, parameters for marginal tax rate on
                        capital income function
+    rr_coeffs       = length 3 tuple, parts of the replacement rate
+                       that do not depend on labor supply, from
+                       tax.replacement_rate_coeffs()
 
     OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
     household.get_BQ()
-    tax.replacement_rate_vals()
+    tax.get_replacement_rate()
     household.FOC_savings()
     household.FOC_labor()
     tax.total_taxes()
@@ -202,7 +224,7 @@ def euler_equation_solver(guesses, params):
                   h_wealth, p_wealth, m_wealth, b_ellipse, upsilon,\
                   j, chi_b, chi_n, tau_bq, rho, lambdas, omega_SS, e,\
                   analytical_mtrs, etr_params, mtrx_params,\
-                  mtry_params = params
+                  mtry_params, rr_coeffs = params
 
     b_guess = np.array(guesses[:S])
     n_guess = np.array(guesses[S:])
@@ -212,8 +234,7 @@ def euler_equation_solver(guesses, params):
 
     BQ_params = (omega_SS, lambdas[j], rho, g_n_ss, 'SS')
     BQ = household.get_BQ(r, b_splus1, BQ_params)
-    theta_params = (e[:,j], S, retire)
-    theta = tax.replacement_rate_vals(n_guess, w, factor, theta_params)
+    theta = tax.get_replacement_rate(n_guess, rr_coeffs)
 
     foc_save_parms = (e[:, j], sigma, beta, g_y, chi_b[j], theta,
                       tau_bq[j], rho, lambdas[j], j, J, S, analytical_mtrs,
@@ -279,15 +300,15 @@ def inner_loop(outer_loop_vars, params, baseline):
 
 
     Functions called:
+        tax.replacement_rate_coeffs()
         euler_equation_solver()
-        household.get_K()
-        firm.get_L()
+        aggregates.get_aggregates()
         firm.get_Y()
         firm.get_r()
         firm.get_w()
-        household.get_BQ()
+        aggregates.get_BQ()
         tax.replacement_rate_vals()
-        tax.get_lump_sum()
+        tax.get_tax_receipts()
 
     Objects in function:
 
@@ -303,7 +324,7 @@ def inner_loop(outer_loop_vars, params, baseline):
 
     J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
                   g_n_ss, tau_payroll, tau_bq, rho, omega_SS, lambdas, imm_rates, e, retire, mean_income_data,\
-                  h_wealth, p_wealth, m_wealth, b_ellipse, upsilon = ss_params
+                  h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, agg_weights = ss_params
 
     analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
     chi_b, chi_n = chi_params
@@ -322,13 +343,15 @@ def inner_loop(outer_loop_vars, params, baseline):
         #     guesses = np.append(bssmat[:, j-1], nssmat[:, j-1])
 
         guesses = np.append(bssmat[:, j], nssmat[:, j])
+        theta_params = (e[:, j], S, retire)
+        rr_coeffs = tax.replacement_rate_coeffs(w, factor, theta_params)
 
         euler_params = [r, w, T_H, factor, j, J, S, beta, sigma, ltilde, g_y,\
                   g_n_ss, tau_payroll, retire, mean_income_data,\
                   h_wealth, p_wealth, m_wealth, b_ellipse, upsilon,\
                   j, chi_b, chi_n, tau_bq, rho, lambdas, omega_SS, e,\
                   analytical_mtrs, etr_params, mtrx_params,\
-                  mtry_params]
+                  mtry_params, rr_coeffs]
 
         [solutions, infodict, ier, message] = opt.fsolve(euler_equation_solver, guesses * .9,
                                     args=euler_params, xtol=MINIMIZER_TOL, full_output=True)
@@ -336,10 +359,9 @@ def inner_loop(outer_loop_vars, params, baseline):
         euler_errors[:,j] = infodict['fvec']
         bssmat[:, j] = solutions[:S]
         nssmat[:, j] = solutions[S:]
-    K_params = (omega_SS.reshape(S, 1), lambdas.reshape(1, J), imm_rates, g_n_ss, 'SS')
-    K = household.get_K(bssmat, K_params)
-    L_params = (e, omega_SS.reshape(S, 1), lambdas.reshape(1, J), 'SS')
-    L = firm.get_L(nssmat, L_params)
+    aggs = aggr.get_aggregates(agg_weights, 'SS', b_splus1=bssmat, n=nssmat)
+    K = aggs['K']
+    L = aggs['L']
     Y_params = (alpha, Z)
     Y = firm.get_Y(K, L, Y_params)
     r_params = (alpha, delta)
@@ -347,21 +369,23 @@ def inner_loop(outer_loop_vars, params, baseline):
     new_w = firm.get_w(Y, L, alpha)
     b_s = np.array(list(np.zeros(J).reshape(1, J)) + list(bssmat[:-1, :]))
     average_income_model = ((new_r * b_s + new_w * e * nssmat) *
-                            omega_SS.reshape(S, 1) *
-                            lambdas.reshape(1, J)).sum()
+                            agg_weights['pop']).sum()
     if baseline:
         new_factor = mean_income_data / average_income_model
     else:
         new_factor = factor
 
-    BQ_params = (omega_SS.reshape(S, 1), lambdas.reshape(1, J), rho.reshape(S, 1), g_n_ss, 'SS')
-    new_BQ = household.get_BQ(new_r, bssmat, BQ_params)
+    new_BQ = aggr.get_BQ(new_r, aggs['bq_wealth'], 'SS')
     theta_params = (e, S, retire)
     theta = tax.replacement_rate_vals(nssmat, new_w, new_factor, theta_params)
 
-    T_H_params = (e, lambdas.reshape(1, J), omega_SS.reshape(S, 1), 'SS', etr_params, theta, tau_bq,
-                      tau_payroll, h_wealth, p_wealth, m_wealth, retire, T, S, J)
-    net_tax_receipts = tax.get_lump_sum(new_r, new_w, b_s, nssmat, new_BQ, factor, T_H_params)
+    receipts_params = (e, lambdas.reshape(1, J), 'SS', etr_params, theta,
+                       tau_bq, tau_payroll, h_wealth, p_wealth, m_wealth,
+                       retire, T, S, J)
+    receipts = tax.get_tax_receipts(new_r, new_w, b_s, nssmat, new_BQ,
+                                    factor, receipts_params)
+    net_tax_receipts = aggr.get_aggregates(agg_weights, 'SS',
+                                           revenue=receipts)['T_H']
 
     print 'Inner Loop Max Euler Error: ', (np.absolute(euler_errors)).max()
 
@@ -399,15 +423,14 @@ def SS_solver(b_guess_init, n_guess_init, rss, T_Hss, factor_ss,
 
 
     OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
-    euler_equation_solver()
-    household.get_K()
-    firm.get_L()
+    inner_loop()
+    aggregates.get_aggregates()
+    aggregates.get_I()
     firm.get_Y()
-    firm.get_r()
-    firm.get_w()
-    household.get_BQ()
+    firm.get_w_from_r()
     tax.replacement_rate_vals()
-    tax.get_lump_sum()
+    tax.total_taxes()
+    household.get_cons()
     utils.convex_combo()
     utils.pct_diff_func()
 
@@ -436,7 +459,7 @@ def SS_solver(b_guess_init, n_guess_init, rss, T_Hss, factor_ss,
 
     J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
                   g_n_ss, tau_payroll, tau_bq, rho, omega_SS, lambdas, imm_rates, e, retire, mean_income_data,\
-                  h_wealth, p_wealth, m_wealth, b_ellipse, upsilon = ss_params
+                  h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, agg_weights = ss_params
 
     analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
 
@@ -513,22 +536,22 @@ def SS_solver(b_guess_init, n_guess_init, rss, T_Hss, factor_ss,
     factor_ss = factor
     T_Hss = T_H
 
-    Kss_params = (omega_SS.reshape(S, 1), lambdas, imm_rates, g_n_ss, 'SS')
-    Kss = household.get_K(bssmat_splus1, Kss_params)
-    Lss_params = (e, omega_SS.reshape(S, 1), lambdas, 'SS')
-    Lss = firm.get_L(nssmat, Lss_params)
+    aggs = aggr.get_aggregates(agg_weights, 'SS', b_splus1=bssmat_splus1,
+                               n=nssmat)
+    Kss = aggs['K']
+    Lss = aggs['L']
     Yss_params = (alpha, Z)
     Yss = firm.get_Y(Kss, Lss, Yss_params)
-    Iss_params = (delta, g_y, omega_SS, lambdas, imm_rates, g_n_ss, 'SS')
-    Iss = firm.get_I(bssmat_splus1, Kss, Kss, Iss_params)
+    Iss_params = (delta, g_y, g_n_ss)
+    Iss = aggr.get_I(Kss, Kss, aggs['I_imm'], Iss_params)
 
     BQss = new_BQ
     theta_params = (e, S, retire)
     theta = tax.replacement_rate_vals(nssmat, wss, factor_ss, theta_params)
 
     # solve resource constraint
-    etr_params_3D = np.tile(np.reshape(etr_params,(S,1,etr_params.shape[1])),(1,J,1))
-    mtrx_params_3D = np.tile(np.reshape(mtrx_params,(S,1,mtrx_params.shape[1])),(1,J,1))
+    # a singleton J axis broadcasts the tax parameters across ability types
+    etr_params_3D = np.reshape(etr_params, (etr_params.shape[0], 1, etr_params.shape[1]))
     taxss_params = (e, lambdas, 'SS', retire, etr_params_3D,
                     h_wealth, p_wealth, m_wealth, tau_payroll, theta, tau_bq, J, S)
     taxss = tax.total_taxes(rss, wss, bssmat_s, nssmat, BQss, factor_ss, T_Hss, None, False, taxss_params)
@@ -536,8 +559,7 @@ def SS_solver(b_guess_init, n_guess_init, rss, T_Hss, factor_ss,
     cssmat = household.get_cons(rss, wss, bssmat_s, bssmat_splus1, nssmat, BQss.reshape(
         1, J), taxss, css_params)
 
-    Css_params = (omega_SS.reshape(S, 1), lambdas, 'SS')
-    Css = household.get_C(cssmat, Css_params)
+    Css = aggr.get_aggregates(agg_weights, 'SS', c=cssmat)['C']
     Gss = net_tax_receipts - T_Hss
 
     resource_constraint = Yss - (Css + Iss + Gss)
@@ -676,7 +698,7 @@ def SS_fsolve(guesses, params):
 
     J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
                   g_n_ss, tau_payroll, tau_bq, rho, omega_SS, lambdas, imm_rates, e, retire, mean_income_data,\
-                  h_wealth, p_wealth, m_wealth, b_ellipse, upsilon = ss_params
+                  h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, agg_weights = ss_params
 
     analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
 
@@ -771,7 +793,7 @@ def SS_fsolve_reform(guesses, params):
 
     J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
                   g_n_ss, tau_payroll, tau_bq, rho, omega_SS, lambdas, imm_rates, e, retire, mean_income_data,\
-                  h_wealth, p_wealth, m_wealth, b_ellipse, upsilon = ss_params
+                  h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, agg_weights = ss_params
 
     analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
 
@@ -845,7 +867,7 @@ def SS_fsolve_reform_fixed(guesses, params):
 
     J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
                   g_n_ss, tau_payroll, tau_bq, rho, omega_SS, lambdas, imm_rates, e, retire, mean_income_data,\
-                  h_wealth, p_wealth, m_wealth, b_ellipse, upsilon = ss_params
+                  h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, agg_weights = ss_params
 
     analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
 
@@ -882,9 +904,63 @@ def SS_fsolve_reform_fixed(guesses, params):
     return error1
 
 
+def load_SS_solution(output_dir):
+    '''
+    --------------------------------------------------------------------
+    Loads the SS solution saved in output_dir.  Meant to be called once
+    at the entry point of a run; the solution is then passed to
+    run_SS() in memory.
+    --------------------------------------------------------------------
+
+    INPUTS:
+    output_dir = string, path where SS results are saved
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION: None
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    ss_dir = string, path of the pickled SS results
+
+    RETURNS: dictionary, SS results
+
+    OUTPUT: None
+    --------------------------------------------------------------------
+    '''
+    ss_dir = os.path.join(output_dir, 'SS', 'SS_vars.pkl')
+    print('Loading SS results from ', ss_dir)
+    with open(ss_dir, "rb") as f:
+        return pickle.load(f)
+
+
+def save_SS_solution(output, output_dir):
+    '''
+    --------------------------------------------------------------------
+    Saves the SS solution to output_dir with the binary pickle protocol.
+    --------------------------------------------------------------------
+
+    INPUTS:
+    output     = dictionary, SS results
+    output_dir = string, path where SS results are saved
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
+    utils.mkdirs()
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    ss_dir = string, path of the pickled SS results
+
+    RETURNS: None
+
+    OUTPUT: output_dir/SS/SS_vars.pkl
+    --------------------------------------------------------------------
+    '''
+    utils.mkdirs(os.path.join(output_dir, 'SS'))
+    ss_dir = os.path.join(output_dir, 'SS', 'SS_vars.pkl')
+    with open(ss_dir, "wb") as f:
+        pickle.dump(output, f, pickle.HIGHEST_PROTOCOL)
+
 
 def run_SS(income_tax_params, ss_params, iterative_params, chi_params,
-           baseline, fix_transfers=False, baseline_dir="./OUTPUT"):
+           baseline, fix_transfers=False, baseline_dir="./OUTPUT",
+           initial_guesses=None, baseline_solution=None):
     '''
     --------------------------------------------------------------------
     Solve for SS of OG-USA.
@@ -900,14 +976,25 @@ def run_SS(income_tax_params, ss_params, iterative_params, chi_params,
     baseline = boolean, =True if run is for baseline tax policy
     calibrate_model = boolean, =True if run calibration of chi parameters
     output_dir = string, path to save output from current model run
-    baseline_dir = string, path where baseline results located
+    baseline_dir = string, path where baseline results located, only
+                   read if baseline_solution is not given
+    initial_guesses = dictionary, SS results (e.g. the solution at nearby
+                      parameter values) to start from, in place of the
+                      baseline SS results (baseline) or START_VALUES_FILE
+                      (reform)
+    baseline_solution = dictionary, baseline SS results, the starting
+                        point of a baseline run without initial_guesses
+                        and the source of factor_ss (and T_Hss with
+                        fix_transfers) in a reform run
 
 
     OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
     SS_fsolve()
+    load_SS_solution()
 
     OBJECTS CREATED WITHIN FUNCTION:
     chi_params = [J+S,] vector, chi_b and chi_n stacked together
+    guess_solution = dictionary, SS results used as starting values
     b_guess = [S,J] array, initial guess at savings
     n_guess = [S,J] array, initial guess at labor supply
     wguess = scalar, initial guess at SS real wage rate
@@ -925,7 +1012,7 @@ def run_SS(income_tax_params, ss_params, iterative_params, chi_params,
     '''
     J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
                   g_n_ss, tau_payroll, tau_bq, rho, omega_SS, lambdas, imm_rates, e, retire, mean_income_data,\
-                  h_wealth, p_wealth, m_wealth, b_ellipse, upsilon = ss_params
+                  h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, agg_weights = ss_params
 
     analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
 
@@ -933,18 +1020,23 @@ def run_SS(income_tax_params, ss_params, iterative_params, chi_params,
 
     maxiter, mindist_SS = iterative_params
 
-    # load baseline SS results
-    baseline_ss_dir = os.path.join(baseline_dir, 'SS', 'SS_vars.pkl')
-    print('Baseline directory = ', baseline_ss_dir)
-    base_ss_solutions = pickle.load(open(baseline_ss_dir, "rb"))
+    # load baseline SS results only if they are needed and were not
+    # passed in
+    if baseline_solution is None and (not baseline or initial_guesses is None):
+        baseline_solution = load_SS_solution(baseline_dir)
+    base_ss_solutions = baseline_solution
 
 
     if baseline:
-        b_guess = base_ss_solutions['bssmat_splus1'].flatten()
-        n_guess = base_ss_solutions['nssmat'].flatten()
-        rguess = base_ss_solutions['rss']
-        T_Hguess = base_ss_solutions['T_Hss']
-        factorguess = base_ss_solutions['factor_ss']
+        if initial_guesses is None:
+            guess_solution = base_ss_solutions
+        else:
+            guess_solution = initial_guesses
+        b_guess = guess_solution['bssmat_splus1'].flatten()
+        n_guess = guess_solution['nssmat'].flatten()
+        rguess = guess_solution['rss']
+        T_Hguess = guess_solution['T_Hss']
+        factorguess = guess_solution['factor_ss']
         print('Starting r: ', rguess)
         ss_params_baseline = [b_guess.reshape(S, J), n_guess.reshape(S, J), chi_params, ss_params, income_tax_params, iterative_params]
         guesses = [rguess, T_Hguess, factorguess]
@@ -963,10 +1055,14 @@ def run_SS(income_tax_params, ss_params, iterative_params, chi_params,
         output = SS_solver(b_guess.reshape(S, J), n_guess.reshape(S, J), rss, T_Hss, factor_ss, solution_params, baseline, fix_transfers, fsolve_flag)
     else:
         # [wguess, rguess, T_Hguess, factor] = [ss_solutions['wss'], ss_solutions['rss'], ss_solutions['T_Hss'], ss_solutions['factor_ss']]
-        b_guess = START_VALUES['bssmat_splus1'].flatten()
-        n_guess = START_VALUES['nssmat'].flatten()
-        rguess = START_VALUES['rss']
-        T_Hguess = START_VALUES['T_Hss']
+        if initial_guesses is None:
+            guess_solution = default_start_values()
+        else:
+            guess_solution = initial_guesses
+        b_guess = guess_solution['bssmat_splus1'].flatten()
+        n_guess = guess_solution['nssmat'].flatten()
+        rguess = guess_solution['rss']
+        T_Hguess = guess_solution['T_Hss']
         factor = base_ss_solutions['factor_ss']
         # wguess = 0.968167841907 #1.16
         # rguess = 0.086998690192 #.068
@@ -996,3 +1092,548 @@ def run_SS(income_tax_params, ss_params, iterative_params, chi_params,
         output = SS_solver(b_guess.reshape(S, J), n_guess.reshape(S, J), rss, T_Hss, factor, solution_params, baseline, fix_transfers, fsolve_flag)
 
     return output
+
+
+'''
+------------------------------------------------------------------------
+    Batched SS solve
+
+    Several scenarios (e.g. values of sigma or of the wealth tax
+    parameters) are solved at once.  The household problems of all
+    scenarios and ability types are the columns of [S,K*J] arrays
+    (column k*J + j is ability type j in scenario k), so the Euler
+    errors of all of them are computed in one call of the household and
+    tax functions, and the outer variables r, T_H and factor are [K,]
+    vectors updated together.  Scenarios that have converged drop out of
+    the iterations.
+------------------------------------------------------------------------
+'''
+
+'''
+SCENARIO_PARAMS = dictionary, parameters a scenario can set and their
+                  position in ss_params (d_income is the d parameter
+                  of the income tax functions)
+'''
+SCENARIO_PARAMS = {'sigma': 5, 'h_wealth': 22, 'p_wealth': 23,
+                   'm_wealth': 24, 'd_income': None}
+
+
+def set_scenario_params(scenario, income_tax_params, ss_params):
+    '''
+    Returns the income tax and SS parameters with the values set by a
+    scenario.  The parameters passed in are not changed.
+
+    Inputs:
+        scenario          = dictionary, parameter values keyed by name
+                            (see SCENARIO_PARAMS)
+        income_tax_params = length 4 tuple, (analytical_mtrs, etr_params,
+                            mtrx_params, mtry_params)
+        ss_params         = list, from create_steady_state_parameters()
+
+    Functions called:
+        revenue.set_income_tax_d
+
+    Returns: income_tax_params, ss_params
+    '''
+    import revenue
+    ss_params = list(ss_params)
+    for name, value in scenario.items():
+        if name not in SCENARIO_PARAMS:
+            raise ValueError("Unknown scenario parameter: " + name)
+        if name == 'd_income':
+            income_tax_params = revenue.set_income_tax_d(income_tax_params,
+                                                         value)
+        else:
+            ss_params[SCENARIO_PARAMS[name]] = value
+    return income_tax_params, ss_params
+
+
+def batch_household_params(scenario_params, chi_params):
+    '''
+    Stacks the parameters of the household problems of K scenarios into
+    columns.
+
+    Inputs:
+        scenario_params = list of K (income_tax_params, ss_params) tuples
+        chi_params      = length 2 tuple, (chi_b, chi_n)
+
+    Functions called: None
+
+    Objects in function:
+        cols  = dictionary, parameters that vary by column, each with
+                the column axis last (tax function parameters [S,K*J,#]
+                if they vary by scenario, else [S,1,#])
+        fixed = dictionary, parameters common to all columns
+
+    Returns: (cols, fixed)
+    '''
+    income_tax_params, ss_params = scenario_params[0]
+    J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
+        g_n_ss, tau_payroll, tau_bq, rho, omega_SS, lambdas, imm_rates, e, \
+        retire, mean_income_data, h_wealth, p_wealth, m_wealth, \
+        b_ellipse, upsilon, agg_weights = ss_params
+    chi_b, chi_n = chi_params
+    K = len(scenario_params)
+
+    def by_scenario(index):
+        # [K*J,] vector of a scalar parameter of each scenario
+        return np.repeat([float(params[1][index])
+                          for params in scenario_params], J)
+
+    cols = {'e': np.tile(e, (1, K)),
+            'sigma': by_scenario(5),
+            'h_wealth': by_scenario(22),
+            'p_wealth': by_scenario(23),
+            'm_wealth': by_scenario(24),
+            'chi_b': np.tile(chi_b, K),
+            'tau_bq': np.tile(tau_bq, K),
+            'lambdas': np.tile(lambdas, K)}
+    for i, name in ((1, 'etr_params'), (2, 'mtrx_params'),
+                    (3, 'mtry_params')):
+        tax_params = [params[0][i] for params in scenario_params]
+        if all(x is tax_params[0] or np.array_equal(x, tax_params[0])
+               for x in tax_params):
+            cols[name] = tax_params[0][:, np.newaxis, :]
+        else:
+            cols[name] = np.concatenate(
+                [np.repeat(x[:, np.newaxis, :], J, axis=1)
+                 for x in tax_params], axis=1)
+
+    fixed = {'J': J, 'S': S, 'beta': beta, 'g_y': g_y, 'g_n_ss': g_n_ss,
+             'ltilde': ltilde, 'b_ellipse': b_ellipse, 'upsilon': upsilon,
+             'tau_payroll': tau_payroll, 'retire': retire,
+             'analytical_mtrs': income_tax_params[0],
+             'chi_n': chi_n.reshape(S, 1), 'rho': rho.reshape(S, 1),
+             'omega_SS': omega_SS.reshape(S, 1)}
+    return cols, fixed
+
+
+def take_columns(cols, idx):
+    '''
+    Returns the column parameters for the columns in idx.
+    '''
+    taken = {}
+    for name, value in cols.items():
+        if name == 'rr_coeffs':
+            aime_wts, n_top, pia_scale = value
+            taken[name] = (aime_wts[:, idx], n_top, pia_scale[idx])
+        elif value.ndim == 3:
+            taken[name] = value if value.shape[1] == 1 else value[:, idx, :]
+        else:
+            taken[name] = value[..., idx]
+    return taken
+
+
+def euler_equation_solver_batch(b, n, cols, fixed):
+    '''
+    --------------------------------------------------------------------
+    Computes the Euler errors of the household problems in each column,
+    as euler_equation_solver() does for one ability type.
+    --------------------------------------------------------------------
+
+    INPUTS:
+    b     = [S,M] array, savings in each column
+    n     = [S,M] array, labor supply in each column
+    cols  = dictionary, column parameters (see batch_household_params()),
+            including the prices r, w, T_H, factor and the replacement
+            rate coefficients rr_coeffs of each column
+    fixed = dictionary, parameters common to all columns
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
+    household.get_BQ()
+    tax.get_replacement_rate()
+    household.FOC_savings()
+    household.FOC_labor()
+    tax.total_taxes()
+    household.get_cons()
+
+    RETURNS: error1, error2 ([S,M] arrays, Euler errors from the FOC for
+             savings and labor supply)
+    --------------------------------------------------------------------
+    '''
+    S, J = fixed['S'], fixed['J']
+    r, w, T_H, factor = cols['r'], cols['w'], cols['T_H'], cols['factor']
+    e, sigma, lambdas = cols['e'], cols['sigma'], cols['lambdas']
+    chi_b, tau_bq = cols['chi_b'], cols['tau_bq']
+    h_wealth, p_wealth, m_wealth = (cols['h_wealth'], cols['p_wealth'],
+                                    cols['m_wealth'])
+    etr_params, mtrx_params, mtry_params = (cols['etr_params'],
+                                            cols['mtrx_params'],
+                                            cols['mtry_params'])
+    rho = fixed['rho']
+
+    zeros = np.zeros((1, b.shape[1]))
+    b_s = np.append(zeros, b[:-1], axis=0)
+    b_splus1 = b
+    b_splus2 = np.append(b[1:], zeros, axis=0)
+
+    BQ_params = (fixed['omega_SS'], lambdas, rho, fixed['g_n_ss'], 'SS')
+    BQ = household.get_BQ(r, b_splus1, BQ_params)
+    theta = tax.get_replacement_rate(n, cols['rr_coeffs'])
+
+    foc_save_parms = (e, sigma, fixed['beta'], fixed['g_y'], chi_b, theta,
+                      tau_bq, rho, lambdas, None, J, S,
+                      fixed['analytical_mtrs'], etr_params, mtry_params,
+                      h_wealth, p_wealth, m_wealth, fixed['tau_payroll'],
+                      fixed['retire'], 'SS')
+    error1 = household.FOC_savings(r, w, b_s, b_splus1, b_splus2, n, BQ,
+                                   factor, T_H, foc_save_parms)
+    foc_labor_params = (e, sigma, fixed['g_y'], theta, fixed['b_ellipse'],
+                        fixed['upsilon'], fixed['chi_n'], fixed['ltilde'],
+                        tau_bq, lambdas, None, J, S,
+                        fixed['analytical_mtrs'], etr_params, mtrx_params,
+                        h_wealth, p_wealth, m_wealth, fixed['tau_payroll'],
+                        fixed['retire'], 'SS')
+    error2 = household.FOC_labor(r, w, b_s, b_splus1, n, BQ, factor, T_H,
+                                 foc_labor_params)
+
+    # same constraints as in euler_equation_solver()
+    error2[(n < 0) | (n > fixed['ltilde']) | np.isnan(n)] = 1e14
+    error1[(b <= 0) | np.isnan(b)] = 1e14
+
+    tax1_params = (e, lambdas, 'SS', fixed['retire'], etr_params, h_wealth,
+                   p_wealth, m_wealth, fixed['tau_payroll'], theta, tau_bq,
+                   J, S)
+    tax1 = tax.total_taxes(r, w, b_s, n, BQ, factor, T_H, None, False,
+                           tax1_params)
+    cons_params = (e, lambdas, fixed['g_y'])
+    cons = household.get_cons(r, w, b_s, b_splus1, n, BQ, tax1, cons_params)
+    error1[cons < 0] = 1e14
+
+    return error1, error2
+
+
+def solve_households_batch(bssmat, nssmat, cols, fixed, jac=None,
+                           tol=MINIMIZER_TOL, max_iter=100):
+    '''
+    --------------------------------------------------------------------
+    Solves the household problems in all columns at once with Newton's
+    method.  The Jacobian of each column's 2S Euler errors is found by
+    forward differences, one evaluation of all columns per unknown, and
+    is reused for later steps (and, if passed back in, for the next
+    prices) until a step fails to halve the errors of the column.  Steps
+    with a new Jacobian that do not reduce the errors are halved.
+    Columns that have converged are not evaluated again, and columns
+    Newton's method cannot solve are passed to fsolve.
+    --------------------------------------------------------------------
+
+    INPUTS:
+    bssmat   = [S,M] array, initial guess for savings
+    nssmat   = [S,M] array, initial guess for labor supply
+    cols     = dictionary, column parameters and prices
+    fixed    = dictionary, parameters common to all columns
+    jac      = [M,2S,2S] array, Jacobians from an earlier solve, or None
+    tol      = scalar, tolerance on the largest Euler error of a column
+    max_iter = integer, maximum number of Newton steps
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
+    euler_equation_solver_batch()
+    take_columns()
+    scipy.optimize.fsolve()
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    x      = [2S,M] array, b and n stacked
+    F      = [2S,M] array, Euler errors
+    active = [M_active,] vector, columns not yet converged
+    stale  = [M,] boolean vector, columns whose Jacobian is recomputed
+             before the next step
+    new    = [M,] boolean vector, columns whose Jacobian was computed at
+             the current guess
+
+    RETURNS: bssmat, nssmat, euler_errors ([2S,M] array), jac
+    --------------------------------------------------------------------
+    '''
+    S = fixed['S']
+    M = bssmat.shape[1]
+
+    def errors(x, idx):
+        # marg_ut_cons() squeezes its output, so a single column is
+        # evaluated twice to keep the [S,M] shapes
+        sub = take_columns(cols, np.append(idx, idx[:1]) if len(idx) == 1
+                           else idx)
+        xx = x if len(idx) > 1 else np.append(x, x, axis=1)
+        error1, error2 = euler_equation_solver_batch(xx[:S], xx[S:], sub,
+                                                     fixed)
+        return np.append(error1, error2, axis=0)[:, :len(idx)]
+
+    x = np.append(bssmat, nssmat, axis=0)
+    F = errors(x, np.arange(M))
+    if jac is None:
+        jac = np.zeros((M, 2 * S, 2 * S))
+        stale = np.ones(M, dtype=bool)
+    else:
+        jac = jac.copy()
+        stale = np.isnan(jac).any(axis=(1, 2))
+    failed = np.zeros(M, dtype=bool)
+    for iteration in xrange(max_iter):
+        active = np.nonzero((np.absolute(F).max(axis=0) > tol) &
+                            ~failed)[0]
+        if len(active) == 0:
+            break
+        # forward difference Jacobians of the columns that need one
+        new = np.zeros(M, dtype=bool)
+        update = active[stale[active]]
+        if len(update) > 0:
+            xu = x[:, update]
+            Fu = F[:, update]
+            for i in xrange(2 * S):
+                h = 1.49e-8 * np.maximum(np.absolute(xu[i]), 1.0)
+                xh = xu.copy()
+                xh[i] += h
+                jac[update, :, i] = ((errors(xh, update) - Fu) / h).T
+            stale[update] = False
+            new[update] = True
+
+        xa = x[:, active]
+        Fa = F[:, active]
+        try:
+            dx = np.linalg.solve(jac[active],
+                                 -Fa.T[:, :, np.newaxis])[:, :, 0].T
+        except np.linalg.LinAlgError:
+            # a singular Jacobian in some column, use least squares
+            dx = np.array([np.linalg.lstsq(jac[m], -Fa[:, i], rcond=-1)[0]
+                           for i, m in enumerate(active)]).T
+        norm = np.absolute(Fa).max(axis=0)
+        x_new = xa + dx
+        F_new = errors(x_new, active)
+        norm_new = np.absolute(F_new).max(axis=0)
+        better = norm_new < norm
+        xa[:, better] = x_new[:, better]
+        Fa[:, better] = F_new[:, better]
+        # an old Jacobian is recomputed once it stops halving the errors
+        stale[active[~new[active] & (norm_new > 0.5 * norm)]] = True
+
+        # halve the step in the columns where the errors do not fall
+        # with a new Jacobian
+        todo = np.nonzero(~better & new[active])[0]
+        step = 1.0
+        for halving in xrange(20):
+            if len(todo) == 0:
+                break
+            step /= 2.0
+            x_new = xa[:, todo] + step * dx[:, todo]
+            F_new = errors(x_new, active[todo])
+            better = np.absolute(F_new).max(axis=0) < norm[todo]
+            xa[:, todo[better]] = x_new[:, better]
+            Fa[:, todo[better]] = F_new[:, better]
+            todo = todo[~better]
+        # no step improves these columns
+        failed[active[todo]] = True
+        x[:, active] = xa
+        F[:, active] = Fa
+
+    # columns Newton's method left far from a solution (e.g. from a
+    # guess that violates the constraints) are solved one at a time as
+    # in inner_loop()
+    for m in np.nonzero(np.absolute(F).max(axis=0) > np.sqrt(tol))[0]:
+        guesses = np.append(bssmat[:, m], nssmat[:, m]) * .9
+        solution, infodict, ier, message = opt.fsolve(
+            lambda x_m: errors(x_m.reshape(2 * S, 1), np.array([m]))[:, 0],
+            guesses, xtol=MINIMIZER_TOL, full_output=True)
+        if np.absolute(infodict['fvec']).max() < np.absolute(F[:, m]).max():
+            x[:, m] = solution
+            F[:, m] = infodict['fvec']
+        stale[m] = True
+    # do not pass on Jacobians that were not computed near the solution
+    jac[stale] = np.nan
+
+    return x[:S], x[S:], F, jac
+
+
+def run_SS_batch(scenarios, income_tax_params, ss_params, iterative_params,
+                 chi_params, baseline, fix_transfers=False,
+                 baseline_dir="./OUTPUT", initial_guesses=None,
+                 baseline_solution=None):
+    '''
+    --------------------------------------------------------------------
+    Solves the SS of K scenarios at once.  The outer variables are
+    updated as in SS_solver() (a damped fixed point, r, T_H and factor
+    as [K,] vectors), the household problems of all scenarios are
+    solved together by solve_households_batch(), and scenarios drop out
+    once their distance is below mindist_SS.  The full SS results of
+    each scenario are then computed by SS_solver() from the converged
+    values.  Scenarios with a bracket wealth tax (a table in place of
+    p_wealth) can not be stacked, so if any scenario has one, each
+    scenario is solved by run_SS() instead.
+    --------------------------------------------------------------------
+
+    INPUTS:
+    scenarios         = list of K dictionaries, parameter values of each
+                        scenario (see SCENARIO_PARAMS)
+    income_tax_params = length 4 tuple, (analytical_mtrs, etr_params,
+                        mtrx_params, mtry_params)
+    ss_params         = list, from create_steady_state_parameters()
+    iterative_params  = [2,] vector, maximum iterations and tolerance
+    chi_params        = length 2 tuple, (chi_b, chi_n)
+    baseline          = boolean, =True if run is for baseline tax policy
+    fix_transfers     = boolean, =True if reform transfers are fixed at
+                        their baseline value
+    baseline_dir      = string, path where baseline results located,
+                        only read if baseline_solution is not given
+    initial_guesses   = dictionary, SS results to start every scenario
+                        from, or list of K dictionaries
+    baseline_solution = dictionary, baseline SS results
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
+    set_scenario_params()
+    run_SS()
+    batch_household_params()
+    solve_households_batch()
+    SS_solver()
+    load_SS_solution()
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    b, n   = [S,K*J] arrays, savings and labor supply of all columns
+    r, T_H, factor = [K,] vectors, outer variables of each scenario
+    jac    = [K*J,2S,2S] array, Jacobians of the household problems
+    dist   = [K,] vector, distance between iterations of each scenario
+    active = [K,] boolean vector, scenarios not yet converged
+
+    RETURNS: list of K dictionaries, SS results of each scenario (as
+             from run_SS())
+    --------------------------------------------------------------------
+    '''
+    J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
+        g_n_ss, tau_payroll, tau_bq, rho, omega_SS, lambdas, imm_rates, e, \
+        retire, mean_income_data, h_wealth, p_wealth, m_wealth, \
+        b_ellipse, upsilon, agg_weights = ss_params
+    maxiter, mindist_SS = iterative_params
+    K = len(scenarios)
+
+    if baseline_solution is None and (not baseline or initial_guesses is None):
+        baseline_solution = load_SS_solution(baseline_dir)
+    if initial_guesses is None:
+        initial_guesses = baseline_solution if baseline else default_start_values()
+    if isinstance(initial_guesses, dict):
+        initial_guesses = [initial_guesses] * K
+
+    scenario_params = [set_scenario_params(scenario, income_tax_params,
+                                           ss_params)
+                       for scenario in scenarios]
+    if any(np.ndim(params[1][23]) > 0 for params in scenario_params):
+        return [run_SS(income_tax_params_k, ss_params_k, iterative_params,
+                       chi_params, baseline, fix_transfers=fix_transfers,
+                       baseline_dir=baseline_dir, initial_guesses=guess,
+                       baseline_solution=baseline_solution)
+                for (income_tax_params_k, ss_params_k), guess
+                in zip(scenario_params, initial_guesses)]
+    cols, fixed = batch_household_params(scenario_params, chi_params)
+
+    b = np.concatenate([np.array(guess['bssmat_splus1'], dtype=float)
+                        for guess in initial_guesses], axis=1)
+    n = np.concatenate([np.array(guess['nssmat'], dtype=float)
+                        for guess in initial_guesses], axis=1)
+    r = np.array([float(guess['rss']) for guess in initial_guesses])
+    if baseline:
+        T_H = np.array([guess['T_Hss'] for guess in initial_guesses])
+        factor = np.array([guess['factor_ss'] for guess in initial_guesses])
+    else:
+        factor = np.ones(K) * baseline_solution['factor_ss']
+        if fix_transfers:
+            T_H = np.ones(K) * baseline_solution['T_Hss']
+        else:
+            T_H = np.array([guess['T_Hss'] for guess in initial_guesses])
+
+    # the population weights are the same in every scenario, the
+    # scenario axis takes the place of time in the TPI aggregation
+    batch_weights = {'pop': np.broadcast_to(agg_weights['pop'], (K, S, J)),
+                     'L': np.broadcast_to(agg_weights['L'], (K, S, J)),
+                     'b': np.broadcast_to(agg_weights['b'][:, np.newaxis],
+                                          (3, K, S, J))}
+
+    # Jacobians of the household problems, reused between iterations
+    jac = np.nan * np.ones((K * J, 2 * S, 2 * S))
+    nu = np.ones(K) * nu
+    dist = np.ones(K) * 10.0
+    dist_prev = dist.copy()
+    active = np.ones(K, dtype=bool)
+    iteration = 0
+    while active.any() and iteration < maxiter:
+        ks = np.nonzero(active)[0]
+        idx = (ks[:, np.newaxis] * J + np.arange(J)).flatten()
+        w = firm.get_w_from_r(r[ks], (Z, alpha, delta))
+
+        # prices of each column
+        sub = take_columns(cols, idx)
+        sub['r'] = np.repeat(r[ks], J)
+        sub['w'] = np.repeat(w, J)
+        sub['T_H'] = np.repeat(T_H[ks], J)
+        sub['factor'] = np.repeat(factor[ks], J)
+        sub['rr_coeffs'] = tax.replacement_rate_coeffs(
+            sub['w'], sub['factor'], (sub['e'], S, retire))
+        b[:, idx], n[:, idx], euler_errors, jac[idx] = \
+            solve_households_batch(b[:, idx], n[:, idx], sub, fixed,
+                                   jac=jac[idx])
+
+        # aggregates of each scenario
+        b_k = b[:, idx].reshape(S, len(ks), J).transpose(1, 0, 2)
+        n_k = n[:, idx].reshape(S, len(ks), J).transpose(1, 0, 2)
+        weights = {'pop': batch_weights['pop'][:len(ks)],
+                   'L': batch_weights['L'][:len(ks)],
+                   'b': batch_weights['b'][:, :len(ks)]}
+        aggs = aggr.get_aggregates(weights, 'TPI', b_splus1=b_k, n=n_k)
+        Y = firm.get_Y(aggs['K'], aggs['L'], (alpha, Z))
+        new_r = firm.get_r(Y, aggs['K'], (alpha, delta))
+        new_w = firm.get_w(Y, aggs['L'], alpha)
+        b_s = np.append(np.zeros((1, len(idx))), b[:-1, idx], axis=0)
+        average_income_model = ((np.repeat(new_r, J) * b_s +
+                                 np.repeat(new_w, J) * sub['e'] *
+                                 n[:, idx]) * np.tile(agg_weights['pop'],
+                                                      (1, len(ks)))
+                                ).reshape(S, len(ks), J).sum(axis=(0, 2))
+        if baseline:
+            new_factor = mean_income_data / average_income_model
+        else:
+            new_factor = factor[ks]
+        new_BQ = aggr.get_BQ(new_r, aggs['bq_wealth'], 'TPI').flatten()
+        theta = tax.replacement_rate_vals(n[:, idx], np.repeat(new_w, J),
+                                          np.repeat(new_factor, J),
+                                          (sub['e'], S, retire))
+        receipts_params = (sub['e'], sub['lambdas'].reshape(1, -1), 'SS',
+                           sub['etr_params'], theta, sub['tau_bq'],
+                           tau_payroll, sub['h_wealth'], sub['p_wealth'],
+                           sub['m_wealth'], retire, T, S, J)
+        receipts = tax.get_tax_receipts(np.repeat(new_r, J),
+                                        np.repeat(new_w, J), b_s, n[:, idx],
+                                        new_BQ, np.repeat(factor[ks], J),
+                                        receipts_params)
+        net_tax_receipts = (receipts * np.tile(agg_weights['pop'],
+                                               (1, len(ks)))
+                            ).reshape(S, len(ks), J).sum(axis=(0, 2))
+        if fix_transfers:
+            new_T_H = T_H[ks]
+        else:
+            new_T_H = net_tax_receipts
+
+        # damped update of the outer variables of each scenario
+        r[ks] = utils.convex_combo(new_r, r[ks], nu[ks])
+        factor[ks] = utils.convex_combo(new_factor, factor[ks], nu[ks])
+        T_H[ks] = utils.convex_combo(new_T_H, T_H[ks], nu[ks])
+        diff_T_H = np.where(T_H[ks] != 0,
+                            utils.pct_diff_func(new_T_H, T_H[ks]),
+                            np.absolute(new_T_H - T_H[ks]))
+        dist[ks] = np.maximum(np.maximum(utils.pct_diff_func(new_r, r[ks]),
+                                         diff_T_H),
+                              utils.pct_diff_func(new_factor, factor[ks]))
+        # as in SS_solver(), damp more if the distance increases
+        if iteration > 10:
+            nu[ks] = np.where(dist[ks] > dist_prev[ks], nu[ks] / 2.0,
+                              nu[ks])
+        dist_prev[ks] = dist[ks]
+        active[ks] = dist[ks] > mindist_SS
+        iteration += 1
+        print "SS Batch Iteration: %02d" % iteration, " Scenarios left: ", \
+            active.sum(), " Max distance: ", dist[ks].max()
+
+    # full SS results of each scenario from the converged values
+    output = []
+    for k in xrange(K):
+        income_tax_params_k, ss_params_k = scenario_params[k]
+        b_k = b[:, k * J:(k + 1) * J].copy()
+        n_k = n[:, k * J:(k + 1) * J].copy()
+        solution_params = [b_k, n_k, chi_params, ss_params_k,
+                           income_tax_params_k, iterative_params]
+        output.append(SS_solver(b_k, n_k, r[k], T_H[k], factor[k],
+                                solution_params, baseline, fix_transfers,
+                                fsolve_flag=True))
+    return output
@@ -21,7 +21,6 @@ This py-file creates the following other file(s):
 # Packages
 import numpy as np
 import scipy.optimize as opt
-import cPickle as pickle
 
 from . import tax
 from . import household
@@ -49,7 +48,14 @@ Grab some values from prior run to serve as starting values
 #START_VALUES = pickle.load(open("./OUTPUT_INCOME_REFORM/sigma2.0/SS/SS_vars.pkl", "rb"))
 #START_VALUES = pickle.load(open("./OUTPUT_WEALTH_REFORM/sigma3.0/SS/SS_vars.pkl", "rb"))
 # START_VALUES = pickle.load(open("./OUTPUT_BASELINE/SS/SS_vars.pkl", "rb"))
-START_VALUES = pickle.load(open("./OUTPUT_BASELINE/sigma2.0/SS/SS_vars.pkl", "rb"))
+START_VALUES_FILE = "./OUTPUT_BASELINE/sigma2.0/SS/SS_vars.pkl"
+
+
+def default_start_values():
+    '''
+    Returns the starting values in START_VALUES_FILE.
+    '''
+    return utils.read_start_values(START_VALUES_FILE)
 
 
 '''
@@ -592,8 +598,8 @@ def SS_solver(b_guess_init, n_guess_init, wss, rss, T_Hss, BQss, factor_ss, para
     # theta = tax.replacement_rate_vals(nssmat, wss, factor_ss, theta_params)
 
     # solve resource constraint
-    etr_params_3D = np.tile(np.reshape(etr_params,(S,1,etr_params.shape[1])),(1,J,1))
-    mtrx_params_3D = np.tile(np.reshape(mtrx_params,(S,1,mtrx_params.shape[1])),(1,J,1))
+    # a singleton J axis broadcasts the tax parameters across ability types
+    etr_params_3D = np.reshape(etr_params, (etr_params.shape[0], 1, etr_params.shape[1]))
     taxss_params = (e, lambdas, 'SS', retire, etr_params_3D,
                     h_wealth, p_wealth, m_wealth, tau_payroll, theta, tau_bq, J, S)
     taxss = tax.total_taxes(rss, wss, bssmat_s, nssmat, BQss, factor_ss, T_Hss, None, False, taxss_params)
@@ -908,6 +914,7 @@ def run_SS(income_tax_params, ss_params, iterative_params, chi_params, baseline=
 
     # b_guess = np.ones((S, J)).flatten() * 0.05
     # n_guess = np.ones((S, J)).flatten() * .4 * ltilde
+    START_VALUES = default_start_values()
     b_guess = START_VALUES['bssmat_splus1']
     n_guess = START_VALUES['nssmat']
     # For initial guesses of w, r, T_H, and factor, we use values that are close
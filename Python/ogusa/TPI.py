@@ -34,9 +34,17 @@ import tax
 import utils
 import household
 import firm
+import aggregates as aggr
 import os
 
-TPI_START_VALUES = pickle.load(open("./OUTPUT_INCOME_REFORM/sigma2.0/TPI/TPI_vars.pkl", "rb"))
+TPI_START_VALUES_FILE = "./OUTPUT_INCOME_REFORM/sigma2.0/TPI/TPI_vars.pkl"
+
+
+def default_start_values():
+    '''
+    Returns the starting values in TPI_START_VALUES_FILE.
+    '''
+    return utils.read_start_values(TPI_START_VALUES_FILE)
 
 '''
 Set minimizer tolerance
@@ -105,6 +113,14 @@ def create_tpi_params(**sim_params):
     theta_params = (sim_params['e'], sim_params['S'], sim_params['retire'])
     theta = tax.replacement_rate_vals(nssmat, wss, factor, theta_params)
 
+    # Population weights used to aggregate household distributions are
+    # the same for every TPI iteration, so build them once here
+    weights_params = (sim_params['omega'], sim_params['omega_S_preTP'],
+                      sim_params['lambdas'], sim_params['imm_rates'],
+                      sim_params['rho'], sim_params['e'],
+                      sim_params['g_n_vector'], sim_params['T'], 'TPI')
+    agg_weights = aggr.get_weights(weights_params)
+
     tpi_params = [sim_params['J'], sim_params['S'], sim_params['T'], sim_params['BW'],
                   sim_params['beta'], sim_params['sigma'], sim_params['alpha'],
                   sim_params['Z'], sim_params['delta'], sim_params['ltilde'],
@@ -112,26 +128,19 @@ def create_tpi_params(**sim_params):
                   sim_params['tau_payroll'], sim_params['tau_bq'], sim_params['rho'], sim_params['omega'], N_tilde,
                   sim_params['lambdas'], sim_params['imm_rates'], sim_params['e'],
                   sim_params['retire'], sim_params['mean_income_data'], factor, T_H_baseline] + \
-                  wealth_tax_params + ellipse_params + chi_params + [theta]
+                  wealth_tax_params + ellipse_params + chi_params + [theta, agg_weights]
     iterative_params = [sim_params['maxiter'], sim_params['mindist_SS'], sim_params['mindist_TPI']]
 
     J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
                   g_n_vector, tau_payroll, tau_bq, rho, omega, N_tilde, lambdas, imm_rates, e, retire, mean_income_data,\
-                  factor, T_H_baseline, h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, chi_b, chi_n, theta = tpi_params
+                  factor, T_H_baseline, h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, chi_b, chi_n, theta, agg_weights = tpi_params
 
     ## Assumption for tax functions is that policy in last year of BW is
-    # extended permanently
-    etr_params_TP = np.zeros((S,T+S,sim_params['etr_params'].shape[2]))
-    etr_params_TP[:,:BW,:] = sim_params['etr_params']
-    etr_params_TP[:,BW:,:] = np.reshape(sim_params['etr_params'][:,BW-1,:],(S,1,sim_params['etr_params'].shape[2]))
-
-    mtrx_params_TP = np.zeros((S,T+S,sim_params['mtrx_params'].shape[2]))
-    mtrx_params_TP[:,:BW,:] = sim_params['mtrx_params']
-    mtrx_params_TP[:,BW:,:] = np.reshape(sim_params['mtrx_params'][:,BW-1,:],(S,1,sim_params['mtrx_params'].shape[2]))
-
-    mtry_params_TP = np.zeros((S,T+S,sim_params['mtry_params'].shape[2]))
-    mtry_params_TP[:,:BW,:] = sim_params['mtry_params']
-    mtry_params_TP[:,BW:,:] = np.reshape(sim_params['mtry_params'][:,BW-1,:],(S,1,sim_params['mtry_params'].shape[2]))
+    # extended permanently.  Parameters that don't vary by year are left
+    # with a singleton year axis.
+    etr_params_TP = tax.extend_tax_params(sim_params['etr_params'], T+S)
+    mtrx_params_TP = tax.extend_tax_params(sim_params['mtrx_params'], T+S)
+    mtry_params_TP = tax.extend_tax_params(sim_params['mtry_params'], T+S)
 
     income_tax_params = (sim_params['analytical_mtrs'], etr_params_TP, mtrx_params_TP, mtry_params_TP)
 
@@ -183,7 +192,7 @@ def firstdoughnutring(guesses, r, w, b, BQ, T_H, j, params):
     analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
     J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
                   g_n_vector, tau_payroll, tau_bq, rho, omega, N_tilde, lambdas, imm_rates, e, retire, mean_income_data,\
-                  factor, T_H_baseline, h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, chi_b, chi_n, theta = tpi_params
+                  factor, T_H_baseline, h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, chi_b, chi_n, theta, agg_weights = tpi_params
 
 
     b_splus1 = float(guesses[0])
@@ -271,7 +280,7 @@ def twist_doughnut(guesses, r, w, BQ, T_H, j, s, t, params):
     analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
     J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
                   g_n_vector, tau_payroll, tau_bq, rho, omega, N_tilde, lambdas, imm_rates, e, retire, mean_income_data,\
-                  factor, T_H_baseline, h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, chi_b, chi_n, theta = tpi_params
+                  factor, T_H_baseline, h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, chi_b, chi_n, theta, agg_weights = tpi_params
 
     length = len(guesses) / 2
     b_guess = np.array(guesses[:length])
@@ -369,7 +378,7 @@ def inner_loop(guesses, outer_loop_vars, params):
     analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
     J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
                   g_n_vector, tau_payroll, tau_bq, rho, omega, N_tilde, lambdas, imm_rates, e, retire, mean_income_data,\
-                  factor, T_H_baseline, h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, chi_b, chi_n, theta = tpi_params
+                  factor, T_H_baseline, h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, chi_b, chi_n, theta, agg_weights = tpi_params
     K0, b_sinit, b_splus1init, factor, initial_b, initial_n, omega_S_preTP = initial_values
 
     guesses_b, guesses_n = guesses
@@ -405,15 +414,12 @@ def inner_loop(guesses, outer_loop_vars, params):
         for s in xrange(S - 2):  # Upper triangle
             ind2 = np.arange(s + 2)
 
-            # initialize array of diagonal elements
-            length_diag = (np.diag(np.transpose(etr_params[:, :S, 0]), S-(s+2))).shape[0]
-            etr_params_to_use = np.zeros((length_diag, etr_params.shape[2]))
-            mtrx_params_to_use = np.zeros((length_diag, mtrx_params.shape[2]))
-            mtry_params_to_use = np.zeros((length_diag, mtry_params.shape[2]))
-            for i in range(etr_params.shape[2]):
-                etr_params_to_use[:, i] = np.diag(np.transpose(etr_params[:, :S, i]), S-(s+2))
-                mtrx_params_to_use[:, i] = np.diag(np.transpose(mtrx_params[:, :S, i]), S-(s+2))
-                mtry_params_to_use[:, i] = np.diag(np.transpose(mtry_params[:, :S, i]), S-(s+2))
+            # tax parameters along the diagonal of ages and years
+            # faced by this cohort
+            diag_ages = S - (s + 2) + ind2
+            etr_params_to_use = tax.get_tax_params(etr_params, diag_ages, ind2)
+            mtrx_params_to_use = tax.get_tax_params(mtrx_params, diag_ages, ind2)
+            mtry_params_to_use = tax.get_tax_params(mtry_params, diag_ages, ind2)
 
 
             inc_tax_params_upper = (analytical_mtrs, etr_params_to_use,
@@ -458,15 +464,12 @@ def inner_loop(guesses, outer_loop_vars, params):
             #     np.diag(guesses_b[t:t + S, :, j])
             # n_guesses_to_use = np.diag(guesses_n[t:t + S, :, j])
 
-            # initialize array of diagonal elements
-            length_diag = (np.diag(np.transpose(etr_params[:, t:t+S, 0]))).shape[0]
-            etr_params_to_use = np.zeros((length_diag, etr_params.shape[2]))
-            mtrx_params_to_use = np.zeros((length_diag, mtrx_params.shape[2]))
-            mtry_params_to_use = np.zeros((length_diag, mtry_params.shape[2]))
-            for i in range(etr_params.shape[2]):
-                etr_params_to_use[:, i] = np.diag(np.transpose(etr_params[:, t:t+S, i]))
-                mtrx_params_to_use[:, i] = np.diag(np.transpose(mtrx_params[:, t:t+S, i]))
-                mtry_params_to_use[:, i] = np.diag(np.transpose(mtry_params[:, t:t+S, i]))
+            # tax parameters along the diagonal of ages and years
+            # faced by this cohort
+            diag_ages = np.arange(S)
+            etr_params_to_use = tax.get_tax_params(etr_params, diag_ages, t + diag_ages)
+            mtrx_params_to_use = tax.get_tax_params(mtrx_params, diag_ages, t + diag_ages)
+            mtry_params_to_use = tax.get_tax_params(mtry_params, diag_ages, t + diag_ages)
 
             inc_tax_params_TP = (analytical_mtrs, etr_params_to_use,
                                  mtrx_params_to_use, mtry_params_to_use)
@@ -516,14 +519,24 @@ def inner_loop(guesses, outer_loop_vars, params):
 
 def run_TPI(income_tax_params, tpi_params, iterative_params,
             initial_values, SS_values, fix_transfers=False,
-            output_dir="./OUTPUT"):
+            output_dir="./OUTPUT", initial_guesses=None):
+    '''
+    --------------------------------------------------------------------
+    Solve for the transition path of OG-USA.
+
+    initial_guesses = dictionary, TPI results (e.g. the path at nearby
+                      parameter values) to start from, in place of
+                      the values in TPI_START_VALUES_FILE.  The guesses
+                      are copied, not changed.
+    --------------------------------------------------------------------
+    '''
 
     # unpack tuples of parameters
     analytical_mtrs, etr_params, mtrx_params, mtry_params = income_tax_params
     maxiter, mindist_SS, mindist_TPI = iterative_params
     J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
                   g_n_vector, tau_payroll, tau_bq, rho, omega, N_tilde, lambdas, imm_rates, e, retire, mean_income_data,\
-                  factor, T_H_baseline, h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, chi_b, chi_n, theta = tpi_params
+                  factor, T_H_baseline, h_wealth, p_wealth, m_wealth, b_ellipse, upsilon, chi_b, chi_n, theta, agg_weights = tpi_params
     K0, b_sinit, b_splus1init, factor, initial_b, initial_n, omega_S_preTP = initial_values
     Kss, Lss, rss, wss, BQss, T_Hss, Gss, bssmat_splus1, nssmat = SS_values
 
@@ -574,11 +587,11 @@ def run_TPI(income_tax_params, tpi_params, iterative_params,
     K = np.zeros(T+S)
     L = np.zeros(T+S)
     K[0] = K0
-    K_params = (omega[:T-1].reshape(T-1, S, 1), lambdas.reshape(1, 1, J), imm_rates[:T-1].reshape(T-1,S,1), g_n_vector[1:T], 'TPI')
-    K[1:T] = household.get_K(guesses_b[:T-1], K_params)
+    aggs = aggr.get_aggregates(agg_weights, 'TPI', b_splus1=guesses_b[:T],
+                               n=guesses_n[:T])
+    K[1:T] = aggs['K'][:T-1]
     K[T:] = Kss
-    L_params = (e.reshape(1, S, J), omega[:T, :].reshape(T, S, 1), lambdas.reshape(1, 1, J), 'TPI')
-    L[:T] = firm.get_L(guesses_n[:T], L_params)
+    L[:T] = aggs['L']
     L[T:] = Lss
     Y_params = (alpha, Z)
     Y = firm.get_Y(K, L, Y_params)
@@ -586,18 +599,25 @@ def run_TPI(income_tax_params, tpi_params, iterative_params,
     r[:T] = firm.get_r(Y[:T], K[:T], r_params)
 
     # uncomment lines below if want to use starting values from prior run
-    r = TPI_START_VALUES['r']
-    K = TPI_START_VALUES['K']
-    L = TPI_START_VALUES['L']
-    Y = TPI_START_VALUES['Y']
-    T_H = TPI_START_VALUES['T_H']
-    BQ = TPI_START_VALUES['BQ']
-    G = TPI_START_VALUES['G']
+    if initial_guesses is None:
+        initial_guesses = default_start_values()
+    # copy the guesses, the paths are updated in place below
+    r = np.array(initial_guesses['r'], dtype=float)
+    K = np.array(initial_guesses['K'], dtype=float)
+    L = np.array(initial_guesses['L'], dtype=float)
+    Y = np.array(initial_guesses['Y'], dtype=float)
+    T_H = np.array(initial_guesses['T_H'], dtype=float)
+    BQ = np.array(initial_guesses['BQ'], dtype=float)
+    G = np.array(initial_guesses['G'], dtype=float)
 
-    guesses_b = TPI_START_VALUES['b_mat']
-    guesses_n = TPI_START_VALUES['n_mat']
+    guesses_b = np.array(initial_guesses['b_mat'], dtype=float)
+    guesses_n = np.array(initial_guesses['n_mat'], dtype=float)
 
 
+    # tax parameters by year, age and ability type, with singleton axes
+    # (a view, so nothing is tiled) where they don't vary
+    etr_params_path = np.transpose(etr_params[:, :T, :], (1, 0, 2))[:, :, np.newaxis, :]
+
     TPIiter = 0
     TPIdist = 10
     PLOT_TPI = False
@@ -651,12 +671,10 @@ def run_TPI(income_tax_params, tpi_params, iterative_params,
         bmat_splus1[:, :, :] = b_mat[:T, :, :]
 
         K[0] = K0
-        K_params = (omega[:T-1].reshape(T-1, S, 1), lambdas.reshape(1, 1, J),
-                    imm_rates[:T-1].reshape(T-1, S, 1), g_n_vector[1:T], 'TPI')
-        K[1:T] = household.get_K(bmat_splus1[:T-1], K_params)
-        L_params = (e.reshape(1, S, J), omega[:T, :].reshape(T, S, 1),
-                    lambdas.reshape(1, 1, J), 'TPI')
-        L[:T] = firm.get_L(n_mat[:T], L_params)
+        aggs = aggr.get_aggregates(agg_weights, 'TPI', b_splus1=bmat_splus1,
+                                   n=n_mat[:T])
+        K[1:T] = aggs['K'][:T-1]
+        L[:T] = aggs['L']
         # print 'K diffs = ', K-K0
         # print 'L diffs = ', L-L[0]
 
@@ -666,32 +684,15 @@ def run_TPI(income_tax_params, tpi_params, iterative_params,
         rnew = firm.get_r(Ynew[:T], K[:T], r_params)
         wnew = firm.get_w_from_r(rnew, w_params)
 
-        omega_shift = np.append(omega_S_preTP.reshape(1, S),
-                                omega[:T-1, :], axis=0)
-        BQ_params = (omega_shift.reshape(T, S, 1), lambdas.reshape(1, 1, J),
-                     rho.reshape(1, S, 1), g_n_vector[:T].reshape(T, 1), 'TPI')
-        # b_mat_shift = np.append(np.reshape(initial_b, (1, S, J)),
-        #                         b_mat[:T-1, :, :], axis=0)
-        b_mat_shift = bmat_splus1[:T, :, :]
-        # print 'b diffs = ', (bmat_splus1[100, :, :] - initial_b).max(), (bmat_splus1[0, :, :] - initial_b).max(), (bmat_splus1[1, :, :] - initial_b).max()
         # print 'r diffs = ', rnew[1]-r[1], rnew[100]-r[100], rnew[-1]-r[-1]
-        BQnew = household.get_BQ(rnew[:T].reshape(T, 1), b_mat_shift,
-                                 BQ_params)
-        BQss2 = np.empty(J)
-        for j in range(J):
-            BQss_params = (omega[1, :], lambdas[j], rho, g_n_vector[1], 'SS')
-            BQss2[j] = household.get_BQ(rnew[1], bmat_splus1[1, :, j],
-                                        BQss_params)
-        # print 'BQ test = ', BQss2-BQss, BQss-BQnew[1], BQss-BQnew[100], BQss-BQnew[-1]
-
-        total_tax_params = np.zeros((T, S, J, etr_params.shape[2]))
-        for i in range(etr_params.shape[2]):
-            total_tax_params[:, :, :, i] = np.tile(np.reshape(np.transpose(etr_params[:,:T,i]),(T,S,1)),(1,1,J))
-
-        tax_receipt_params = (np.tile(e.reshape(1, S, J),(T,1,1)), lambdas.reshape(1, 1, J), omega[:T].reshape(T, S, 1), 'TPI',
-                total_tax_params, theta, tau_bq, tau_payroll, h_wealth, p_wealth, m_wealth, retire, T, S, J)
-        net_tax_receipts = np.array(list(tax.get_lump_sum(np.tile(rnew[:T].reshape(T, 1, 1),(1,S,J)), np.tile(wnew[:T].reshape(T, 1, 1),(1,S,J)),
-               bmat_s, n_mat[:T,:,:], BQnew[:T].reshape(T, 1, J), factor, tax_receipt_params)) + [T_Hss] * S)
+        BQnew = aggr.get_BQ(rnew[:T], aggs['bq_wealth'], 'TPI')
+
+        tax_receipt_params = (np.tile(e.reshape(1, S, J),(T,1,1)), lambdas.reshape(1, 1, J), 'TPI',
+                etr_params_path, theta, tau_bq, tau_payroll, h_wealth, p_wealth, m_wealth, retire, T, S, J)
+        receipts = tax.get_tax_receipts(np.tile(rnew[:T].reshape(T, 1, 1),(1,S,J)), np.tile(wnew[:T].reshape(T, 1, 1),(1,S,J)),
+               bmat_s, n_mat[:T,:,:], BQnew[:T].reshape(T, 1, J), factor, tax_receipt_params)
+        net_tax_receipts = np.array(list(aggr.get_aggregates(
+            agg_weights, 'TPI', revenue=receipts)['T_H']) + [T_Hss] * S)
 
         r[:T] = utils.convex_combo(rnew[:T], r[:T], nu)
         BQ[:T] = utils.convex_combo(BQnew[:T], BQ[:T], nu)
@@ -703,10 +704,6 @@ def run_TPI(income_tax_params, tpi_params, iterative_params,
             T_H[:T] = utils.convex_combo(T_H_new[:T], T_H[:T], nu)
             G[:T] = 0.0
 
-        etr_params_path = np.zeros((T,S,J,etr_params.shape[2]))
-        for i in range(etr_params.shape[2]):
-            etr_params_path[:,:,:,i] = np.tile(
-                np.reshape(np.transpose(etr_params[:,:T,i]),(T,S,1)),(1,1,J))
         tax_path_params = (np.tile(e.reshape(1, S, J),(T,1,1)),
                            lambdas, 'TPI', retire, etr_params_path, h_wealth,
                            p_wealth, m_wealth, tau_payroll, theta, tau_bq, J, S)
@@ -801,10 +798,10 @@ def run_TPI(income_tax_params, tpi_params, iterative_params,
     bmat_splus1[:, :, :] = b_mat[:T, :, :]
 
     K[0] = K0
-    K_params = (omega[:T-1].reshape(T-1, S, 1), lambdas.reshape(1, 1, J), imm_rates[:T-1].reshape(T-1,S,1), g_n_vector[1:T], 'TPI')
-    K[1:T] = household.get_K(bmat_splus1[:T-1], K_params)
-    L_params = (e.reshape(1, S, J), omega[:T, :].reshape(T, S, 1), lambdas.reshape(1, 1, J), 'TPI')
-    L[:T]  = firm.get_L(n_mat[:T], L_params)
+    aggs = aggr.get_aggregates(agg_weights, 'TPI', b_splus1=bmat_splus1,
+                               n=n_mat[:T])
+    K[1:T] = aggs['K'][:T-1]
+    L[:T] = aggs['L']
 
     Y_params = (alpha, Z)
     Ynew = firm.get_Y(K[:T], L[:T], Y_params)
@@ -812,20 +809,16 @@ def run_TPI(income_tax_params, tpi_params, iterative_params,
     rnew = firm.get_r(Ynew[:T], K[:T], r_params)
     wnew = firm.get_w_from_r(rnew, w_params)
 
-    omega_shift = np.append(omega_S_preTP.reshape(1,S),omega[:T-1,:],axis=0)
-    BQ_params = (omega_shift.reshape(T, S, 1), lambdas.reshape(1, 1, J), rho.reshape(1, S, 1),
-                 g_n_vector[:T].reshape(T, 1), 'TPI')
     b_mat_shift = np.append(np.reshape(initial_b,(1,S,J)),b_mat[:T-1,:,:],axis=0)
-    BQnew = household.get_BQ(rnew[:T].reshape(T, 1), b_mat_shift, BQ_params)
-
-    total_tax_params = np.zeros((T,S,J,etr_params.shape[2]))
-    for i in range(etr_params.shape[2]):
-        total_tax_params[:,:,:,i] = np.tile(np.reshape(np.transpose(etr_params[:,:T,i]),(T,S,1)),(1,1,J))
+    bq_wealth = aggr.get_bq_wealth(agg_weights, 'TPI', b_mat_shift)
+    BQnew = aggr.get_BQ(rnew[:T], bq_wealth, 'TPI')
 
-    tax_receipt_params = (np.tile(e.reshape(1, S, J),(T,1,1)), lambdas.reshape(1, 1, J), omega[:T].reshape(T, S, 1), 'TPI',
-            total_tax_params, theta, tau_bq, tau_payroll, h_wealth, p_wealth, m_wealth, retire, T, S, J)
-    net_tax_receipts = np.array(list(tax.get_lump_sum(np.tile(rnew[:T].reshape(T, 1, 1),(1,S,J)), np.tile(wnew[:T].reshape(T, 1, 1),(1,S,J)),
-           bmat_s, n_mat[:T,:,:], BQnew[:T].reshape(T, 1, J), factor, tax_receipt_params)) + [T_Hss] * S)
+    tax_receipt_params = (np.tile(e.reshape(1, S, J),(T,1,1)), lambdas.reshape(1, 1, J), 'TPI',
+            etr_params_path, theta, tau_bq, tau_payroll, h_wealth, p_wealth, m_wealth, retire, T, S, J)
+    receipts = tax.get_tax_receipts(np.tile(rnew[:T].reshape(T, 1, 1),(1,S,J)), np.tile(wnew[:T].reshape(T, 1, 1),(1,S,J)),
+           bmat_s, n_mat[:T,:,:], BQnew[:T].reshape(T, 1, J), factor, tax_receipt_params)
+    net_tax_receipts = np.array(list(aggr.get_aggregates(
+        agg_weights, 'TPI', revenue=receipts)['T_H']) + [T_Hss] * S)
 
     if fix_transfers:
         G[:T] = net_tax_receipts[:T] - T_H[:T]
@@ -833,9 +826,6 @@ def run_TPI(income_tax_params, tpi_params, iterative_params,
         T_H[:T] = net_tax_receipts[:T]
         G[:T] = 0.0
 
-    etr_params_path = np.zeros((T,S,J,etr_params.shape[2]))
-    for i in range(etr_params.shape[2]):
-        etr_params_path[:,:,:,i] = np.tile(np.reshape(np.transpose(etr_params[:,:T,i]),(T,S,1)),(1,1,J))
     tax_path_params = (np.tile(e.reshape(1, S, J),(T,1,1)), lambdas, 'TPI', retire, etr_params_path, h_wealth,
                        p_wealth, m_wealth, tau_payroll, theta, tau_bq, J, S)
     tax_path = tax.total_taxes(np.tile(r[:T].reshape(T, 1, 1),(1,S,J)), np.tile(w[:T].reshape(T, 1, 1),(1,S,J)), bmat_s,
@@ -844,10 +834,9 @@ def run_TPI(income_tax_params, tpi_params, iterative_params,
     cons_params = (e.reshape(1, S, J), lambdas.reshape(1, 1, J), g_y)
     c_path = household.get_cons(r[:T].reshape(T, 1, 1), w[:T].reshape(T, 1, 1), bmat_s, bmat_splus1, n_mat[:T,:,:],
                    BQ[:T].reshape(T, 1, J), tax_path, cons_params)
-    C_params = (omega[:T].reshape(T, S, 1), lambdas, 'TPI')
-    C = household.get_C(c_path, C_params)
-    I_params = (delta, g_y, omega[:T].reshape(T, S, 1), lambdas, imm_rates[:T].reshape(T, S, 1), g_n_vector[1:T+1], 'TPI')
-    I = firm.get_I(bmat_splus1[:T], K[1:T+1], K[:T], I_params)
+    C = aggr.get_aggregates(agg_weights, 'TPI', c=c_path)['C']
+    I_params = (delta, g_y, g_n_vector[1:T+1])
+    I = aggr.get_I(K[1:T+1], K[:T], aggs['I_imm'], I_params)
     rc_error = Y[:T] - C[:T] - I[:T] - G[:T]
     print 'Resource Constraint Difference:', rc_error
 
@@ -0,0 +1,237 @@
+'''
+------------------------------------------------------------------------
+Functions to compute economic aggregates (K, L, BQ, C, I and net tax
+receipts) from household distributions in the steady state and along
+the transition path.
+
+The population weight tensors (omega x lambdas, adjusted for mortality,
+immigration and population growth) depend only on demographics, so they
+are built once per run by get_weights() and then reused in every SS and
+TPI iteration by get_aggregates().
+
+This py-file calls the following other file(s): None
+------------------------------------------------------------------------
+'''
+
+# Packages
+import numpy as np
+
+'''
+------------------------------------------------------------------------
+    Functions
+------------------------------------------------------------------------
+'''
+
+
+def get_weights(params):
+    '''
+    Builds the population weight tensors used to aggregate household
+    distributions.
+
+    Inputs:
+        params = length 7 tuple if method = 'SS',
+                 (omega, lambdas, imm_rates, rho, e, g_n, method)
+                 length 9 tuple if method = 'TPI',
+                 (omega, omega_S_preTP, lambdas, imm_rates, rho, e,
+                  g_n_vector, T, method)
+        omega         = [S,] vector or [T+S,S] array, population weights
+        omega_S_preTP = [S,] vector, population weights in the period
+                        before the transition path begins
+        lambdas       = [J,] vector, fraction in each lifetime income
+                        group
+        imm_rates     = [S,] vector or [T+S,S] array, immigration rates
+        rho           = [S,] vector, mortality rates
+        e             = [S,J] array, effective labor units
+        g_n           = scalar, steady state population growth rate
+        g_n_vector    = [T+S,] vector, population growth rates
+        T             = integer, number of periods in transition path
+        method        = string, 'SS' or 'TPI'
+
+    Functions called: None
+
+    Objects in function:
+        pop      = [S,J] or [T,S,J] array, omega x lambdas
+        imm      = [S,J] or [T,S,J] array, population weights of next
+                   period's immigrants by the age they save at
+        growth   = scalar or [T,1,1] array, 1 + population growth rate
+                   between t and t+1
+        growth_bq = scalar or [T,1,1] array, 1 + population growth rate
+                    between t-1 and t
+        weights  = dictionary, weight tensors by aggregate
+
+    Returns: weights
+    '''
+    method = params[-1]
+
+    if method == 'SS':
+        omega, lambdas, imm_rates, rho, e, g_n, method = params
+        S = omega.shape[0]
+        J = lambdas.shape[0]
+        pop = omega.reshape(S, 1) * lambdas.reshape(1, J)
+        omega_shift = np.append(omega[1:], [0.0])
+        imm_shift = np.append(imm_rates[1:], [0.0])
+        imm = (omega_shift * imm_shift).reshape(S, 1) * lambdas.reshape(1, J)
+        pop_bq = pop * rho.reshape(S, 1)
+        growth = 1.0 + g_n
+        growth_bq = growth
+    elif method == 'TPI':
+        omega, omega_S_preTP, lambdas, imm_rates, rho, e, g_n_vector, \
+            T, method = params
+        S = omega.shape[1]
+        J = lambdas.shape[0]
+        pop = omega[:T].reshape(T, S, 1) * lambdas.reshape(1, 1, J)
+        omega_shift = np.append(omega[:T, 1:], np.zeros((T, 1)), axis=1)
+        imm_shift = np.append(imm_rates[:T, 1:], np.zeros((T, 1)),
+                              axis=1)
+        imm = ((omega_shift * imm_shift).reshape(T, S, 1) *
+               lambdas.reshape(1, 1, J))
+        omega_lag = np.append(omega_S_preTP.reshape(1, S),
+                              omega[:T - 1, :], axis=0)
+        pop_bq = (omega_lag.reshape(T, S, 1) * rho.reshape(1, S, 1) *
+                  lambdas.reshape(1, 1, J))
+        growth = 1.0 + g_n_vector[1:T + 1].reshape(T, 1, 1)
+        growth_bq = 1.0 + g_n_vector[:T].reshape(T, 1, 1)
+
+    # Weights on savings are stacked so K, the immigrant part of
+    # investment and bequests come out of a single pass over b
+    weights = {'pop': pop,
+               'L': e * pop,
+               'b': np.array([(pop + imm) / growth, imm / growth,
+                              pop_bq / growth_bq])}
+
+    return weights
+
+
+def get_aggregates(weights, method, b_splus1=None, n=None, c=None,
+                   revenue=None):
+    '''
+    Computes the aggregates implied by the household distributions
+    that are passed in.
+
+    Inputs:
+        weights  = dictionary, weight tensors from get_weights()
+        method   = string, 'SS' or 'TPI'
+        b_splus1 = [S,J] or [T,S,J] array, savings
+        n        = [S,J] or [T,S,J] array, labor supply
+        c        = [S,J] or [T,S,J] array, consumption
+        revenue  = [S,J] or [T,S,J] array, net tax receipts by household
+
+    Functions called: None
+
+    Objects in function:
+        b_aggs = [3,] or [3,T,J] array, weighted sums of savings
+        aggs   = dictionary, aggregates
+            K         = scalar or [T,] vector, aggregate capital (in
+                        TPI, capital in period t+1)
+            I_imm     = scalar or [T,] vector, capital brought in by
+                        immigrants, used in get_I()
+            bq_wealth = [J,] or [T,J] array, wealth of decedents by
+                        lifetime income group, used in get_BQ()
+            L         = scalar or [T,] vector, aggregate labor
+            C         = scalar or [T,] vector, aggregate consumption
+            T_H       = scalar or [T,] vector, net tax receipts
+
+    Returns: aggs
+    '''
+    if method == 'SS':
+        spec = 'sj,sj->'
+        b_spec = 'sj,ksj->kj'
+    elif method == 'TPI':
+        spec = 'tsj,tsj->t'
+        b_spec = 'tsj,ktsj->ktj'
+
+    aggs = {}
+    if b_splus1 is not None:
+        b_aggs = np.einsum(b_spec, b_splus1, weights['b'])
+        aggs['K'] = b_aggs[0].sum(-1)
+        aggs['I_imm'] = b_aggs[1].sum(-1)
+        aggs['bq_wealth'] = b_aggs[2]
+    if n is not None:
+        aggs['L'] = np.einsum(spec, n, weights['L'])
+    if c is not None:
+        aggs['C'] = np.einsum(spec, c, weights['pop'])
+    if revenue is not None:
+        aggs['T_H'] = np.einsum(spec, revenue, weights['pop'])
+
+    return aggs
+
+
+def get_bq_wealth(weights, method, b):
+    '''
+    Computes the wealth of decedents by lifetime income group alone,
+    without the other aggregates of savings.
+
+    Inputs:
+        weights = dictionary, weight tensors from get_weights()
+        method  = string, 'SS' or 'TPI'
+        b       = [S,J] or [T,S,J] array, savings of those who die at
+                  the end of the period
+
+    Functions called: None
+
+    Objects in function:
+        bq_wealth = [J,] or [T,J] array, wealth of decedents by lifetime
+                    income group, used in get_BQ()
+
+    Returns: bq_wealth
+    '''
+    if method == 'SS':
+        bq_wealth = np.einsum('sj,sj->j', b, weights['b'][2])
+    elif method == 'TPI':
+        bq_wealth = np.einsum('tsj,tsj->tj', b, weights['b'][2])
+    return bq_wealth
+
+
+def get_BQ(r, bq_wealth, method):
+    '''
+    Calculation of bequests to each lifetime income group.
+
+    Inputs:
+        r         = scalar or [T,] vector, interest rates
+        bq_wealth = [J,] or [T,J] array, wealth of decedents by lifetime
+                    income group from get_aggregates() or
+                    get_bq_wealth()
+        method    = string, 'SS' or 'TPI'
+
+    Functions called: None
+
+    Objects in function:
+        BQ = [J,] or [T,J] array, bequests by lifetime income group
+
+    Returns: BQ
+    '''
+    if method == 'SS':
+        BQ = (1.0 + r) * bq_wealth
+    elif method == 'TPI':
+        BQ = (1.0 + np.reshape(r, (-1, 1))) * bq_wealth
+    return BQ
+
+
+def get_I(K_p1, K, I_imm, params):
+    '''
+    Generates aggregate investment.
+
+    Inputs:
+        K_p1   = scalar or [T,] vector, aggregate capital, one period
+                 ahead
+        K      = scalar or [T,] vector, aggregate capital
+        I_imm  = scalar or [T,] vector, capital brought in by immigrants
+                 from get_aggregates()
+        params = length 3 tuple, (delta, g_y, g_n)
+        delta  = scalar, depreciation rate of capital
+        g_y    = scalar, production growth rate
+        g_n    = scalar or [T,] vector, population growth rate between
+                 t and t+1
+
+    Functions called: None
+
+    Objects in function:
+        aggI = scalar or [T,] vector, aggregate investment
+
+    Returns: aggI
+    '''
+    delta, g_y, g_n = params
+
+    aggI = ((1 + g_n) * np.exp(g_y) * (K_p1 - I_imm) -
+            (1.0 - delta) * K)
+    return aggI
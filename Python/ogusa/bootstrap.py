@@ -0,0 +1,148 @@
+'''
+------------------------------------------------------------------------
+Weighted bootstrap of data moments.
+
+Each bootstrap replicate is represented by a vector of multiplicities,
+the number of times each observation is drawn, rather than by a
+resampled copy of the data.  The data are prepared (e.g. sorted) once
+and the moments for a block of replicates are computed with array
+operations on the [block, N] matrix of multiplicities.  The random
+stream for each block is seeded from (seed, block number), so results
+are reproducible and do not depend on the number of processes used.
+
+This py-file calls the following other file(s): None
+------------------------------------------------------------------------
+'''
+
+# Packages
+import multiprocessing
+import numpy as np
+
+# Maximum number of elements in the [block, N] multiplicity matrix
+MAX_BLOCK_ELEMENTS = 10000000
+
+'''
+------------------------------------------------------------------------
+    Functions
+------------------------------------------------------------------------
+'''
+
+
+def get_boot_weights(n_obs, n_reps, seed, method='poisson'):
+    '''
+    Draws the multiplicities of each observation for a block of
+    bootstrap replicates.
+
+    Inputs:
+        n_obs  = integer, number of observations
+        n_reps = integer, number of replicates in the block
+        seed   = integer or sequence of integers, seed for this block
+        method = string, 'poisson' for independent Poisson(1) draws or
+                 'multinomial' for n_obs draws with replacement
+
+    Functions called: None
+
+    Objects in function:
+        prng = RandomState object, random number generator for the block
+        mult = [n_reps,N] array, multiplicity of each observation in each
+               replicate
+
+    Returns: mult
+    '''
+    prng = np.random.RandomState(seed)
+    if method == 'poisson':
+        mult = prng.poisson(1.0, size=(n_reps, n_obs))
+    elif method == 'multinomial':
+        mult = prng.multinomial(n_obs, np.ones(n_obs) / n_obs, size=n_reps)
+    else:
+        raise ValueError("Bootstrap method must be 'poisson' or "
+                         "'multinomial'")
+    return mult.astype(float)
+
+
+def boot_blocks(args):
+    '''
+    Computes the moments for a set of blocks of bootstrap replicates.
+    Takes a single tuple so it can be mapped over a worker pool.
+
+    Inputs:
+        args        = length 6 tuple, (moment_func, data, blocks, n_obs,
+                      seed, method)
+        moment_func = function, takes a [block,N] multiplicity matrix and
+                      data and returns a [block,M] array of moments
+        data        = tuple, prepared data passed to moment_func
+        blocks      = list of (block number, number of replicates) tuples
+        n_obs       = integer, number of observations
+        seed        = integer, seed for the bootstrap
+        method      = string, 'poisson' or 'multinomial'
+
+    Functions called:
+        get_boot_weights
+
+    Objects in function:
+        mult    = [block,N] array, multiplicities for a block
+        moments = list of [block,M] arrays, moments for each block
+
+    Returns: [sum of blocks,M] array
+    '''
+    moment_func, data, blocks, n_obs, seed, method = args
+    moments = []
+    for block, n_reps in blocks:
+        mult = get_boot_weights(n_obs, n_reps, [seed, block], method)
+        moments.append(moment_func(mult, data))
+    return np.concatenate(moments, axis=0)
+
+
+def boot_moments(moment_func, data, n_obs, n, seed=0, method='poisson',
+                 block_size=None, num_workers=1):
+    '''
+    Computes the moments for n bootstrap replicates.
+
+    Inputs:
+        moment_func = function, takes a [block,N] multiplicity matrix and
+                      data and returns a [block,M] array of moments
+        data        = tuple, prepared data passed to moment_func
+        n_obs       = integer, number of observations
+        n           = integer, number of bootstrap replicates
+        seed        = integer, seed for the bootstrap
+        method      = string, 'poisson' or 'multinomial'
+        block_size  = integer, number of replicates computed at once
+                      (default keeps the multiplicity matrix under
+                      MAX_BLOCK_ELEMENTS)
+        num_workers = integer, number of processes
+
+    Functions called:
+        boot_blocks
+
+    Objects in function:
+        blocks = list of (block number, number of replicates) tuples
+        tasks  = list, blocks assigned to each process
+        boot   = [n,M] array, bootstrapped moments
+
+    Returns: boot
+    '''
+    if block_size is None:
+        block_size = max(1, MAX_BLOCK_ELEMENTS // n_obs)
+    blocks = [(b, min(block_size, n - b * block_size))
+              for b in xrange(int(np.ceil(n / float(block_size))))]
+
+    # the data are sent once to each process, along with its share of
+    # the blocks
+    num_workers = max(1, min(num_workers, len(blocks)))
+    tasks = [(moment_func, data, blocks[i::num_workers], n_obs, seed,
+              method) for i in xrange(num_workers)]
+    if num_workers == 1:
+        boot = boot_blocks(tasks[0])
+    else:
+        pool = multiprocessing.Pool(num_workers)
+        results = pool.map(boot_blocks, tasks)
+        pool.close()
+        pool.join()
+        # put replicates back in block order
+        boot = np.zeros((n, results[0].shape[1]))
+        for i in xrange(num_workers):
+            rows = np.concatenate([np.arange(b * block_size,
+                                             b * block_size + n_reps)
+                                   for b, n_reps in blocks[i::num_workers]])
+            boot[rows, :] = results[i]
+    return boot
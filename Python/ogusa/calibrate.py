@@ -7,9 +7,23 @@ chi_estimate() = returns chi_n, chi_b
     - calls:
         wealth.get_wealth_data() - returns data moments on wealth distribution
         labor.labor_data_moments() - returns data moments on labor supply
+        gauss_newton_estimate() - returns chi that minimizes the
+                                  statistical objective function
+            solve_moments() - returns model moments and SS solution,
+                              or the logged evaluation
+            moment_jacobian()
+        surrogate_estimate() - returns chi that minimizes a surrogate
+                               of the statistical objective function
+            design_moments() - returns model moments at design points
+            fit_surrogate() - returns Gaussian-process fit of moments
+            predict_surrogate() - returns predicted moments
         minstat() - returns min of statistical objective function
             model_moments() - returns model moments
                 SS.run_SS() - return SS distributions
+            log_eval() - appends an evaluation to the evaluation log
+        load_eval_log() - returns evaluations saved by a previous run
+        moment_jacobian() - returns derivatives of model moments wrt chi
+            perturbed_moments() - returns model moments at perturbed chi
 
 '''
 
@@ -25,7 +39,8 @@ This py-file calls the following other file(s):
     labor.labor_data_moments()
     SS.run_SS
 
-This py-file creates the following other file(s): None
+This py-file creates the following other file(s):
+    ./baseline_dir/Calibration/estimation_evals.pkl
 ------------------------------------------------------------------------
 '''
 
@@ -34,18 +49,13 @@ import scipy.optimize as opt
 import pandas as pd
 import os
 import pickle
+import multiprocessing
 import wealth
 import labor
 import SS
 import utils
 import inequal
 
-# initialize datafame to keep output
-global bh_output
-data = np.ones((1,88))
-columns = list(xrange(88))
-bh_output = pd.DataFrame(data, columns=columns)
-
 
 class MyBounds(object):
         def __init__(self, xmin=np.zeros((87,)) ):
@@ -57,7 +67,9 @@ class MyBounds(object):
             tmin = bool(np.all(x >= self.xmin))
             return tmin
 
-def chi_estimate(income_tax_params, ss_params, iterative_params, chi_guesses, baseline_dir="./OUTPUT"):
+def chi_estimate(income_tax_params, ss_params, iterative_params, chi_guesses, baseline_dir="./OUTPUT",
+                 num_workers=None, estimator=None, baseline_solution=None,
+                 std_errors=False):
     '''
     --------------------------------------------------------------------
     This function calls others to obtain the data momements and then
@@ -73,12 +85,24 @@ def chi_estimate(income_tax_params, ss_params, iterative_params, chi_guesses, ba
                              for SS solution
     chi_guesses           = [J+S,] vector, initial guesses of chi_b and chi_n stacked together
     baseline_dir          = string, path where baseline results located
+    num_workers           = integer, number of processes used to compute
+                             moment derivatives (default is the number of CPUs)
+    estimator             = string, 'gauss-newton' or 'surrogate' to estimate
+                             chi starting from chi_guesses (or the best point
+                             in the evaluation log), None to use chi_guesses
+    baseline_solution     = dictionary, baseline SS results, loaded from
+                             baseline_dir if not given
+    std_errors            = boolean, =True to compute the standard errors
+                             of the estimates, which takes 2(J+S) more SS
+                             solves
 
 
     OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
     wealth.compute_wealth_moments()
     labor.labor_data_moments()
-    minstat()
+    gauss_newton_estimate()
+    surrogate_estimate()
+    moment_jacobian()
 
     OBJECTS CREATED WITHIN FUNCTION:
     wealth_moments     = [J+2,] array, wealth moments from data
@@ -90,10 +114,14 @@ def chi_estimate(income_tax_params, ss_params, iterative_params, chi_guesses, ba
     est_output         = dictionary, output from minimizer
     chi_params         = [J+S,] vector, parameters estimates for chi_b and chi_n stacked
     objective_func_min = scalar, minimum of statistical objective function
+    deriv_moments      = [J+2+S,J+S] array, derivatives of model moments wrt chi
+    VCV_params         = [J+S,J+S] array, variance-covariance matrix of chi estimates
+    std_errors_chi     = [J+S,] vector, standard errors of chi estimates
 
 
     OUTPUT:
     ./baseline_dir/Calibration/chi_estimation.pkl
+    ./baseline_dir/Calibration/chi_std_errors.pkl (if std_errors)
 
 
     RETURNS: chi_params
@@ -104,11 +132,19 @@ def chi_estimate(income_tax_params, ss_params, iterative_params, chi_guesses, ba
     J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
                   g_n_ss, tau_payroll, tau_bq, rho, omega_SS, lambdas, \
                   imm_rates, e, retire, mean_income_data, h_wealth, p_wealth,\
-                  m_wealth, b_ellipse, upsilon = ss_params
+                  m_wealth, b_ellipse, upsilon, agg_weights = ss_params
     chi_b_guess, chi_n_guess = chi_guesses
 
     flag_graphs = False
 
+    # the baseline SS is read once and passed to every SS solve
+    if baseline_solution is None:
+        baseline_solution = SS.load_SS_solution(baseline_dir)
+
+    # evaluations from a previous run are reused rather than re-solved
+    eval_store = load_eval_log(os.path.join(baseline_dir,
+                                            "Calibration/estimation_evals.pkl"))
+
     # specify bootstrap iterations
     n = 10000
 
@@ -145,16 +181,35 @@ def chi_estimate(income_tax_params, ss_params, iterative_params, chi_guesses, ba
     chi_guesses_flat = list(chi_b_guess.flatten()) + list(chi_n_guess.flatten())
     #
     # min_args = data_moments, W, income_tax_params, ss_params, \
-    #            iterative_params, chi_guesses_flat, baseline_dir
+    #            iterative_params, chi_guesses_flat, baseline_dir, eval_store, \
+    #            baseline_solution
     # # est_output = opt.minimize(minstat, chi_guesses_flat, args=(min_args), method="L-BFGS-B", bounds=bnds,
     # #                 tol=1e-15, options={'maxfun':1,'maxiter':1,'maxls':2})
     # mybounds = MyBounds()
     # minimizer_kwargs = {"args": (min_args)}
-    # est_output = opt.basinhopping(minstat, chi_guesses_flat, niter=1000,
+    # est_output = opt.basinhopping(minstat, chi_start, niter=1000,
     #                             minimizer_kwargs=minimizer_kwargs,
     #                             disp=False,niter_success=None, accept_test=mybounds)
     chi_params = chi_guesses_flat #est_output.x
     # objective_func_min = est_output.fun
+    ss_output = None
+    if estimator is not None:
+        chi_start = best_logged_chi(eval_store, data_moments, W, chi_guesses_flat)
+        est_params = (income_tax_params, ss_params, iterative_params, baseline_dir)
+        if estimator == 'gauss-newton':
+            jac_dir = os.path.join(baseline_dir, "Calibration/jacobian")
+            chi_params, ss_output, objective_func_min = gauss_newton_estimate(
+                chi_start, data_moments, W, est_params, eval_store,
+                num_workers=num_workers, jac_dir=jac_dir,
+                initial_guesses=baseline_solution)
+        elif estimator == 'surrogate':
+            chi_params, ss_output, objective_func_min = surrogate_estimate(
+                chi_start, data_moments, W, est_params, eval_store,
+                num_workers=num_workers, initial_guesses=baseline_solution)
+        else:
+            raise ValueError("estimator must be None, 'gauss-newton' or "
+                             "'surrogate'")
+        chi_params = list(chi_params)
     #
     # # pickle output
     # utils.mkdirs(os.path.join(baseline_dir, "Calibration"))
@@ -167,7 +222,10 @@ def chi_estimate(income_tax_params, ss_params, iterative_params, chi_guesses, ba
     chi_n = chi_params[J:]
     chi_params_list = (chi_b, chi_n)
 
-    ss_output = SS.run_SS(income_tax_params, ss_params, iterative_params, chi_params_list, True, baseline_dir)
+    if ss_output is None:
+        ss_output = SS.run_SS(income_tax_params, ss_params, iterative_params,
+                              chi_params_list, True, baseline_dir=baseline_dir,
+                              baseline_solution=baseline_solution)
     model_moments = calc_moments(ss_output, omega_SS, lambdas, S, J)
 
     # make dataframe for results
@@ -176,57 +234,586 @@ def chi_estimate(income_tax_params, ss_params, iterative_params, chi_guesses, ba
     moment_fit = moment_fit.fillna(0) # with 0s rather than NaNs
     moment_fit['data_moment'] = data_moments
     moment_fit['model_moment'] = model_moments
-    moment_fit['minstat'] = 2.5 #objective_func_min
+    moment_fit['minstat'] = moment_distance(
+        {'model_moments': model_moments, 'ss_flag': ss_output['ss_flag']},
+        data_moments, W)
     mom_dir = os.path.join(baseline_dir, "Calibration/moment_results.pkl")
     pickle.dump(moment_fit, open(mom_dir, "wb"))
 
-    quit()
     # calculate std errors
-    h = 0.001  # pct change in parameter
-    model_moments_low = np.zeros((len(chi_params),len(model_moments)))
-    model_moments_high = np.zeros((len(chi_params),len(model_moments)))
-    chi_params_low = chi_params
-    chi_params_high = chi_params
-    for i in range(len(chi_params)):
-        chi_params_low[i] = chi_params[i]*(1+h)
-        chi_b = chi_params_low[:J]
-        chi_n = chi_params_low[J:]
-        chi_params_list = (chi_b, chi_n)
-        ss_output = SS.run_SS(income_tax_params, ss_params, iterative_params, chi_params_list, True, baseline_dir)
-        model_moments_low[i,:] = calc_moments(ss_output, omega_SS, lambdas, S, J)
-
-        chi_params_high[i] = chi_params[i]*(1+h)
-        chi_b = chi_params_high[:J]
-        chi_n = chi_params_high[J:]
-        chi_params_list = (chi_b, chi_n)
-        ss_output = SS.run_SS(income_tax_params, ss_params, iterative_params, chi_params_list, True, baseline_dir)
-        model_moments_high[i,:] = calc_moments(ss_output, omega_SS, lambdas, S, J)
-
-    deriv_moments = (np.asarray(model_moments_high) - np.asarray(model_moments_low)).T/(2.*h*np.asarray(chi_params))
-    VCV_params = np.linalg.inv(np.dot(np.dot(deriv_moments.T,W),deriv_moments))
-    std_errors_chi = (np.diag(VCV_params))**(1/2.)
-    sd_dir = os.path.join(baseline_dir, "Calibration/chi_std_errors.pkl")
-    pickle.dump(std_errors_chi, open(sd_dir, "wb"))
+    if std_errors:
+        h = 0.001  # pct change in parameter
+        jac_params = (income_tax_params, ss_params, iterative_params, ss_output)
+        jac_dir = os.path.join(baseline_dir, "Calibration/jacobian")
+        deriv_moments = moment_jacobian(chi_params, h, jac_params, num_workers, jac_dir)
+        VCV_params = np.linalg.inv(np.dot(np.dot(deriv_moments.T,W),deriv_moments))
+        std_errors_chi = (np.diag(VCV_params))**(1/2.)
+        sd_dir = os.path.join(baseline_dir, "Calibration/chi_std_errors.pkl")
+        pickle.dump(std_errors_chi, open(sd_dir, "wb"))
 
     return chi_params
 
 
+def gauss_newton_estimate(chi_start, data_moments, W, params, eval_store,
+                          num_workers=None, jac_dir=None, h=0.001,
+                          max_iter=25, tol=1e-6, initial_guesses=None):
+    '''
+    --------------------------------------------------------------------
+    This function minimizes the weighted, squared deviation between the
+    model and data moments over chi with the Levenberg-Marquardt
+    variant of Gauss-Newton.  The moment Jacobian comes from
+    moment_jacobian(), with the perturbed steady states solved in
+    parallel, and every SS solve starts from the SS at the current
+    chi.  A step that does not reduce the distance is retried with a
+    larger damping parameter, which shortens it and turns it toward the
+    gradient.
+
+    INPUTS:
+    chi_start    = [J+S,] vector, starting values of chi_b and chi_n stacked
+    data_moments = [J+2+S,] vector, wealth and labor moments from data
+    W            = [J+2+S,J+2+S] array, weighting matrix
+    params       = length 4 tuple, (income_tax_params, ss_params,
+                   iterative_params, baseline_dir)
+    eval_store   = dictionary, evaluations, from load_eval_log()
+    num_workers  = integer, number of processes used for the Jacobian
+    jac_dir      = string, path where moments from each perturbation are
+                   saved, None to not save them
+    h            = scalar, percent change in each parameter for the
+                   Jacobian
+    max_iter     = integer, maximum number of Gauss-Newton iterations
+    tol          = scalar, convergence tolerance on the relative change
+                   in chi and in the distance
+    initial_guesses = dictionary, SS solution to start the first solve
+                      from, None to load the baseline SS from baseline_dir
+
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
+    solve_moments()
+    moment_jacobian()
+    moment_distance()
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    chi_params    = [J+S,] vector, current chi
+    ss_output     = dictionary, SS solution at chi_params, None if its
+                    evaluation was logged
+    ss_start      = dictionary, latest SS solution, solves start from it
+    record        = dictionary, evaluation at chi_params
+    distance      = scalar, distance at chi_params
+    lam           = scalar, Levenberg-Marquardt damping parameter
+    deriv_moments = [J+2+S,J+S] array, derivatives of model moments wrt chi
+    resid         = [J+2+S,] vector, model less data moments
+    JtWJ          = [J+S,J+S] array, Gauss-Newton approximation to the
+                    Hessian (up to a factor of 2)
+    grad          = [J+S,] vector, gradient of the distance (up to a
+                    factor of 2)
+    step          = [J+S,] vector, change in chi
+    chi_trial     = [J+S,] vector, chi after the step
+
+    RETURNS: chi_params, ss_output, distance
+    --------------------------------------------------------------------
+    '''
+    income_tax_params, ss_params, iterative_params, baseline_dir = params
+    data_moments = np.array(data_moments)
+    chi_params = np.array(chi_start, dtype=float)
+
+    record, ss_output = solve_moments(chi_params, params, eval_store,
+                                      data_moments, W, initial_guesses)
+    distance = record['distance']
+    if record['ss_flag'] != 0:
+        print 'SS not solved at the starting chi, estimation not run'
+        return chi_params, ss_output, distance
+    # solves start from the latest solution (the starting guesses if
+    # the evaluations so far were all logged)
+    ss_start = initial_guesses if ss_output is None else ss_output
+
+    lam = 1e-3
+    for it in xrange(max_iter):
+        jac_params = (income_tax_params, ss_params, iterative_params, ss_start)
+        deriv_moments = moment_jacobian(chi_params, h, jac_params,
+                                        num_workers, jac_dir)
+        resid = record['model_moments'] - data_moments
+        JtWJ = np.dot(np.dot(deriv_moments.T, W), deriv_moments)
+        grad = np.dot(np.dot(deriv_moments.T, W), resid)
+
+        improved = False
+        while lam < 1e10:
+            step = -np.linalg.solve(JtWJ + lam * np.diag(np.diag(JtWJ)), grad)
+            # chi must stay positive, so a step may at most halve it
+            step = np.maximum(step, -0.5 * chi_params)
+            chi_trial = chi_params + step
+            record_trial, ss_trial = solve_moments(chi_trial, params,
+                                                   eval_store, data_moments,
+                                                   W, ss_start)
+            distance_trial = record_trial['distance']
+            print 'Gauss-Newton iteration ', it, ', distance = ', distance_trial
+            if distance_trial < distance:
+                improved = True
+                lam = max(lam / 10., 1e-7)
+                break
+            lam *= 10.
+
+        if not improved:
+            print 'Gauss-Newton: no step reduces the distance'
+            break
+        rel_step = np.abs(step / chi_params).max()
+        rel_fall = (distance - distance_trial) / max(distance, 1e-14)
+        chi_params, record, ss_output = chi_trial, record_trial, ss_trial
+        distance = distance_trial
+        if ss_output is not None:
+            ss_start = ss_output
+        if rel_step < tol or rel_fall < tol:
+            break
+
+    return chi_params, ss_output, distance
+
+
+def surrogate_estimate(chi_start, data_moments, W, params, eval_store,
+                       num_workers=None, n_design=None, n_refine=10,
+                       radius=0.5, seed=0, tol=1e-6, initial_guesses=None):
+    '''
+    --------------------------------------------------------------------
+    This function minimizes the weighted, squared deviation between the
+    model and data moments over chi using a surrogate of the model
+    moments.  A space-filling design of SS solves around chi_start is
+    run in parallel and a Gaussian-process regression of the moments
+    on log(chi) is fit to it (and to any successful evaluations already
+    in the evaluation log).  Each refinement minimizes the surrogate
+    objective within a box around the best point so far, solves the
+    true SS at the surrogate minimum and refits.  The box shrinks when
+    the true SS does not improve on the best point.
+
+    INPUTS:
+    chi_start    = [J+S,] vector, starting values of chi_b and chi_n stacked
+    data_moments = [J+2+S,] vector, wealth and labor moments from data
+    W            = [J+2+S,J+2+S] array, weighting matrix
+    params       = length 4 tuple, (income_tax_params, ss_params,
+                   iterative_params, baseline_dir)
+    eval_store   = dictionary, evaluations, from load_eval_log()
+    num_workers  = integer, number of processes for the design solves
+    n_design     = integer, number of design points (default 2(J+S))
+    n_refine     = integer, maximum number of refinement solves
+    radius       = scalar, half width of the design box in log(chi)
+    seed         = integer, seed for the design
+    tol          = scalar, convergence tolerance on the relative change
+                   in the distance
+    initial_guesses = dictionary, SS solution to start the first solve
+                      from, None to load the baseline SS from baseline_dir
+
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
+    solve_moments()
+    design_moments()
+    fit_surrogate()
+    predict_surrogate()
+    log_eval()
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    x_best     = [J+S,] vector, log of the best chi so far
+    ss_best    = dictionary, SS solution at the best chi, None if its
+                 evaluation was logged
+    ss_start   = dictionary, latest SS solution, solves start from it
+    dist_best  = scalar, distance at the best chi
+    u          = [n_design,J+S] array, Latin hypercube sample on [0,1]
+    chi_design = [n_design,J+S] array, chi at the design points
+    X          = [n,J+S] array, log chi at successful evaluations
+    Y          = [n,J+2+S] array, model moments at successful evaluations
+    surrogate  = dictionary, Gaussian-process fit from fit_surrogate()
+    surr_obj   = function, surrogate distance as a function of log chi
+    x_new      = [J+S,] vector, log chi minimizing the surrogate distance
+
+    RETURNS: chi_params, ss_output, distance
+    --------------------------------------------------------------------
+    '''
+    income_tax_params, ss_params, iterative_params, baseline_dir = params
+    data_moments = np.array(data_moments)
+    x_best = np.log(np.array(chi_start, dtype=float))
+    n_params = len(x_best)
+    if n_design is None:
+        n_design = 2 * n_params
+
+    record, ss_best = solve_moments(np.exp(x_best), params, eval_store,
+                                    data_moments, W, initial_guesses)
+    dist_best = record['distance']
+    if record['ss_flag'] != 0:
+        print 'SS not solved at the starting chi, estimation not run'
+        return np.exp(x_best), ss_best, dist_best
+    # solves start from the latest solution (the starting guesses if
+    # the evaluations so far were all logged)
+    ss_start = initial_guesses if ss_best is None else ss_best
+
+    # Latin hypercube design in log(chi) around the starting point,
+    # skipping the points logged in an earlier run
+    prng = np.random.RandomState(seed)
+    u = ((np.argsort(prng.rand(n_design, n_params), axis=0) +
+          prng.rand(n_design, n_params)) / n_design)
+    chi_design = np.exp(x_best + radius * (2. * u - 1.))
+    tasks = [(chi_design[i], params, ss_start, data_moments, W)
+             for i in xrange(n_design)
+             if eval_key(chi_design[i]) not in eval_store['evals']]
+    if num_workers == 1 or len(tasks) == 0:
+        results = [design_moments(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(num_workers)
+        results = pool.map(design_moments, tasks)
+        pool.close()
+        pool.join()
+    for record in results:
+        log_eval(eval_store, record)
+
+    for it in xrange(n_refine):
+        records = [eval_store['evals'][key] for key in eval_store['order']
+                   if eval_store['evals'][key]['ss_flag'] == 0]
+        X = np.log(np.array([rec['chi_params'] for rec in records]))
+        Y = np.array([rec['model_moments'] for rec in records])
+        surrogate = fit_surrogate(X, Y)
+
+        def surr_obj(x):
+            diff = predict_surrogate(surrogate, x.reshape(1, n_params))[0] - data_moments
+            return np.dot(np.dot(diff, W), diff)
+
+        bnds = list(zip(x_best - radius, x_best + radius))
+        x_new = opt.minimize(surr_obj, x_best, method='L-BFGS-B',
+                             bounds=bnds).x
+
+        record, ss_new = solve_moments(np.exp(x_new), params, eval_store,
+                                       data_moments, W, ss_start)
+        print 'Surrogate iteration ', it, ', distance = ', record['distance']
+        if ss_new is not None and ss_new['ss_flag'] == 0:
+            ss_start = ss_new
+        if record['ss_flag'] == 0 and record['distance'] < dist_best:
+            rel_fall = (dist_best - record['distance']) / max(dist_best, 1e-14)
+            x_best, ss_best, dist_best = x_new, ss_new, record['distance']
+            if rel_fall < tol:
+                break
+        else:
+            radius /= 2.
+
+    return np.exp(x_best), ss_best, dist_best
+
+
+def design_moments(args):
+    '''
+    --------------------------------------------------------------------
+    This function solves the SS at a design point of the surrogate
+    calibration and returns the evaluation.  It takes a single tuple so
+    it can be mapped over a worker pool.  The evaluation is not logged
+    here, since the workers do not share the evaluation log; the caller
+    logs it.
+
+    INPUTS:
+    args            = length 5 tuple, (chi_params, params,
+                      initial_guesses, data_moments, W)
+    chi_params      = [J+S,] vector, chi_b and chi_n stacked together
+    params          = length 4 tuple, (income_tax_params, ss_params,
+                      iterative_params, baseline_dir)
+    initial_guesses = dictionary, SS solution to start from
+    data_moments    = [J+2+S,] vector, wealth and labor moments from data
+    W               = [J+2+S,J+2+S] array, weighting matrix
+
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
+    load_eval_log()
+    solve_moments()
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    record = dictionary, evaluation with keys 'chi_params',
+             'model_moments', 'ss_flag' and 'distance'
+
+    RETURNS: record
+    --------------------------------------------------------------------
+    '''
+    chi_params, params, initial_guesses, data_moments, W = args
+
+    record, ss_output = solve_moments(chi_params, params, load_eval_log(None),
+                                      data_moments, W, initial_guesses)
+
+    return record
+
+
+def fit_surrogate(X, Y, nugget=1e-8):
+    '''
+    --------------------------------------------------------------------
+    This function fits a Gaussian-process regression, with a squared
+    exponential kernel and a constant mean, of each model moment on
+    log(chi).  All moments share the kernel, whose length scale is the
+    median distance between the points.
+
+    INPUTS:
+    X      = [n,J+S] array, log chi at the evaluations
+    Y      = [n,J+2+S] array, model moments at the evaluations
+    nugget = scalar, jitter added to the kernel diagonal, relative to
+             its unit variance
+
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION: None
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    sq_dist   = [n,n] array, squared distances between points
+    length    = scalar, kernel length scale
+    K         = [n,n] array, kernel matrix
+    surrogate = dictionary, Gaussian-process fit
+        X      = [n,J+S] array, log chi at the evaluations
+        length = scalar, kernel length scale
+        mean   = [J+2+S,] vector, mean of the moments
+        alpha  = [n,J+2+S] array, kernel weights of the moments
+
+    RETURNS: surrogate
+    --------------------------------------------------------------------
+    '''
+    sq_dist = ((X[:, np.newaxis, :] - X[np.newaxis, :, :]) ** 2).sum(-1)
+    length = np.sqrt(np.median(sq_dist[np.triu_indices(X.shape[0], 1)]))
+    if not np.isfinite(length) or length <= 0.0:
+        length = 1.0
+    K = np.exp(-0.5 * sq_dist / length ** 2) + nugget * np.eye(X.shape[0])
+    mean = Y.mean(0)
+    surrogate = {'X': X, 'length': length, 'mean': mean,
+                 'alpha': np.linalg.solve(K, Y - mean)}
+
+    return surrogate
+
+
+def predict_surrogate(surrogate, X):
+    '''
+    --------------------------------------------------------------------
+    This function predicts the model moments at log(chi) from a
+    Gaussian-process fit.
+
+    INPUTS:
+    surrogate = dictionary, Gaussian-process fit from fit_surrogate()
+    X         = [m,J+S] array, log chi at which to predict
+
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION: None
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    sq_dist = [m,n] array, squared distances to the fitted points
+
+    RETURNS: [m,J+2+S] array of predicted moments
+    --------------------------------------------------------------------
+    '''
+    sq_dist = ((X[:, np.newaxis, :] -
+                surrogate['X'][np.newaxis, :, :]) ** 2).sum(-1)
+
+    return (surrogate['mean'] +
+            np.dot(np.exp(-0.5 * sq_dist / surrogate['length'] ** 2),
+                   surrogate['alpha']))
+
+
+def solve_moments(chi_params, params, eval_store, data_moments, W,
+                  initial_guesses=None):
+    '''
+    --------------------------------------------------------------------
+    This function solves the SS at chi_params and computes the model
+    moments.  The evaluation is appended to the evaluation log.  If
+    chi_params was already evaluated (in this or an earlier run, see
+    load_eval_log()), the logged evaluation is returned instead and the
+    SS is not solved.
+
+    INPUTS:
+    chi_params      = [J+S,] vector, chi_b and chi_n stacked together
+    params          = length 4 tuple, (income_tax_params, ss_params,
+                      iterative_params, baseline_dir)
+    eval_store      = dictionary, evaluations, from load_eval_log()
+    data_moments    = [J+2+S,] vector, wealth and labor moments from data
+    W               = [J+2+S,J+2+S] array, weighting matrix
+    initial_guesses = dictionary, SS solution to start from, None to
+                      start from the baseline SS saved in baseline_dir
+
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
+    eval_key()
+    SS.run_SS()
+    calc_moments()
+    moment_distance()
+    log_eval()
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    key       = tuple, key for the evaluation
+    ss_output = dictionary, SS solution at chi_params, None if the
+                evaluation was logged
+    record    = dictionary, evaluation with keys 'chi_params',
+                'model_moments', 'ss_flag' and 'distance'
+
+    RETURNS: record, ss_output
+    --------------------------------------------------------------------
+    '''
+    income_tax_params, ss_params, iterative_params, baseline_dir = params
+    J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
+                  g_n_ss, tau_payroll, tau_bq, rho, omega_SS, lambdas, \
+                  imm_rates, e, retire, mean_income_data, h_wealth, p_wealth,\
+                  m_wealth, b_ellipse, upsilon, agg_weights = ss_params
+
+    chi_params = np.array(chi_params, dtype=float)
+    key = eval_key(chi_params)
+    if key in eval_store['evals']:
+        record = dict(eval_store['evals'][key])
+        record['distance'] = moment_distance(record, data_moments, W)
+        return record, None
+
+    ss_output = SS.run_SS(income_tax_params, ss_params, iterative_params,
+                          (chi_params[:J], chi_params[J:]), True,
+                          baseline_dir=baseline_dir,
+                          initial_guesses=initial_guesses)
+    record = {'chi_params': chi_params,
+              'model_moments': np.array(calc_moments(ss_output, omega_SS,
+                                                     lambdas, S, J)),
+              'ss_flag': ss_output['ss_flag']}
+    record['distance'] = moment_distance(record, data_moments, W)
+    log_eval(eval_store, record)
+
+    return record, ss_output
+
+
+def moment_jacobian(chi_params, h, params, num_workers=None, jac_dir=None):
+    '''
+    --------------------------------------------------------------------
+    This function computes the derivatives of the model moments with
+    respect to each chi parameter by central finite differences.  The
+    2(J+S) perturbed steady states are independent, so they are solved
+    in parallel, each starting from the SS at the central chi.  The
+    moments from each finished solve are saved to jac_dir so that an
+    interrupted run picks up where it left off.
+
+    INPUTS:
+    chi_params  = [J+S,] vector, chi_b and chi_n stacked together
+    h           = scalar, percent change in each parameter
+    params      = length 4 tuple, (income_tax_params, ss_params,
+                  iterative_params, ss_output)
+    ss_output   = dictionary, SS solution at chi_params
+    num_workers = integer, number of processes (default is the number
+                  of CPUs)
+    jac_dir     = string, path where moments from each perturbation are
+                  saved, None to not save them
+
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
+    perturbed_moments()
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    tasks         = list, perturbations that still need to be solved
+    moments       = dictionary, model moments keyed by (i, direction)
+    col_file      = string, file holding the moments from a perturbation
+    saved         = dictionary, chi and model moments from a perturbation
+    deriv_moments = [J+2+S,J+S] array, derivatives of model moments wrt chi
+
+    OUTPUT:
+    ./jac_dir/moments_<i>_<direction>.pkl
+
+    RETURNS: deriv_moments
+    --------------------------------------------------------------------
+    '''
+    chi_params = np.array(chi_params, dtype=float)
+    if jac_dir is not None:
+        utils.mkdirs(jac_dir)
+
+    tasks = []
+    moments = {}
+    for i in xrange(len(chi_params)):
+        for direction in (-1, 1):
+            chi_perturbed = chi_params.copy()
+            chi_perturbed[i] = chi_params[i] * (1 + direction * h)
+            if jac_dir is not None:
+                col_file = os.path.join(jac_dir, 'moments_' + str(i) + '_' +
+                                        str(direction) + '.pkl')
+                # only reuse results computed at the same chi
+                if os.path.exists(col_file):
+                    saved = pickle.load(open(col_file, "rb"))
+                    if np.array_equal(saved['chi_params'], chi_perturbed):
+                        moments[(i, direction)] = saved['model_moments']
+                        continue
+            tasks.append((i, direction, chi_perturbed, params))
+
+    if num_workers == 1:
+        results = (perturbed_moments(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(num_workers)
+        results = pool.imap_unordered(perturbed_moments, tasks)
+    for i, direction, chi_perturbed, model_moments in results:
+        print 'Finished perturbation ', i, direction
+        moments[(i, direction)] = model_moments
+        if jac_dir is not None:
+            col_file = os.path.join(jac_dir, 'moments_' + str(i) + '_' +
+                                    str(direction) + '.pkl')
+            saved = {'chi_params': chi_perturbed,
+                     'model_moments': model_moments}
+            pickle.dump(saved, open(col_file, "wb"))
+    if num_workers != 1:
+        pool.close()
+        pool.join()
+
+    model_moments_low = np.array([moments[(i, -1)] for i in xrange(len(chi_params))])
+    model_moments_high = np.array([moments[(i, 1)] for i in xrange(len(chi_params))])
+    deriv_moments = (model_moments_high - model_moments_low).T/(2.*h*chi_params)
+
+    return deriv_moments
+
+
+def perturbed_moments(args):
+    '''
+    --------------------------------------------------------------------
+    This function solves the SS at a perturbed chi, starting from the SS
+    solution at the central chi, and returns the model moments.  It
+    takes a single tuple so it can be mapped over a worker pool.
+
+    INPUTS:
+    args          = length 4 tuple, (i, direction, chi_perturbed, params)
+    i             = integer, index of the perturbed parameter
+    direction     = integer, -1 or 1 for a decrease or increase
+    chi_perturbed = [J+S,] vector, perturbed chi_b and chi_n stacked together
+    params        = length 4 tuple, (income_tax_params, ss_params,
+                    iterative_params, ss_output)
+
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
+    SS.run_SS()
+    calc_moments()
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    ss_output     = dictionary, SS solution at the central chi
+    ss_perturbed  = dictionary, SS solution at the perturbed chi
+    model_moments = [J+2+S,] array, moments from the model solution
+
+    RETURNS: i, direction, chi_perturbed, model_moments
+    --------------------------------------------------------------------
+    '''
+    i, direction, chi_perturbed, params = args
+    income_tax_params, ss_params, iterative_params, ss_output = params
+    J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
+                  g_n_ss, tau_payroll, tau_bq, rho, omega_SS, lambdas, \
+                  imm_rates, e, retire, mean_income_data, h_wealth, p_wealth,\
+                  m_wealth, b_ellipse, upsilon, agg_weights = ss_params
+
+    chi_params_list = (chi_perturbed[:J], chi_perturbed[J:])
+    ss_perturbed = SS.run_SS(income_tax_params, ss_params, iterative_params,
+                             chi_params_list, True, initial_guesses=ss_output)
+    model_moments = calc_moments(ss_perturbed, omega_SS, lambdas, S, J)
+
+    return i, direction, chi_perturbed, model_moments
+
+
 def minstat(chi_guesses, *args):
     '''
     --------------------------------------------------------------------
     This function generates the weighted sum of squared differences
-    between the model and data moments.
+    between the model and data moments.  Model moments are memoized by
+    the exact chi vector, so points the minimizer revisits are not
+    re-solved, and each new evaluation is appended to the evaluation
+    log.
 
     INPUTS:
     chi_guesses = [J+S,] vector, initial guesses of chi_b and chi_n stacked together
-    arg         = length 6 tuple, variables needed for minimizer
+    arg         = length 9 tuple, variables needed for minimizer
 
 
     OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
     SS.run_SS()
     calc_moments()
+    moment_distance()
+    log_eval()
 
     OBJECTS CREATED WITHIN FUNCTION:
+    eval_store    = dictionary, evaluations so far, from load_eval_log()
+    key           = tuple, chi_guesses used as key for evaluations
     ss_output     = dictionary, variables from SS of model
     model_moments = [J+2+S,] array, moments from the model solution
     distance      = scalar, weighted, squared deviation between data and model moments
@@ -235,42 +822,40 @@ def minstat(chi_guesses, *args):
     --------------------------------------------------------------------
     '''
 
-    data_moments, W, income_tax_params, ss_params, iterative_params, chi_params, baseline_dir = args
+    data_moments, W, income_tax_params, ss_params, iterative_params, \
+        chi_params, baseline_dir, eval_store, baseline_solution = args
     J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
                   g_n_ss, tau_payroll, tau_bq, rho, omega_SS, lambdas, \
                   imm_rates, e, retire, mean_income_data, h_wealth, p_wealth,\
-                  m_wealth, b_ellipse, upsilon = ss_params
+                  m_wealth, b_ellipse, upsilon, agg_weights = ss_params
+
+    key = eval_key(chi_guesses)
+    if key in eval_store['evals']:
+        record = eval_store['evals'][key]
+        distance = moment_distance(record, data_moments, W)
+        print 'DATA and MODEL DISTANCE (logged): ', distance
+        return distance
+
     chi_b = chi_guesses[:J]
     chi_n = chi_guesses[J:]
     chi_params = (chi_b, chi_n)
-    ss_output = SS.run_SS(income_tax_params, ss_params, iterative_params, chi_params, True, baseline_dir)
+    ss_output = SS.run_SS(income_tax_params, ss_params, iterative_params,
+                          chi_params, True, baseline_dir=baseline_dir,
+                          baseline_solution=baseline_solution)
 
     model_moments = calc_moments(ss_output, omega_SS, lambdas, S, J)
+    record = {'chi_params': np.array(key), 'model_moments': np.array(model_moments),
+              'ss_flag': ss_output['ss_flag']}
 
     # distance with levels
-    if ss_output['ss_flag'] == 0:
-        distance = np.dot(np.dot((np.array(model_moments) - np.array(data_moments)).T,W),
-                   np.array(model_moments) - np.array(data_moments))
-    else:
-        distance = 1e14
+    distance = moment_distance(record, data_moments, W)
 
     #distance = ((np.array(model_moments) - np.array(data_moments))**2).sum()
     print 'DATA and MODEL DISTANCE: ', distance
 
     # save results along the way
-    bh_along = np.reshape(np.append(chi_guesses,distance),(1,88))
-    # x = chi_guesses
-    # f = distance
-    # fun_dict = {'x':x,'f':f}
-    # bh_out = np.append(bh_output, bh_along,axis=1)
-    # bh_output = bh_out
-    # print bh_output.shape
-    columns = list(xrange(88))
-    df = pd.DataFrame(bh_along, columns=columns)
-    bh_output.loc[len(bh_output),:] = bh_along
-    pickle.dump(bh_output, open( "estimation_output_along.pkl", "wb" ) )
-
-
+    record['distance'] = distance
+    log_eval(eval_store, record)
 
     # # distance with percentage diffs
     # distance = (((model_moments - data_moments)/data_moments)**2).sum()
@@ -297,12 +882,9 @@ def calc_moments(ss_output, omega_SS, lambdas, S, J):
     OBJECTS CREATED WITHIN FUNCTION:
     model_wealth_moments = [J+2,] array, wealth moments from the model
     model_labor_moments  = [S,] array, labor moments from the model
-    model_moments        = [J+2+S,] array, wealth and data moments from the model solution
-    distance             = scalar, weighted, squared deviation between data and model moments
 
-    RETURNS: distance
-
-    RETURNS: model_moments
+    RETURNS: model_moments ([J+2+S,] list, wealth and labor moments
+             from the model solution)
     --------------------------------------------------------------------
     '''
     # unpack relevant SS variables
@@ -320,3 +902,158 @@ def calc_moments(ss_output, omega_SS, lambdas, S, J):
     model_moments = list(model_wealth_moments.flatten()) + list(model_labor_moments.flatten())
 
     return model_moments
+
+
+def moment_distance(record, data_moments, W):
+    '''
+    --------------------------------------------------------------------
+    This function computes the weighted, squared deviation between the
+    model moments of an evaluation and the data moments.
+
+    INPUTS:
+    record       = dictionary, evaluation with keys 'model_moments' and
+                   'ss_flag'
+    data_moments = [J+2+S,] vector, wealth and labor moments from data
+    W            = [J+2+S,J+2+S] array, weighting matrix
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION: None
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    diff     = [J+2+S,] vector, model less data moments
+    distance = scalar, weighted, squared deviation between data and model moments
+
+    RETURNS: distance
+    --------------------------------------------------------------------
+    '''
+    if record['ss_flag'] != 0:
+        return 1e14
+    diff = np.array(record['model_moments']) - np.array(data_moments)
+    distance = np.dot(np.dot(diff.T, W), diff)
+
+    return distance
+
+
+def eval_key(chi_params):
+    '''
+    --------------------------------------------------------------------
+    This function returns the key under which an evaluation at
+    chi_params is stored.  Only an exact repeat of chi_params matches.
+
+    INPUTS:
+    chi_params = [J+S,] vector, chi_b and chi_n stacked together
+
+    RETURNS: tuple of floats
+    --------------------------------------------------------------------
+    '''
+    return tuple(np.asarray(chi_params, dtype=float).ravel())
+
+
+def load_eval_log(log_file):
+    '''
+    --------------------------------------------------------------------
+    This function reads the evaluations appended to log_file by
+    log_eval() in a previous run.  A partly written last record (e.g.
+    from an interrupted run) is dropped.
+
+    INPUTS:
+    log_file = string, path of the evaluation log, None to not keep a log
+
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
+    eval_key()
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    eval_store = dictionary, evaluations
+        log_file = string, path of the evaluation log
+        evals    = dictionary, evaluation records keyed by eval_key()
+        order    = list, keys in the order evaluated
+    record     = dictionary, one evaluation with keys 'chi_params',
+                 'model_moments', 'ss_flag' and 'distance'
+
+    RETURNS: eval_store
+    --------------------------------------------------------------------
+    '''
+    eval_store = {'log_file': log_file, 'evals': {}, 'order': []}
+    if log_file is None or not os.path.exists(log_file):
+        return eval_store
+
+    with open(log_file, "rb") as f:
+        while True:
+            try:
+                record = pickle.load(f)
+            except (EOFError, pickle.UnpicklingError, ValueError):
+                break
+            key = eval_key(record['chi_params'])
+            if key not in eval_store['evals']:
+                eval_store['order'].append(key)
+            eval_store['evals'][key] = record
+    print 'Loaded ', len(eval_store['order']), ' evaluations from ', log_file
+
+    return eval_store
+
+
+def log_eval(eval_store, record):
+    '''
+    --------------------------------------------------------------------
+    This function adds an evaluation to eval_store and appends it to the
+    evaluation log.  Only the new record is written, so the cost of
+    saving does not grow with the number of evaluations.
+
+    INPUTS:
+    eval_store = dictionary, evaluations, from load_eval_log()
+    record     = dictionary, one evaluation with keys 'chi_params',
+                 'model_moments', 'ss_flag' and 'distance'
+
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
+    eval_key()
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    key = tuple, key for the evaluation
+
+    OUTPUT:
+    ./eval_store['log_file']
+
+    RETURNS: None
+    --------------------------------------------------------------------
+    '''
+    key = eval_key(record['chi_params'])
+    if key not in eval_store['evals']:
+        eval_store['order'].append(key)
+    eval_store['evals'][key] = record
+
+    if eval_store['log_file'] is not None:
+        utils.mkdirs(os.path.dirname(os.path.abspath(eval_store['log_file'])))
+        with open(eval_store['log_file'], "ab") as f:
+            pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+
+
+def best_logged_chi(eval_store, data_moments, W, chi_default):
+    '''
+    --------------------------------------------------------------------
+    This function returns the logged chi with the smallest distance,
+    to seed a resumed calibration.
+
+    INPUTS:
+    eval_store   = dictionary, evaluations, from load_eval_log()
+    data_moments = [J+2+S,] vector, wealth and labor moments from data
+    W            = [J+2+S,J+2+S] array, weighting matrix
+    chi_default  = [J+S,] vector, chi returned if nothing was logged
+
+
+    OTHER FUNCTIONS AND FILES CALLED BY THIS FUNCTION:
+    moment_distance()
+
+    OBJECTS CREATED WITHIN FUNCTION:
+    distances = list, distance of each logged evaluation
+
+    RETURNS: [J+S,] vector
+    --------------------------------------------------------------------
+    '''
+    if len(eval_store['order']) == 0:
+        return np.array(chi_default, dtype=float)
+
+    distances = [moment_distance(eval_store['evals'][key], data_moments, W)
+                 for key in eval_store['order']]
+
+    return np.array(eval_store['order'][int(np.argmin(distances))])
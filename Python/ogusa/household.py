@@ -24,7 +24,8 @@ def marg_ut_cons(c, sigma):
     Computation of marginal utility of consumption.
     Inputs:
         c     = [T,S,J] array, household consumption
-        sigma = scalar, coefficient of relative risk aversion
+        sigma = scalar (or array that broadcasts against c),
+                coefficient of relative risk aversion
     Functions called: None
     Objects in function:
         output = [T,S,J] array, marginal utility of consumption
@@ -35,8 +36,16 @@ def marg_ut_cons(c, sigma):
     # epsilon = 0.0001
     epsilon = 0.002
     cvec_cnstr = c < epsilon
+    if np.ndim(sigma) > 0:
+        # sigma varies (e.g. by scenario in a batched SS solve)
+        sigma = np.broadcast_to(sigma, c.shape)
+        sigma_cnstr = sigma[cvec_cnstr]
+        sigma = sigma[~cvec_cnstr]
+    else:
+        sigma_cnstr = sigma
     MU_c = np.zeros(c.shape)
     MU_c[~cvec_cnstr] = c[~cvec_cnstr] ** (-sigma)
+    sigma = sigma_cnstr
     b2 = (-sigma * (epsilon ** (-sigma - 1))) / 2
     b1 = (epsilon ** (-sigma)) - 2 * b2 * epsilon
     MU_c[cvec_cnstr] = 2 * b2 * c[cvec_cnstr] + b1
@@ -194,6 +203,7 @@ def FOC_savings(r, w, b, b_splus1, b_splus2, n, BQ, factor, T_H,
         marg_ut_cons
         tax.total_taxes
         tax.MTR_capital
+        tax.mtr_wealth
 
     Objects in function:
         tax1 = [S,J] array, net taxes in the current period
@@ -219,16 +229,14 @@ def FOC_savings(r, w, b, b_splus1, b_splus2, n, BQ, factor, T_H,
     # since in the euler equation, the coefficient on the marginal
     # utility of consumption for this term will be zero (since rho is
     # one).
-    e_extended = np.array(list(e) + [0])
-    n_extended = np.array(list(n) + [0])
-    etr_params_extended = np.append(etr_params,
-                                    np.reshape(etr_params[-1, :],
-                                               (1, etr_params.shape[1])),
-                                    axis=0)[1:, :]
-    mtry_params_extended = np.append(mtry_params,
-                                     np.reshape(mtry_params[-1, :],
-                                                (1, mtry_params.shape[1])),
-                                     axis=0)[1:, :]
+    # (the extended arrays keep any trailing axes, e.g. the columns of a
+    # batched SS solve)
+    e_extended = np.append(e, np.zeros((1,) + np.shape(e)[1:]), axis=0)
+    n_extended = np.append(n, np.zeros((1,) + np.shape(n)[1:]), axis=0)
+    etr_params_extended = np.append(etr_params, etr_params[-1:],
+                                    axis=0)[1:]
+    mtry_params_extended = np.append(mtry_params, mtry_params[-1:],
+                                     axis=0)[1:]
     if method == 'TPI':
         r_extended = np.append(r, r[-1])
         w_extended = np.append(w, w[-1])
@@ -264,9 +272,7 @@ def FOC_savings(r, w, b, b_splus1, b_splus2, n, BQ, factor, T_H,
     deriv = ((1 + r_extended[1:]) - r_extended[1:] *
              (tax.MTR_capital(r_extended[1:], w_extended[1:], b_splus1,
                               n_extended[1:], factor, mtr_cap_params)) -
-             (tax.tau_w_prime(b_splus1, (h_wealth, p_wealth, m_wealth)) *
-             b_splus1) - tax.tau_wealth(b_splus1, (h_wealth, p_wealth,
-                                                   m_wealth)))
+             tax.mtr_wealth(b_splus1, (h_wealth, p_wealth, m_wealth)))
 
     savings_ut = (rho * np.exp(-sigma * g_y) * chi_b * b_splus1 **
                   (-sigma))
@@ -4,6 +4,14 @@ Last updated 9/21/2016
 
 Functions to compute various measures of inequality.
 
+Weighted distributions are indexed once by weighted_dist(), which sorts
+the values and stores cumulative population and value shares.  The
+percentile, share, Gini and log-variance functions below then answer
+queries on that structure with binary searches rather than by
+re-sorting and scanning the data for each measure.  The weights may
+have leading dimensions (e.g. bootstrap replicates) that are carried
+through every query.
+
 This python files calls:
 
 
@@ -20,127 +28,404 @@ from pkg_resources import resource_stream, Requirement
 EPSILON = 1e-10
 PATH_EXISTS_ERRNO = 17
 
-def the_inequalizer(dist, pop_weights, ability_weights, factor, S, J):
+def weighted_dist(values, weights, presorted=False):
     '''
     --------------------------------------------------------------------
-    Generates three measures of inequality.
+    Sorts a weighted distribution once and stores the cumulative sums
+    used by the inequality measures.
 
     Inputs:
-        dist            = [S,J] array, distribution of endogenous variables over age and lifetime income group
-        pop_weights     = [S,] vector, fraction of population by each age
-        ability_weights = [J,] vector, fraction of population for each lifetime income group
-        factor          = scalar, factor relating model units to dollars
-        S               = integer, number of economically active periods in lifetime
-        J               = integer, number of ability types
+        values    = [N,] or [...,N] array, values of the distribution
+        weights   = [...,N] array, weight of each value
+        presorted = boolean, =True if values are already in ascending
+                    order along the last axis
 
     Functions called: None
 
     Objects in function:
-        weights           = [S,J] array, fraction of population for each age and lifetime income group
-        flattened_dist    = [S*J,] vector, vectorized dist
-        flattened_weights = [S*J,] vector, vectorized weights
-        sort_dist         = [S*J,] vector, ascending order vector of dist
-        loc_90th          = integer, index of 90th percentile
-        loc_10th          = integer, index of 10th percentile
-        loc_99th          = integer, index of 99th percentile
+        idx = [...,N] array, indices that sort values
+        wd  = dictionary, the indexed distribution
+            values       = [...,N] array, values in ascending order
+            weights      = [...,N] array, weights in the same order
+            p            = [...,N] array, cumulative population share
+            nu           = [...,N] array, cumulative share of the total
+                           value
+            total_weight = [...] array, sum of weights
+            total        = [...] array, weighted sum of values
+
+    Returns: wd
+    --------------------------------------------------------------------
+    '''
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    values = np.broadcast_to(values, np.broadcast(values, weights).shape)
+    weights = np.broadcast_to(weights, values.shape)
+    if not presorted:
+        idx = np.argsort(values, axis=-1, kind='mergesort')
+        values = np.take_along_axis(values, idx, axis=-1)
+        weights = np.take_along_axis(weights, idx, axis=-1)
+
+    cum_weights = np.cumsum(weights, axis=-1)
+    cum_values = np.cumsum(weights * values, axis=-1)
+    wd = {'values': values, 'weights': weights,
+          'p': cum_weights / cum_weights[..., -1:],
+          'nu': cum_values / cum_values[..., -1:],
+          'total_weight': cum_weights[..., -1],
+          'total': cum_values[..., -1]}
+
+    return wd
+
+
+def dist_index(wd, q, side='left'):
+    '''
+    --------------------------------------------------------------------
+    Finds the number of observations whose cumulative population share
+    is below each of the shares in q.
+
+    Inputs:
+        wd   = dictionary, distribution from weighted_dist()
+        q    = scalar or [K,] vector, population shares in [0,1]
+        side = string, 'left' counts p < q, 'right' counts p <= q
+
+    Functions called: None
 
-    Returns: measure of inequality
+    Objects in function:
+        p      = [R,N] array, cumulative population shares, leading
+                 dimensions flattened
+        offset = [R,1] array, shift that makes p increasing across rows
+        idx    = [...,K] array, number of observations below q
+
+    Returns: idx
     --------------------------------------------------------------------
     '''
+    q = np.atleast_1d(np.asarray(q, dtype=float))
+    p = wd['p']
+    if p.ndim == 1:
+        return np.searchsorted(p, q, side=side)
+
+    # Each row of p is increasing and in [0,1], so shifting rows apart
+    # makes the whole array sorted and all rows are searched at once
+    N = p.shape[-1]
+    p = p.reshape(-1, N)
+    R = p.shape[0]
+    offset = 2.0 * np.arange(R).reshape(R, 1)
+    idx = (np.searchsorted((p + offset).ravel(), q + offset, side=side) -
+           N * np.arange(R).reshape(R, 1))
+    idx = np.clip(idx, 0, N)
+
+    # The shift rounds p, so move each index to where the comparison
+    # with the unshifted p holds, as np.searchsorted gives for one row
+    p_pad = np.concatenate((np.full((R, 1), -np.inf), p,
+                            np.full((R, 1), np.inf)), axis=1)
+    while True:
+        p_below = np.take_along_axis(p_pad, idx, axis=1)
+        p_above = np.take_along_axis(p_pad, idx + 1, axis=1)
+        if side == 'left':
+            move = (p_above < q).astype(int) - (p_below >= q).astype(int)
+        else:
+            move = (p_above <= q).astype(int) - (p_below > q).astype(int)
+        if not move.any():
+            break
+        idx += move
+
+    return idx.reshape(wd['p'].shape[:-1] + q.shape)
+
+
+def dist_nearest(wd, q):
+    '''
+    --------------------------------------------------------------------
+    Finds the observation whose cumulative population share is closest
+    to each of the shares in q.
+
+    Inputs:
+        wd = dictionary, distribution from weighted_dist()
+        q  = scalar or [K,] vector, population shares in [0,1]
 
-    weights = np.tile(pop_weights.reshape(S, 1), (1, J)) * \
-    ability_weights.reshape(1, J)
-    flattened_dist = dist.flatten()
-    flattened_weights = weights.flatten()
-    idx = np.argsort(flattened_dist)
-    sort_dist = flattened_dist[idx]
-    sort_weights = flattened_weights[idx]
-    cum_weights = np.cumsum(sort_weights)
+    Functions called:
+        dist_index
 
-    # gini
-    p = np.cumsum(sort_weights)
-    nu = np.cumsum(sort_dist*sort_weights)
-    nu = nu/nu[-1]
-    gini_coeff = (nu[1:]*p[:-1]).sum() - (nu[:-1] * p[1:]).sum()
+    Objects in function:
+        N     = integer, number of observations
+        upper = [...,K] array, first observation with p >= q
+        lower = [...,K] array, observation before upper
+        idx   = [...,K] array, index of the nearest observation
 
-    # variance
-    ln_dist = np.log(sort_dist*factor) # it is scale invariant, but use factor anyway
-    weight_mean = (ln_dist*sort_weights).sum()/sort_weights.sum()
-    var_ln_dist = ((sort_weights*((ln_dist-weight_mean)**2)).sum())*(1./(sort_weights.sum()))
+    Returns: idx
+    --------------------------------------------------------------------
+    '''
+    N = wd['p'].shape[-1]
+    upper = np.minimum(dist_index(wd, q), N - 1)
+    lower = np.maximum(upper - 1, 0)
+    q = np.atleast_1d(np.asarray(q, dtype=float))
+    p_upper = np.take_along_axis(wd['p'], upper, axis=-1)
+    p_lower = np.take_along_axis(wd['p'], lower, axis=-1)
+    idx = np.where(np.abs(p_lower - q) <= np.abs(p_upper - q), lower,
+                   upper)
 
+    return idx
 
-    # 90/10 ratio
-    loc_90th = np.argmin(np.abs(cum_weights - .9))
-    loc_10th = np.argmin(np.abs(cum_weights - .1))
-    ratio_90_10 = sort_dist[loc_90th] / sort_dist[loc_10th]
 
-    # top 10% share
-    top_10_share= (sort_dist[loc_90th:] * sort_weights[loc_90th:]
-           ).sum() / (sort_dist * sort_weights).sum()
+def dist_percentile(wd, q):
+    '''
+    --------------------------------------------------------------------
+    Returns the value of the first observation at or above each of the
+    population shares in q.
 
-    # top 1% share
-    loc_99th = np.argmin(np.abs(cum_weights - .99))
-    top_1_share = (sort_dist[loc_99th:] * sort_weights[loc_99th:]
-           ).sum() / (sort_dist * sort_weights).sum()
+    Inputs:
+        wd = dictionary, distribution from weighted_dist()
+        q  = scalar or [K,] vector, population shares in [0,1]
 
-    # calculate percentile shares (percentiles based on lambdas input)
-    dist_weight = (sort_weights*sort_dist)
-    total_dist_weight = dist_weight.sum()
-    cumsum = np.cumsum(sort_weights)
-    dist_sum = np.zeros((J,))
-    cum_weights = ability_weights.cumsum()
-    for i in range(J):
-        cutoff = sort_weights.sum() / (1./cum_weights[i])
-        dist_sum[i] = ((dist_weight[cumsum < cutoff].sum())/total_dist_weight)
+    Functions called:
+        dist_index
 
+    Objects in function:
+        idx = [...,K] array, first observation with p >= q
 
-    dist_share = np.zeros((J,))
-    dist_share[0] = dist_sum[0]
-    dist_share[1:] = dist_sum[1:]-dist_sum[0:-1]
+    Returns: [...,K] array of percentiles
+    --------------------------------------------------------------------
+    '''
+    idx = np.minimum(dist_index(wd, q), wd['p'].shape[-1] - 1)
+    return np.take_along_axis(wd['values'], idx, axis=-1)
 
-    return np.append([dist_share], [gini_coeff,var_ln_dist])
 
-def gini(dist, weights):
+def dist_share_below(wd, idx):
     '''
     --------------------------------------------------------------------
-    Calculates the gini coefficient.
+    Returns the share of the total value held by the first idx
+    observations.
+
+    Inputs:
+        wd  = dictionary, distribution from weighted_dist()
+        idx = [...,K] array, number of observations, e.g. from
+              dist_index()
+
+    Functions called: None
+
+    Objects in function:
+        nu_pad = [...,N+1] array, cumulative value shares starting at 0
+
+    Returns: [...,K] array of shares
     --------------------------------------------------------------------
     '''
+    nu = wd['nu']
+    nu_pad = np.concatenate((np.zeros(nu.shape[:-1] + (1,)), nu), axis=-1)
+    return np.take_along_axis(nu_pad, idx, axis=-1)
 
-    flattened_dist = dist.flatten()
-    flattened_weights = weights.flatten()
-    idx = np.argsort(flattened_dist)
-    sort_dist = flattened_dist[idx]
-    sort_weights = flattened_weights[idx]/flattened_weights.sum()
-    p = np.cumsum(sort_weights)
 
-    # gini
-    nu = np.cumsum(sort_dist*sort_weights)
-    nu = nu/nu[-1]
-    gini_coeff = (nu[1:]*p[:-1]).sum() - (nu[:-1] * p[1:]).sum()
+def dist_gini(wd):
+    '''
+    --------------------------------------------------------------------
+    Calculates the Gini coefficient of an indexed distribution.
 
-    return gini_coeff
+    Inputs:
+        wd = dictionary, distribution from weighted_dist()
 
-def ninety_ten(dist, weights):
+    Functions called: None
+
+    Objects in function:
+        p  = [...,N] array, cumulative population share
+        nu = [...,N] array, cumulative value share
+
+    Returns: [...] array, gini coefficient
+    --------------------------------------------------------------------
+    '''
+    p = wd['p']
+    nu = wd['nu']
+    return ((nu[..., 1:] * p[..., :-1]).sum(-1) -
+            (nu[..., :-1] * p[..., 1:]).sum(-1))
+
+
+def dist_var_log(wd, factor=1.0, ddof=0):
     '''
     --------------------------------------------------------------------
-    Calculates ratio of the 90th to 10th percentile.
+    Calculates the weighted variance of the log of the positive values
+    of an indexed distribution.
+
+    Inputs:
+        wd     = dictionary, distribution from weighted_dist()
+        factor = scalar, factor relating model units to dollars
+        ddof   = scalar, subtracted from the sum of weights in the
+                 denominator
+
+    Functions called: None
+
+    Objects in function:
+        pos         = [...,N] array, =True if value is positive
+        ln_dist     = [...,N] array, log of positive values (0 otherwise)
+        weights_pos = [...,N] array, weights of positive values
+        sum_wgt     = [...] array, sum of weights of positive values
+        weight_mean = [...] array, weighted mean of log values
+        var_ln_dist = [...] array, variance of log values
+
+    Returns: var_ln_dist
     --------------------------------------------------------------------
     '''
-    flattened_dist = dist.flatten()
-    flattened_weights = weights.flatten()
-    idx = np.argsort(flattened_dist)
-    sort_dist = flattened_dist[idx]
-    sort_weights = flattened_weights[idx]
-    cum_weights = np.cumsum(sort_weights)
+    pos = wd['values'] > 0.0
+    ln_dist = np.log(np.where(pos, wd['values'] * factor, 1.0))
+    weights_pos = np.where(pos, wd['weights'], 0.0)
+    sum_wgt = weights_pos.sum(-1)
+    weight_mean = (weights_pos * ln_dist).sum(-1) / sum_wgt
+    var_ln_dist = ((weights_pos * (ln_dist - weight_mean[..., np.newaxis])
+                    ** 2).sum(-1) / (sum_wgt - ddof))
 
+    return var_ln_dist
 
-    # 90/10 ratio
-    loc_90th = np.argmin(np.abs(cum_weights - .9))
-    loc_10th = np.argmin(np.abs(cum_weights - .1))
-    ratio_90_10 = sort_dist[loc_90th] / sort_dist[loc_10th]
 
-    return ratio_90_10
+def dist_from_weights(dist, weights):
+    '''
+    --------------------------------------------------------------------
+    Indexes a distribution whose trailing dimensions match the weights.
+    Any leading dimensions of dist (e.g. parameter values or time
+    periods) are kept as a batch, and all of its distributions are
+    sorted in a single call.
+
+    Inputs:
+        dist    = [...,S,J] array (or any trailing shape matching
+                  weights), distribution of endogenous variables
+        weights = [S,J] array, population weights
+
+    Functions called:
+        weighted_dist
+
+    Objects in function:
+        batch_shape = tuple, leading dimensions of dist
+
+    Returns: dictionary, indexed distribution from weighted_dist()
+    --------------------------------------------------------------------
+    '''
+    dist = np.asarray(dist, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    batch_shape = dist.shape[:dist.ndim - weights.ndim]
+
+    return weighted_dist(dist.reshape(batch_shape + (-1,)),
+                         weights.reshape(-1))
+
+
+def inequality_measures(dist, weights, cum_bins=None, factor=1.0):
+    '''
+    --------------------------------------------------------------------
+    Computes all the inequality measures of a distribution from a
+    single sort.
+
+    Inputs:
+        dist     = [...,S,J] array (or any trailing shape matching
+                   weights), distribution of endogenous variables
+        weights  = [S,J] array, population weights
+        cum_bins = [K,] vector, cumulative population shares at which to
+                   split the distribution into groups, None to skip the
+                   group shares
+        factor   = scalar, factor relating model units to dollars
+
+    Functions called:
+        dist_from_weights
+        dist_nearest
+        dist_share_below
+        dist_gini
+        dist_var_log
+
+    Objects in function:
+        wd       = dictionary, indexed distribution
+        loc      = [...,3] array, index of the 10th, 90th and 99th
+                   percentiles
+        measures = dictionary, inequality measures
+            gini         = [...] array, gini coefficient
+            var_log      = [...] array, variance of log of dist
+            ratio_90_10  = [...] array, ratio of 90th to 10th percentile
+            top_10_share = [...] array, share held by the top 10%
+            top_1_share  = [...] array, share held by the top 1%
+            shares       = [...,K] array, share held by each group
+
+    Returns: measures
+    --------------------------------------------------------------------
+    '''
+    wd = dist_from_weights(dist, weights)
+
+    loc = dist_nearest(wd, [.1, .9, .99])
+    pct = np.take_along_axis(wd['values'], loc, axis=-1)
+    top = 1.0 - dist_share_below(wd, loc[..., 1:])
+    measures = {'gini': dist_gini(wd),
+                'var_log': dist_var_log(wd, factor),
+                'ratio_90_10': pct[..., 1] / pct[..., 0],
+                'top_10_share': top[..., 0],
+                'top_1_share': top[..., 1]}
+
+    if cum_bins is not None:
+        dist_sum = dist_share_below(wd, dist_index(wd, cum_bins))
+        measures['shares'] = np.diff(np.concatenate(
+            (np.zeros(dist_sum.shape[:-1] + (1,)), dist_sum), axis=-1),
+            axis=-1)
+
+    return measures
+
+
+def the_inequalizer(dist, pop_weights, ability_weights, factor, S, J):
+    '''
+    --------------------------------------------------------------------
+    Generates three measures of inequality.
+
+    Inputs:
+        dist            = [S,J] array, distribution of endogenous variables over age and lifetime income group,
+                          or [...,S,J] array to compute the measures for a batch of distributions at once
+        pop_weights     = [S,] vector, fraction of population by each age
+        ability_weights = [J,] vector, fraction of population for each lifetime income group
+        factor          = scalar, factor relating model units to dollars
+        S               = integer, number of economically active periods in lifetime
+        J               = integer, number of ability types
+
+    Functions called:
+        dist_from_weights
+        dist_index
+        dist_share_below
+        dist_gini
+        dist_var_log
+
+    Objects in function:
+        weights     = [S,J] array, fraction of population for each age and lifetime income group
+        wd          = dictionary, indexed distribution of dist
+        dist_sum    = [...,J] array, share of dist held below each cutoff
+        dist_share  = [...,J] array, share of dist held by each percentile group
+        gini_coeff  = [...] array, gini coefficient
+        var_ln_dist = [...] array, variance of log of dist
+
+    Returns: [...,J+2] array, measures of inequality
+    --------------------------------------------------------------------
+    '''
+
+    weights = pop_weights.reshape(S, 1) * ability_weights.reshape(1, J)
+    wd = dist_from_weights(dist, weights)
+
+    # gini
+    gini_coeff = dist_gini(wd)
+
+    # variance
+    var_ln_dist = dist_var_log(wd, factor) # it is scale invariant, but use factor anyway
+
+    # calculate percentile shares (percentiles based on lambdas input)
+    dist_sum = dist_share_below(wd, dist_index(wd, ability_weights.cumsum()))
+    dist_share = np.diff(np.concatenate(
+        (np.zeros(dist_sum.shape[:-1] + (1,)), dist_sum), axis=-1), axis=-1)
+
+    return np.concatenate((dist_share, gini_coeff[..., np.newaxis],
+                           var_ln_dist[..., np.newaxis]), axis=-1)
+
+def gini(dist, weights):
+    '''
+    --------------------------------------------------------------------
+    Calculates the gini coefficient.  Leading dimensions of dist beyond
+    those of weights are treated as a batch.
+    --------------------------------------------------------------------
+    '''
+    wd = dist_from_weights(dist, weights)
+
+    return dist_gini(wd)
+
+def ninety_ten(dist, weights):
+    '''
+    --------------------------------------------------------------------
+    Calculates ratio of the 90th to 10th percentile.
+    --------------------------------------------------------------------
+    '''
+    return inequality_measures(dist, weights)['ratio_90_10']
 
 
 def top_1(dist, weights):
@@ -149,18 +434,10 @@ def top_1(dist, weights):
     Calculates the top 1% share
     --------------------------------------------------------------------
     '''
-    flattened_dist = dist.flatten()
-    flattened_weights = weights.flatten()
-    idx = np.argsort(flattened_dist)
-    sort_dist = flattened_dist[idx]
-    sort_weights = flattened_weights[idx]
-    cum_weights = np.cumsum(sort_weights)
-
+    wd = dist_from_weights(dist, weights)
 
     # top 1% share
-    loc_99th = np.argmin(np.abs(cum_weights - .99))
-    top_1_share = (sort_dist[loc_99th:] * sort_weights[loc_99th:]
-           ).sum() / (sort_dist * sort_weights).sum()
+    top_1_share = 1.0 - dist_share_below(wd, dist_nearest(wd, .99))[..., 0]
 
     return top_1_share
 
@@ -171,18 +448,10 @@ def top_10(dist, weights):
     Calculates the top 10% share
     --------------------------------------------------------------------
     '''
-    flattened_dist = dist.flatten()
-    flattened_weights = weights.flatten()
-    idx = np.argsort(flattened_dist)
-    sort_dist = flattened_dist[idx]
-    sort_weights = flattened_weights[idx]
-    cum_weights = np.cumsum(sort_weights)
-
+    wd = dist_from_weights(dist, weights)
 
     # top 10% share
-    loc_90th = np.argmin(np.abs(cum_weights - .9))
-    top_10_share= (sort_dist[loc_90th:] * sort_weights[loc_90th:]
-           ).sum() / (sort_dist * sort_weights).sum()
+    top_10_share = 1.0 - dist_share_below(wd, dist_nearest(wd, .9))[..., 0]
 
     return top_10_share
 
@@ -193,15 +462,9 @@ def var_log(dist, weights,factor):
     Calculates the variance in logs
     --------------------------------------------------------------------
     '''
-    flattened_dist = dist.flatten()
-    flattened_weights = weights.flatten()
-    idx = np.argsort(flattened_dist)
-    sort_dist = flattened_dist[idx]
-    sort_weights = flattened_weights[idx]
+    wd = dist_from_weights(dist, weights)
 
     # variance
-    ln_dist = np.log(sort_dist*factor) # not scale invariant
-    weight_mean = (ln_dist*sort_weights).sum()/sort_weights.sum()
-    var_ln_dist = ((sort_weights*((ln_dist-weight_mean)**2)).sum())*(1./(sort_weights.sum()))
+    var_ln_dist = dist_var_log(wd, factor) # not scale invariant
 
     return var_ln_dist
@@ -6,6 +6,7 @@ Computes the average labor participation rate for each age cohort.
 
 This py-file calls the following other file(s):
             data/labor/cps_hours_by_age_hourspct.txt
+            bootstrap.py
 
 This py-file creates the following other file(s):
     (make sure that an OUTPUT folder exists)
@@ -25,6 +26,7 @@ import numpy as np
 import pandas as pd
 import cPickle as pickle
 import utils
+import bootstrap
 import scipy.ndimage.filters as filter
 
 
@@ -76,22 +78,48 @@ def compute_labor_moments(cps, S):
     # endowment is 24 hours minus required time to sleep)
     by_age['frac_work'] = by_age['avg_hours']/(365*16.)
 
+    labor_dist_out = labor_profile(by_age['frac_work'].values, S)
+
+    return labor_dist_out
+
+
+def labor_profile(frac_work, S):
+    '''
+    ------------------------------------------------------------------------
+    Extends the fraction of time worked by age in the data to all model
+    ages and adjusts it to the model period.
+    Inputs:
+        frac_work = [60,] or [B,60] array, fraction of time endowment
+                    worked by age (one row per bootstrap replicate)
+        S         = integer, number of model periods
+    Objects created in the function:
+        slope           = scalar or [B,1] array, slope of the extrapolation
+        labor_dist_data = [80,] or [B,80] array, fraction of time worked by
+                          annual age
+        labor_dist_out  = [S,] or [B,S] array, labor moments
+
+    Returns:
+        labor_dist_out
+    ------------------------------------------------------------------------
+    '''
     # Data have sufficient obs through age  80
     # Fit a line to the last few years of the average labor participation which extends from
     # ages 76 to 100.
-    slope = (by_age['frac_work'][-1] - by_age['frac_work'][-15]) / (15.)
-    labor_dist_data = np.zeros(80)
-    labor_dist_data[:60] = by_age['frac_work']
-    labor_dist_data[60:] = by_age['frac_work'][-1] + slope*xrange(20)
+    slope = (frac_work[..., -1:] - frac_work[..., -15:-14]) / (15.)
+    labor_dist_data = np.zeros(frac_work.shape[:-1] + (80,))
+    labor_dist_data[..., :60] = frac_work
+    labor_dist_data[..., 60:] = frac_work[..., -1:] + slope*np.arange(20)
 
     # the above computes moments if the model period is a year
     # the following adjusts those moments in case it is smaller
-    labor_dist_out = filter.uniform_filter(labor_dist_data,size=int(80/S))[::int(80/S)]
+    labor_dist_out = filter.uniform_filter1d(labor_dist_data, size=int(80/S),
+                                             axis=-1)[..., ::int(80/S)]
 
     return labor_dist_out
 
 
-def VCV_moments(cps, n, bin_weights, S):
+def VCV_moments(cps, n, bin_weights, S, seed=0, method='poisson',
+                num_workers=1):
     '''
     ------------------------------------------------------------------------
         Compute Variance-Covariance matrix for labor moments by
@@ -102,24 +130,67 @@ def VCV_moments(cps, n, bin_weights, S):
             n           = interger, number of bootstrap iterations to run
             bin_weights = ability weights (Jx1 array)
             J           = number of ability groups (scalar)
+            seed        = integer, seed for the bootstrap
+            method      = string, 'poisson' or 'multinomial' bootstrap
+                          weights
+            num_workers = integer, number of processes
         Objects created in the function:
+            cps_sorted = pandas DF, CPS data sorted by age
+            age_starts = [60,] vector, first observation of each age
+            boot_data  = tuple, CPS data sorted by age
             labor_moments_boot = [n,S] array, bootstrapped labor moments
-            boot = pandas DF, boostrapped dataframe
             VCV  = [S,S] array, variance-covariance matrix of labor moments
         Output:
             VCV
 
     ------------------------------------------------------------------------
     '''
-    labor_moments_boot = np.zeros((n,S))
-    for i in range(n):
-        boot = cps[np.random.randint(2, size=len(cps.index)).astype(bool)]
-        labor_moments_boot[i,:] = compute_labor_moments(boot, S)
+    # sort by age once, so that sums by age are sums over contiguous
+    # observations in every replicate
+    cps_sorted = cps.sort_values(by='age')
+    age = cps_sorted['age'].values
+    age_starts = np.flatnonzero(np.append([True], age[1:] != age[:-1]))
+    wtsupp = cps_sorted['wtsupp'].values.astype(float)
+    hours_wgt = cps_sorted['hours'].values * wtsupp
+    boot_data = (hours_wgt, wtsupp, age_starts, S)
+    labor_moments_boot = bootstrap.boot_moments(
+        boot_labor_moments, boot_data, len(age), n, seed, method,
+        num_workers=num_workers)
 
     VCV = np.cov(labor_moments_boot.T)
 
     return VCV
 
+
+def boot_labor_moments(mult, data):
+    '''
+    ------------------------------------------------------------------------
+    Computes the labor moments in compute_labor_moments() for a block of
+    bootstrap replicates at once.
+    Inputs:
+        mult       = [B,N] array, multiplicity of each observation in
+                     each replicate
+        data       = length 4 tuple, (hours_wgt, wtsupp, age_starts, S)
+        hours_wgt  = [N,] vector, hours times sampling weight, sorted by age
+        wtsupp     = [N,] vector, sampling weights, sorted by age
+        age_starts = [60,] vector, first observation of each age
+        S          = integer, number of model periods
+    Objects created in the function:
+        avg_hours = [B,60] array, average hours by age
+        frac_work = [B,60] array, fraction of time endowment worked by age
+
+    Returns:
+        [B,S] array of labor moments
+    ------------------------------------------------------------------------
+    '''
+    hours_wgt, wtsupp, age_starts, S = data
+
+    avg_hours = (np.add.reduceat(mult * hours_wgt, age_starts, axis=1) /
+                 np.add.reduceat(mult * wtsupp, age_starts, axis=1))
+    frac_work = avg_hours/(365*16.)
+
+    return labor_profile(frac_work, S)
+
 def labor_data_graphs(weighted, output_dir):
     '''
     ------------------------------------------------------------------------
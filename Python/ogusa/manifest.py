@@ -0,0 +1,174 @@
+'''
+------------------------------------------------------------------------
+Run manifest for saved SS and TPI results.
+
+The manifest is a JSON file saved alongside the results of a run.  For
+each stage of the run (SS, TPI) it records a key, a hash of all the
+inputs of the stage: the effective parameters (including the tax
+function parameter arrays), the run options, the results the stage
+reads from other runs (e.g. the baseline SS of a reform) and the version
+of the model code (a hash of the ogusa source files).  A stage whose
+key matches the manifest and whose results are on disk does not need
+to be run again.
+
+This py-file calls the following other file(s): None
+
+This py-file creates the following other file(s):
+            output_dir/run_manifest.json
+------------------------------------------------------------------------
+'''
+
+# Packages
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+cur_path = os.path.split(os.path.abspath(__file__))[0]
+MANIFEST_FILE = "run_manifest.json"
+STAGE_FILES = {'SS': [os.path.join('SS', 'SS_vars.pkl'),
+                      'run_parameters.pkl'],
+               'TPI': [os.path.join('TPI', 'TPI_vars.pkl'),
+                       os.path.join('TPI', 'TPI_macro_vars.pkl')]}
+
+'''
+------------------------------------------------------------------------
+    Functions
+------------------------------------------------------------------------
+'''
+
+
+def update_hash(h, obj):
+    '''
+    Adds an object (nested dictionaries, lists, tuples, arrays, strings
+    and numbers) to a hash.  Arrays are hashed by dtype, shape and
+    values, dictionaries in order of their keys.
+
+    Inputs:
+        h   = hashlib object
+        obj = object to add
+
+    Returns: None
+    '''
+    if isinstance(obj, dict):
+        h.update('dict:')
+        for key in sorted(obj.keys()):
+            update_hash(h, key)
+            update_hash(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update('list%d:' % len(obj))
+        for item in obj:
+            update_hash(h, item)
+    elif isinstance(obj, np.ndarray):
+        h.update('array:' + str(obj.dtype) + str(obj.shape))
+        h.update(np.ascontiguousarray(obj).tostring())
+    elif isinstance(obj, (float, np.floating)):
+        h.update('float:' + repr(float(obj)))
+    else:
+        h.update(type(obj).__name__ + ':' + repr(obj))
+
+
+def file_hash(path):
+    '''
+    Returns the SHA-1 hash of the contents of a file.
+    '''
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def code_version():
+    '''
+    Returns a hash of the ogusa source files, so that results are
+    recomputed when the model code changes but not after edits to other
+    scripts.
+    '''
+    h = hashlib.sha1()
+    for name in sorted(os.listdir(cur_path)):
+        if name.endswith('.py'):
+            h.update(name)
+            h.update(file_hash(os.path.join(cur_path, name)))
+    return h.hexdigest()
+
+
+def run_key(params, input_files=[]):
+    '''
+    Returns the key of a stage of a run.
+
+    Inputs:
+        params      = dictionary, effective parameters and options of the
+                      run
+        input_files = list, result files of other runs read by the stage
+
+    Functions called:
+        update_hash
+        file_hash
+        code_version
+
+    Objects in function:
+        h = hashlib object
+
+    Returns: string, hex digest
+    '''
+    h = hashlib.sha1()
+    update_hash(h, params)
+    for path in input_files:
+        h.update(file_hash(path))
+    h.update(code_version())
+    return h.hexdigest()
+
+
+def load_manifest(output_dir):
+    '''
+    Returns the manifest saved in output_dir, or an empty manifest.
+    '''
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'stages': {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def is_complete(output_dir, stage, key):
+    '''
+    Returns True if the manifest in output_dir records a completed run
+    of stage with this key and the results of the stage are on disk.
+
+    Inputs:
+        output_dir = string, directory of the run
+        stage      = string, 'SS' or 'TPI'
+        key        = string, from run_key()
+
+    Returns: boolean
+    '''
+    entry = load_manifest(output_dir)['stages'].get(stage)
+    if entry is None or entry['key'] != key:
+        return False
+    return all(os.path.exists(os.path.join(output_dir, name))
+               for name in STAGE_FILES[stage])
+
+
+def record_stage(output_dir, stage, key):
+    '''
+    Records a completed run of stage in the manifest in output_dir.  The
+    manifest is written to a temporary file and then renamed, so it is
+    never left half written.
+
+    Inputs:
+        output_dir = string, directory of the run
+        stage      = string, 'SS' or 'TPI'
+        key        = string, from run_key()
+
+    Returns: None
+    '''
+    manifest = load_manifest(output_dir)
+    manifest['stages'][stage] = {'key': key, 'code_version': code_version(),
+                                 'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                                 'files': STAGE_FILES[stage]}
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    with open(path + '.tmp', "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
@@ -25,6 +25,7 @@ import income as inc
 import pickle
 import utils
 import elliptical_u_est as ellip
+import tax
 import matplotlib.pyplot as plt
 
 '''
@@ -64,6 +65,8 @@ Tax Parameters:
 ------------------------------------------------------------------------
 mean_income_data = scalar, mean income from IRS data file used to calibrate income tax
 etr_params       = [S,BW,#tax params] array, parameters for effective tax rate function
+                    (S and BW axes have length one where parameters
+                    don't vary, see tax.compress_tax_params)
 mtrx_params      = [S,BW,#tax params] array, parameters for marginal tax rate on
                     labor income function
 mtry_params      = [S,BW,#tax params] array, parameters for marginal tax rate on
@@ -71,6 +74,8 @@ mtry_params      = [S,BW,#tax params] array, parameters for marginal tax rate on
 h_wealth         = scalar, wealth tax parameter h (scalar)
 m_wealth         = scalar, wealth tax parameter m (scalar)
 p_wealth         = scalar, wealth tax parameter p (scalar)
+                    or [K,4] array for a bracketed wealth tax, see
+                    tax.wealth_tax_brackets
 tau_bq           = [J,] vector, bequest tax
 tau_payroll      = scalar, payroll tax rate
 retire           = integer, age at which individuals eligible for retirement benefits
@@ -176,6 +181,9 @@ def get_parameters(baseline, reform, guid, user_modifiable):
     etr_params[:,:,1] = b_tax_income
     etr_params[:,:,2] = c_tax_income
     etr_params[:,:,3] = d_tax_income
+    # the parameters are the same for all ages and years, so only a
+    # single set is stored and broadcast where used
+    etr_params = tax.compress_tax_params(etr_params)
 
     mtrx_params = etr_params
     mtry_params = etr_params
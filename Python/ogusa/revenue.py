@@ -0,0 +1,201 @@
+'''
+------------------------------------------------------------------------
+Finds the income tax parameter that matches the SS tax receipts of
+another policy (e.g. the income tax reform that raises the same revenue
+as the wealth tax reform).
+
+The receipts gap is bracketed by stepping away from a starting guess,
+with several bracket points solved concurrently if requested, and the
+root is then found with Brent's method.  Every SS solve starts from the
+solution at the closest value of d solved so far.
+
+This py-file calls the following other file(s):
+            SS.py
+            tax.py
+------------------------------------------------------------------------
+'''
+
+# Packages
+import multiprocessing
+import numpy as np
+import scipy.optimize as opt
+import SS
+import tax
+
+'''
+------------------------------------------------------------------------
+    Functions
+------------------------------------------------------------------------
+'''
+
+
+def set_income_tax_d(income_tax_params, d):
+    '''
+    Returns income tax parameters with the d parameter of the effective
+    and marginal tax rate functions set to d.  The arrays passed in are
+    not changed.
+
+    Inputs:
+        income_tax_params = length 4 tuple, (analytical_mtrs, etr_params,
+                            mtrx_params, mtry_params)
+        d                 = scalar, new value of the d parameter
+
+    Functions called: None
+
+    Objects in function:
+        new_params = list, copies of etr_params, mtrx_params, mtry_params
+
+    Returns: length 4 tuple, (analytical_mtrs, etr_params, mtrx_params,
+             mtry_params)
+    '''
+    analytical_mtrs = income_tax_params[0]
+    new_params = []
+    for params in income_tax_params[1:]:
+        if params.shape[-1] != tax.N_FUNC_PARAMS:
+            raise ValueError("d can only be set for tax function "
+                             "parameters, not tabulated rates")
+        params = params.copy()
+        params[..., 3] = d
+        new_params.append(params)
+
+    return (analytical_mtrs,) + tuple(new_params)
+
+
+def ss_receipts(args):
+    '''
+    Solves the SS with the income tax parameter d and returns the net tax
+    receipts.  Takes a single tuple so it can be mapped over a worker
+    pool.  Raises a RuntimeError if the SS is not solved, since the
+    receipts are then meaningless.
+
+    Inputs:
+        args            = length 3 tuple, (d, params, initial_guesses)
+        d               = scalar, d parameter of the income tax functions
+        params          = length 8 tuple, (income_tax_params, ss_params,
+                          iterative_params, chi_params, baseline,
+                          fix_transfers, baseline_dir, baseline_solution)
+        initial_guesses = dictionary, SS solution to start from
+
+    Functions called:
+        set_income_tax_d
+        SS.run_SS
+
+    Objects in function:
+        ss_output = dictionary, SS solution at d
+
+    Returns: d, net tax receipts, ss_output
+    '''
+    d, params, initial_guesses = args
+    income_tax_params, ss_params, iterative_params, chi_params, baseline, \
+        fix_transfers, baseline_dir, baseline_solution = params
+
+    ss_output = SS.run_SS(set_income_tax_d(income_tax_params, d), ss_params,
+                          iterative_params, chi_params, baseline,
+                          fix_transfers=fix_transfers,
+                          baseline_dir=baseline_dir,
+                          initial_guesses=initial_guesses,
+                          baseline_solution=baseline_solution)
+    if ss_output['ss_flag'] != 0:
+        raise RuntimeError("SS not solved with income tax d = " + str(d) +
+                           ", cannot match receipts")
+
+    return d, ss_output['net_tax_receipts'], ss_output
+
+
+def match_income_tax(receipts_to_match, d_guess, params, step=0.01,
+                     xtol=1e-8, max_expand=20, num_workers=1):
+    '''
+    Finds the d parameter of the income tax functions at which SS net
+    tax receipts (T_H + G) equal receipts_to_match.  Receipts are
+    assumed to increase with d, which sets the direction in which the
+    bracket is searched for.
+
+    Inputs:
+        receipts_to_match = scalar, net tax receipts to match
+        d_guess           = scalar, starting guess for d
+        params            = length 8 tuple, (income_tax_params, ss_params,
+                            iterative_params, chi_params, baseline,
+                            fix_transfers, baseline_dir, baseline_solution)
+        step              = scalar, first step away from d_guess, doubled
+                            until the receipts gap changes sign
+        xtol              = scalar, tolerance on d
+        max_expand        = integer, maximum number of bracket steps
+        num_workers       = integer, number of bracket points solved at
+                            once
+
+    Functions called:
+        ss_receipts
+        opt.brentq
+
+    Objects in function:
+        evals     = dictionary, (receipts gap, SS solution) keyed by d
+        direction = scalar, 1 if receipts are too low at d_guess, else -1
+        bracket   = list, values of d solved in one round
+        d_inc     = scalar, d that matches receipts
+
+    Returns: d_inc, ss_output at d_inc
+    '''
+    income_tax_params, ss_params, iterative_params, chi_params, baseline, \
+        fix_transfers, baseline_dir, baseline_solution = params
+    evals = {}
+
+    def nearest_solution(d):
+        if len(evals) == 0:
+            return None
+        d_near = min(evals.keys(), key=lambda x: abs(x - d))
+        return evals[d_near][1]
+
+    def solve(d_list):
+        if num_workers > 1 and len(d_list) > 1:
+            initial_guesses = nearest_solution(d_list[0])
+            tasks = [(d, params, initial_guesses) for d in d_list]
+            pool = multiprocessing.Pool(min(num_workers, len(tasks)))
+            results = pool.map(ss_receipts, tasks)
+            pool.close()
+            pool.join()
+            for d, receipts, ss_output in results:
+                evals[d] = (receipts - receipts_to_match, ss_output)
+                print 'd = ', d, ', error in taxes = ', evals[d][0]
+        else:
+            for d in d_list:
+                d, receipts, ss_output = ss_receipts(
+                    (d, params, nearest_solution(d)))
+                evals[d] = (receipts - receipts_to_match, ss_output)
+                print 'd = ', d, ', error in taxes = ', evals[d][0]
+
+    def gap(d):
+        if d not in evals:
+            solve([d])
+        return evals[d][0]
+
+    print 'Computing new income tax to match receipts of ', receipts_to_match
+    solve([d_guess])
+    if evals[d_guess][0] == 0.0:
+        return d_guess, evals[d_guess][1]
+
+    # step away from d_guess until the receipts gap changes sign
+    direction = 1.0 if evals[d_guess][0] < 0.0 else -1.0
+    d_low = d_high = None
+    n_steps = 0
+    while d_low is None and n_steps < max_expand:
+        bracket = [d_guess + direction * step * 2 ** (n_steps + i)
+                   for i in xrange(max(1, num_workers))]
+        bracket = [d for d in bracket if d > 0.0]
+        if len(bracket) == 0:
+            break
+        n_steps += len(bracket)
+        solve(bracket)
+        points = sorted(evals.keys())
+        for a, b in zip(points[:-1], points[1:]):
+            if np.sign(evals[a][0]) != np.sign(evals[b][0]):
+                d_low, d_high = a, b
+                break
+    if d_low is None:
+        raise RuntimeError("Could not bracket the income tax parameter "
+                           "that matches receipts")
+
+    d_inc = opt.brentq(gap, d_low, d_high, xtol=xtol)
+    gap(d_inc)
+    print 'New income tax d: ', d_inc
+
+    return d_inc, evals[d_inc][1]
@@ -0,0 +1,241 @@
+'''
+------------------------------------------------------------------------
+Static revenue scoring of wealth tax (and income tax) reforms.
+
+Household wealth and labor supply, prices and the income factor are
+held at their values in a baseline solution, and the income and wealth
+taxes households would pay under each candidate policy are computed
+from them.  This gives the static revenue change of each policy in the
+SS and in each year of the budget window of the transition path, and
+its incidence by age and lifetime income group, without solving the
+model.  Policies are scored in blocks of policies at a time as arrays
+with a leading policy axis, so many policies are scored together.
+
+This py-file calls the following other file(s):
+            tax.py
+------------------------------------------------------------------------
+'''
+
+# Packages
+import numpy as np
+import pandas as pd
+import tax
+
+'''
+------------------------------------------------------------------------
+POLICY_PARAMS = list, policy parameters a candidate policy can set (the
+                wealth tax parameters and the d parameter of the income
+                tax functions)
+------------------------------------------------------------------------
+'''
+POLICY_PARAMS = ['h_wealth', 'p_wealth', 'm_wealth', 'd_income']
+
+'''
+------------------------------------------------------------------------
+    Functions
+------------------------------------------------------------------------
+'''
+
+
+def policy_arrays(policies, baseline_policy):
+    '''
+    Returns the parameters of K policies as [K,] vectors.  Parameters a
+    policy does not set take their baseline value (NaN for d_income,
+    which means the baseline income tax parameters are used).
+
+    Inputs:
+        policies        = list of K dictionaries, policy parameter values
+        baseline_policy = dictionary, baseline values of the wealth tax
+                          parameters
+
+    Functions called: None
+
+    Returns: dictionary, [K,] vector of each policy parameter
+    '''
+    for policy in policies:
+        for name in policy:
+            if name not in POLICY_PARAMS:
+                raise ValueError("Unknown policy parameter: " + name)
+    return dict((name, np.array([policy.get(name,
+                                            baseline_policy.get(name, np.nan))
+                                 for policy in policies], dtype=float))
+                for name in POLICY_PARAMS)
+
+
+def static_taxes(r, w, b, n, factor, e, etr_params, policy):
+    '''
+    Computes the income and wealth taxes paid by each household under K
+    policies, for given wealth and labor supply.
+
+    Inputs:
+        r          = scalar or [T,1,1] array, interest rate
+        w          = scalar or [T,1,1] array, wage rate
+        b          = [S,J] or [T,S,J] array, wealth holdings
+        n          = [S,J] or [T,S,J] array, labor supply
+        factor     = scalar, model income scaling factor
+        e          = [S,J] array, effective labor units
+        etr_params = [S,1,#tax params] or [T,S,1,#tax params] array,
+                     baseline effective tax rate function parameters (the
+                     age and year axes may have length one, see
+                     tax.compress_tax_params)
+        policy     = dictionary, [K,] vector of each policy parameter
+                     (from policy_arrays())
+
+    Functions called:
+        tax.tau_income
+        tax.tau_wealth
+
+    Objects in function:
+        I        = [S,J] or [T,S,J] array, total income
+        tau_unit = [S,J] or [T,S,J] array, effective income tax rate with
+                   d = 1 (the rate is proportional to d)
+        tau_base = [S,J] or [T,S,J] array, baseline effective income tax
+                   rate
+
+    Returns: T_I, T_W ([K,S,J] or [K,T,S,J] arrays, income and wealth
+             taxes)
+    '''
+    shape = (-1,) + (1,) * np.ndim(b)
+    h_wealth = policy['h_wealth'].reshape(shape)
+    p_wealth = policy['p_wealth'].reshape(shape)
+    m_wealth = policy['m_wealth'].reshape(shape)
+    d_income = policy['d_income'].reshape(shape)
+
+    I = r * b + w * e * n
+    tau_base = tax.tau_income(r, w, b, n, factor, (e, etr_params))
+    if np.isnan(d_income).all():
+        tau_inc = tau_base[np.newaxis]
+    else:
+        if etr_params.shape[-1] != tax.N_FUNC_PARAMS:
+            raise ValueError("d can only be set for tax function "
+                             "parameters, not tabulated rates")
+        etr_unit = etr_params.copy()
+        etr_unit[..., 3] = 1.0
+        tau_unit = tax.tau_income(r, w, b, n, factor, (e, etr_unit))
+        tau_inc = np.where(np.isnan(d_income), tau_base, d_income * tau_unit)
+    T_I = tau_inc * I
+    T_W = tax.tau_wealth(b, (h_wealth, p_wealth, m_wealth)) * b
+    return T_I, T_W
+
+
+def static_score(policies, sim_params, ss_solution, tpi_solution=None,
+                 block_size=500):
+    '''
+    Scores K policies on a fixed baseline distribution: the static
+    change in income and wealth tax revenue from the baseline policy, in
+    the SS and in each year of the budget window, and its incidence by
+    age and lifetime income group.  Revenues are per capita, in model
+    units, like net_tax_receipts in the SS results.
+
+    Inputs:
+        policies     = list of K dictionaries, policy parameter values
+                       (see POLICY_PARAMS), e.g. from
+                       sweep.scenario_grid()
+        sim_params   = dictionary, parameters of the baseline run (as
+                       saved in run_parameters.pkl)
+        ss_solution  = dictionary, baseline SS results
+        tpi_solution = dictionary, baseline TPI results, or None to
+                       score the SS only
+        block_size   = integer, number of policies scored at once
+
+    Functions called:
+        policy_arrays
+        static_taxes
+
+    Objects in function:
+        pop_ss     = [S,J] array, SS population weights (omega x lambdas)
+        pop_tpi    = [BW,S,J] array, population weights in the budget
+                     window
+        base       = dictionary, baseline policy
+        d_tax_ss   = [K,S,J] array, change in taxes of each household in
+                     the SS
+        d_tax_tpi  = [K,BW,S,J] array, change in taxes of each household
+                     in the budget window
+
+    Returns: table, incidence
+        table     = pandas DataFrame, one row per policy with its
+                    parameters, SS income and wealth tax revenue,
+                    revenue and revenue_change, and (with tpi_solution)
+                    revenue_change_BW, the change summed over the budget
+                    window
+        incidence = dictionary
+            age     = [K,S] array, SS change in taxes per person by age
+            ability = [K,J] array, SS change in taxes per person by
+                      lifetime income group
+            path    = [K,BW] array, change in revenue in each year of the
+                      budget window (with tpi_solution)
+            path_age = [K,BW,S] array, change in taxes per person by age
+                       in each year of the budget window (with
+                       tpi_solution)
+    '''
+    S = sim_params['S']
+    J = sim_params['J']
+    BW = sim_params['BW']
+    e = sim_params['e']
+    omega_SS = sim_params['omega_SS']
+    lambdas = sim_params['lambdas']
+    etr_params = sim_params['etr_params']
+    base = {'h_wealth': sim_params['h_wealth'],
+            'p_wealth': sim_params['p_wealth'],
+            'm_wealth': sim_params['m_wealth']}
+    factor = ss_solution['factor_ss']
+
+    pop_ss = omega_SS.reshape(S, 1) * lambdas.reshape(1, J)
+    ss_args = (ss_solution['rss'], ss_solution['wss'],
+               ss_solution['bssmat_s'], ss_solution['nssmat'], factor, e,
+               etr_params[:, -1:, :])
+    if tpi_solution is not None:
+        pop_tpi = (sim_params['omega'][:BW].reshape(BW, S, 1) *
+                   lambdas.reshape(1, 1, J))
+        tpi_args = (np.asarray(tpi_solution['r'])[:BW].reshape(BW, 1, 1),
+                    np.asarray(tpi_solution['w'])[:BW].reshape(BW, 1, 1),
+                    tpi_solution['bmat_s'][:BW], tpi_solution['n_mat'][:BW],
+                    factor, e,
+                    np.transpose(etr_params[:, :BW, :],
+                                 (1, 0, 2))[:, :, np.newaxis, :])
+
+    # baseline taxes
+    base_policy = policy_arrays([{}], base)
+    T_I, T_W = static_taxes(*(ss_args + (base_policy,)))
+    base_tax_ss = (T_I + T_W)[0]
+    if tpi_solution is not None:
+        T_I, T_W = static_taxes(*(tpi_args + (base_policy,)))
+        base_tax_tpi = (T_I + T_W)[0]
+
+    policy = policy_arrays(policies, base)
+    K = len(policies)
+    income_tax = np.zeros(K)
+    wealth_tax = np.zeros(K)
+    incidence = {'age': np.zeros((K, S)), 'ability': np.zeros((K, J))}
+    if tpi_solution is not None:
+        incidence['path'] = np.zeros((K, BW))
+        incidence['path_age'] = np.zeros((K, BW, S))
+    for start in xrange(0, K, block_size):
+        block = slice(start, min(start + block_size, K))
+        block_policy = dict((name, policy[name][block])
+                            for name in POLICY_PARAMS)
+        T_I, T_W = static_taxes(*(ss_args + (block_policy,)))
+        income_tax[block] = (T_I * pop_ss).sum(axis=(1, 2))
+        wealth_tax[block] = (T_W * pop_ss).sum(axis=(1, 2))
+        d_tax_ss = T_I + T_W - base_tax_ss
+        incidence['age'][block] = ((d_tax_ss * pop_ss).sum(axis=2) /
+                                   omega_SS.reshape(1, S))
+        incidence['ability'][block] = ((d_tax_ss * pop_ss).sum(axis=1) /
+                                       lambdas.reshape(1, J))
+        if tpi_solution is not None:
+            T_I, T_W = static_taxes(*(tpi_args + (block_policy,)))
+            d_tax_tpi = (T_I + T_W - base_tax_tpi) * pop_tpi
+            incidence['path'][block] = d_tax_tpi.sum(axis=(2, 3))
+            incidence['path_age'][block] = (d_tax_tpi.sum(axis=3) /
+                                            sim_params['omega'][:BW])
+
+    table = pd.DataFrame(policies, index=range(K))
+    table['income_tax'] = income_tax
+    table['wealth_tax'] = wealth_tax
+    table['revenue'] = income_tax + wealth_tax
+    table['revenue_change'] = (table['revenue'] -
+                               (base_tax_ss * pop_ss).sum())
+    if tpi_solution is not None:
+        table['revenue_change_BW'] = incidence['path'].sum(axis=1)
+
+    return table, incidence
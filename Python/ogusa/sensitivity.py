@@ -0,0 +1,477 @@
+'''
+------------------------------------------------------------------------
+Local sensitivities of SS outcomes to policy and preference parameters
+by implicit differentiation.
+
+The SS is the solution z of F(z, theta) = 0, where z stacks the savings
+and labor supply of every age and ability type and the outer variables
+(r, T_H and, in the baseline, factor) and F stacks the household Euler
+errors and the conditions that r, T_H and factor solve in inner_loop().
+Around a solved SS the derivatives of the solution with respect to the
+parameters theta are
+
+    dz/dtheta = -[dF/dz]^(-1) dF/dtheta
+
+so the Jacobian dF/dz is computed and factored once and each parameter
+costs one back substitution, rather than two or more SS solves as with
+finite differences.  The derivatives of outcomes (K, revenue, the gini
+coefficient of wealth, ...) follow from the derivatives of the solution.
+
+dF/dz is found by central differences.  The Euler errors of ability type
+j depend only on the savings and labor supply of type j, so one
+evaluation of the Euler errors of all types gives a column of each
+type's block.
+
+This py-file calls the following other file(s):
+            SS.py
+            tax.py
+            firm.py
+            aggregates.py
+            inequal.py
+------------------------------------------------------------------------
+'''
+
+# Packages
+import numpy as np
+import pandas as pd
+import scipy.linalg as la
+import SS
+import tax
+import firm
+import aggregates as aggr
+import inequal
+
+'''
+------------------------------------------------------------------------
+SENSITIVITY_PARAMS = dictionary, parameters derivatives can be taken
+                     with respect to and their position in ss_params
+                     (d_income is the d parameter of the income tax
+                     functions)
+OUTCOMES           = list, SS outcomes derivatives are reported for
+DIFF_STEP          = scalar, relative step of the central differences
+------------------------------------------------------------------------
+'''
+SENSITIVITY_PARAMS = {'beta': 4, 'sigma': 5, 'alpha': 6, 'Z': 7,
+                      'delta': 8, 'g_y': 11, 'tau_payroll': 13,
+                      'h_wealth': 22, 'p_wealth': 23, 'm_wealth': 24,
+                      'd_income': None}
+OUTCOMES = ['K', 'L', 'Y', 'r', 'w', 'T_H', 'factor', 'revenue',
+            'gini_wealth', 'top_10_share', 'top_1_share']
+DIFF_STEP = 6e-6
+
+'''
+------------------------------------------------------------------------
+    Functions
+------------------------------------------------------------------------
+'''
+
+
+def shift_param(name, step, income_tax_params, ss_params):
+    '''
+    Returns the income tax and SS parameters with step added to one
+    parameter (for d_income, to the d parameter of the effective and
+    marginal tax rate functions at every age).  The parameters passed in
+    are not changed.
+
+    Inputs:
+        name              = string, parameter (see SENSITIVITY_PARAMS)
+        step              = scalar, change in the parameter
+        income_tax_params = length 4 tuple, (analytical_mtrs, etr_params,
+                            mtrx_params, mtry_params)
+        ss_params         = list, from SS.create_steady_state_parameters()
+
+    Functions called: None
+
+    Returns: income_tax_params, ss_params
+    '''
+    if name not in SENSITIVITY_PARAMS:
+        raise ValueError("Unknown sensitivity parameter: " + name)
+    ss_params = list(ss_params)
+    if name == 'd_income':
+        new_params = []
+        for params in income_tax_params[1:]:
+            if params.shape[-1] != tax.N_FUNC_PARAMS:
+                raise ValueError("d can only be changed for tax function "
+                                 "parameters, not tabulated rates")
+            params = params.copy()
+            params[..., 3] += step
+            new_params.append(params)
+        income_tax_params = (income_tax_params[0],) + tuple(new_params)
+    else:
+        ss_params[SENSITIVITY_PARAMS[name]] = (
+            ss_params[SENSITIVITY_PARAMS[name]] + step)
+    return income_tax_params, ss_params
+
+
+def param_value(name, income_tax_params, ss_params):
+    '''
+    Returns the value of a parameter (the mean of d over ages for
+    d_income).
+    '''
+    if name not in SENSITIVITY_PARAMS:
+        raise ValueError("Unknown sensitivity parameter: " + name)
+    if name == 'd_income':
+        return float(income_tax_params[1][..., 3].mean())
+    return float(ss_params[SENSITIVITY_PARAMS[name]])
+
+
+def household_errors(b, n, r, T_H, factor, model):
+    '''
+    Computes the Euler errors of the households of every ability type.
+
+    Inputs:
+        b      = [S,J] array, savings
+        n      = [S,J] array, labor supply
+        r      = scalar, interest rate
+        T_H    = scalar, lump sum transfer
+        factor = scalar, model income scaling factor
+        model  = length 4 tuple, (income_tax_params, ss_params, cols,
+                 fixed), cols and fixed from SS.batch_household_params()
+
+    Functions called:
+        firm.get_w_from_r
+        tax.replacement_rate_coeffs
+        SS.euler_equation_solver_batch
+
+    Returns: [2S,J] array, savings and labor supply Euler errors
+    '''
+    income_tax_params, ss_params, cols, fixed = model
+    S = fixed['S']
+    Z, alpha, delta, retire = (ss_params[7], ss_params[6], ss_params[8],
+                               ss_params[20])
+    w = firm.get_w_from_r(r, (Z, alpha, delta))
+    M = b.shape[1]
+    prices = dict(cols)
+    prices['r'] = np.ones(M) * r
+    prices['w'] = np.ones(M) * w
+    prices['T_H'] = np.ones(M) * T_H
+    prices['factor'] = np.ones(M) * factor
+    prices['rr_coeffs'] = tax.replacement_rate_coeffs(
+        prices['w'], prices['factor'], (cols['e'], S, retire))
+    error1, error2 = SS.euler_equation_solver_batch(b, n, prices, fixed)
+    return np.append(error1, error2, axis=0)
+
+
+def market_values(b, n, r, factor, model):
+    '''
+    Computes the aggregates and the values of r, T_H and factor implied
+    by the distribution of savings and labor supply, as in
+    SS.inner_loop().
+
+    Inputs:
+        b      = [S,J] array, savings
+        n      = [S,J] array, labor supply
+        r      = scalar, interest rate
+        factor = scalar, model income scaling factor
+        model  = length 4 tuple, (income_tax_params, ss_params, cols,
+                 fixed)
+
+    Functions called:
+        aggregates.get_aggregates
+        firm.get_Y
+        firm.get_r
+        firm.get_w
+        aggregates.get_BQ
+        tax.replacement_rate_vals
+        tax.get_tax_receipts
+
+    Returns: dictionary, K, L, Y, new_r, new_w, new_factor and
+             net_tax_receipts
+    '''
+    income_tax_params, ss_params, cols, fixed = model
+    J, S, T, BW, beta, sigma, alpha, Z, delta, ltilde, nu, g_y,\
+        g_n_ss, tau_payroll, tau_bq, rho, omega_SS, lambdas, imm_rates, e, \
+        retire, mean_income_data, h_wealth, p_wealth, m_wealth, \
+        b_ellipse, upsilon, agg_weights = ss_params
+    etr_params = income_tax_params[1]
+
+    aggs = aggr.get_aggregates(agg_weights, 'SS', b_splus1=b, n=n)
+    Y = firm.get_Y(aggs['K'], aggs['L'], (alpha, Z))
+    new_r = firm.get_r(Y, aggs['K'], (alpha, delta))
+    new_w = firm.get_w(Y, aggs['L'], alpha)
+    b_s = np.append(np.zeros((1, J)), b[:-1, :], axis=0)
+    average_income_model = ((new_r * b_s + new_w * e * n) *
+                            agg_weights['pop']).sum()
+    new_factor = mean_income_data / average_income_model
+    new_BQ = aggr.get_BQ(new_r, aggs['bq_wealth'], 'SS')
+    theta = tax.replacement_rate_vals(n, new_w, factor, (e, S, retire))
+    receipts_params = (e, lambdas.reshape(1, J), 'SS', etr_params, theta,
+                       tau_bq, tau_payroll, h_wealth, p_wealth, m_wealth,
+                       retire, T, S, J)
+    receipts = tax.get_tax_receipts(new_r, new_w, b_s, n, new_BQ, factor,
+                                    receipts_params)
+    net_tax_receipts = aggr.get_aggregates(agg_weights, 'SS',
+                                           revenue=receipts)['T_H']
+    return {'K': aggs['K'], 'L': aggs['L'], 'Y': Y, 'new_r': new_r,
+            'new_w': new_w, 'new_factor': new_factor,
+            'net_tax_receipts': net_tax_receipts}
+
+
+def equilibrium_errors(z, prices, model, unknowns):
+    '''
+    Computes the errors of the equilibrium system F(z) at z.
+
+    Inputs:
+        z        = [2SJ+P,] vector, b and n of each ability type (column j
+                   of np.append(b, n, axis=0) at z[2Sj:2S(j+1)]) followed
+                   by the P outer variables in unknowns
+        prices   = dictionary, r, T_H and factor (those not in unknowns
+                   are held at these values)
+        model    = length 4 tuple, (income_tax_params, ss_params, cols,
+                   fixed)
+        unknowns = list, outer variables solved for ('r', 'T_H',
+                   'factor')
+
+    Functions called:
+        household_errors
+        market_values
+
+    Returns: [2SJ+P,] vector, Euler errors followed by the errors of the
+             conditions on the outer variables
+    '''
+    S, J = model[3]['S'], model[3]['J']
+    x = z[:2 * S * J].reshape(J, 2 * S).T
+    prices = dict(prices)
+    for i, name in enumerate(unknowns):
+        prices[name] = z[2 * S * J + i]
+    euler = household_errors(x[:S], x[S:], prices['r'], prices['T_H'],
+                             prices['factor'], model)
+    market = market_values(x[:S], x[S:], prices['r'], prices['factor'],
+                           model)
+    implied = {'r': market['new_r'], 'T_H': market['net_tax_receipts'],
+               'factor': market['new_factor']}
+    return np.append(euler.T.flatten(),
+                     [implied[name] - prices[name] for name in unknowns])
+
+
+def equilibrium_jacobian(z, prices, model, unknowns):
+    '''
+    Computes the Jacobian of the equilibrium system by central
+    differences.
+
+    Inputs:
+        z        = [2SJ+P,] vector, solution (see equilibrium_errors())
+        prices   = dictionary, r, T_H and factor
+        model    = length 4 tuple, (income_tax_params, ss_params, cols,
+                   fixed)
+        unknowns = list, outer variables solved for
+
+    Functions called:
+        household_errors
+        market_values
+        equilibrium_errors
+
+    Objects in function:
+        x   = [2S,J] array, b and n of each ability type
+        jac = [2SJ+P,2SJ+P] array, dF/dz
+
+    Returns: jac
+    '''
+    S, J = model[3]['S'], model[3]['J']
+    N = 2 * S * J
+    P = len(unknowns)
+    x = z[:N].reshape(J, 2 * S).T
+    full = dict(prices)
+    for i, name in enumerate(unknowns):
+        full[name] = z[N + i]
+    jac = np.zeros((N + P, N + P))
+
+    # Euler errors: row i of x is perturbed for every ability type at
+    # once, since type j's errors depend only on column j
+    for i in xrange(2 * S):
+        h = DIFF_STEP * np.maximum(np.absolute(x[i]), 1.0)
+        x_up = x.copy()
+        x_up[i] += h
+        x_down = x.copy()
+        x_down[i] -= h
+        diff = (household_errors(x_up[:S], x_up[S:], full['r'], full['T_H'],
+                                 full['factor'], model) -
+                household_errors(x_down[:S], x_down[S:], full['r'],
+                                 full['T_H'], full['factor'], model)) / (2 * h)
+        for j in xrange(J):
+            jac[2 * S * j:2 * S * (j + 1), 2 * S * j + i] = diff[:, j]
+
+    # conditions on the outer variables: one b or n at a time
+    implied = {'r': 'new_r', 'T_H': 'net_tax_receipts',
+               'factor': 'new_factor'}
+    for k in xrange(N):
+        i, j = k % (2 * S), k // (2 * S)
+        h = DIFF_STEP * max(abs(x[i, j]), 1.0)
+        values = []
+        for step in (h, -h):
+            xh = x.copy()
+            xh[i, j] += step
+            values.append(market_values(xh[:S], xh[S:], full['r'],
+                                        full['factor'], model))
+        for p, name in enumerate(unknowns):
+            jac[N + p, k] = (values[0][implied[name]] -
+                             values[1][implied[name]]) / (2 * h)
+
+    # columns of the outer variables: all the equations
+    for p in xrange(P):
+        h = DIFF_STEP * max(abs(z[N + p]), 1.0)
+        z_up = z.copy()
+        z_up[N + p] += h
+        z_down = z.copy()
+        z_down[N + p] -= h
+        jac[:, N + p] = (equilibrium_errors(z_up, prices, model, unknowns) -
+                         equilibrium_errors(z_down, prices, model,
+                                            unknowns)) / (2 * h)
+
+    return jac
+
+
+def make_model(income_tax_params, ss_params, chi_params):
+    '''
+    Returns the model tuple passed to the functions above.
+    '''
+    cols, fixed = SS.batch_household_params([(income_tax_params, ss_params)],
+                                            chi_params)
+    return (income_tax_params, ss_params, cols, fixed)
+
+
+def ss_outcomes(z, prices, model, unknowns):
+    '''
+    Computes the SS outcomes in OUTCOMES at z.
+
+    Inputs:
+        z        = [2SJ+P,] vector, solution (see equilibrium_errors())
+        prices   = dictionary, r, T_H and factor
+        model    = length 4 tuple, (income_tax_params, ss_params, cols,
+                   fixed)
+        unknowns = list, outer variables solved for
+
+    Functions called:
+        market_values
+        firm.get_w_from_r
+        inequal.inequality_measures
+
+    Returns: dictionary, value of each outcome
+    '''
+    income_tax_params, ss_params, cols, fixed = model
+    S, J = fixed['S'], fixed['J']
+    N = 2 * S * J
+    x = z[:N].reshape(J, 2 * S).T
+    prices = dict(prices)
+    for i, name in enumerate(unknowns):
+        prices[name] = z[N + i]
+    market = market_values(x[:S], x[S:], prices['r'], prices['factor'],
+                           model)
+    b_s = np.append(np.zeros((1, J)), x[:S - 1], axis=0)
+    weights = ss_params[16].reshape(S, 1) * ss_params[17].reshape(1, J)
+    measures = inequal.inequality_measures(b_s, weights)
+    return {'K': market['K'], 'L': market['L'], 'Y': market['Y'],
+            'r': prices['r'],
+            'w': firm.get_w_from_r(prices['r'], (ss_params[7], ss_params[6],
+                                                 ss_params[8])),
+            'T_H': prices['T_H'], 'factor': prices['factor'],
+            'revenue': market['net_tax_receipts'],
+            'gini_wealth': float(measures['gini']),
+            'top_10_share': float(measures['top_10_share']),
+            'top_1_share': float(measures['top_1_share'])}
+
+
+def ss_sensitivities(param_names, income_tax_params, ss_params, chi_params,
+                     ss_solution, baseline=False, fix_transfers=False,
+                     outcomes=OUTCOMES):
+    '''
+    Computes the derivatives of SS outcomes with respect to parameters
+    at a solved SS, by the implicit function theorem.
+
+    Inputs:
+        param_names       = list, parameters (see SENSITIVITY_PARAMS)
+        income_tax_params = length 4 tuple, (analytical_mtrs, etr_params,
+                            mtrx_params, mtry_params), of the solved SS
+        ss_params         = list, from SS.create_steady_state_parameters()
+        chi_params        = length 2 tuple, (chi_b, chi_n)
+        ss_solution       = dictionary, SS results (as from SS.run_SS())
+        baseline          = boolean, =True if the SS is a baseline SS
+                            (factor is solved for, rather than held at
+                            its baseline value)
+        fix_transfers     = boolean, =True if transfers are held at their
+                            baseline value
+        outcomes          = list, outcomes reported (see OUTCOMES)
+
+    Functions called:
+        make_model
+        equilibrium_errors
+        equilibrium_jacobian
+        shift_param
+        param_value
+        ss_outcomes
+
+    Objects in function:
+        unknowns = list, outer variables solved for with b and n
+        z        = [2SJ+P,] vector, the SS solution
+        lu       = LU factorization of dF/dz
+        dF       = [2SJ+P,K] array, dF/dtheta of each of K parameters
+        dz       = [2SJ+P,K] array, dz/dtheta
+
+    Returns: table, solution_derivs
+        table           = pandas DataFrame, derivative of each outcome
+                          (rows) with respect to each parameter (columns)
+        solution_derivs = dictionary, derivatives of the solution with
+                          respect to each parameter
+            b      = [K,S,J] array, savings
+            n      = [K,S,J] array, labor supply
+            r, T_H, factor = [K,] vectors
+    '''
+    for name in outcomes:
+        if name not in OUTCOMES:
+            raise ValueError("Unknown outcome: " + name)
+    unknowns = ['r']
+    if not fix_transfers:
+        unknowns.append('T_H')
+    if baseline:
+        unknowns.append('factor')
+    S, J = ss_params[1], ss_params[0]
+    N = 2 * S * J
+    prices = {'r': float(ss_solution['rss']),
+              'T_H': float(ss_solution['T_Hss']),
+              'factor': float(ss_solution['factor_ss'])}
+    x = np.append(ss_solution['bssmat_splus1'], ss_solution['nssmat'],
+                  axis=0)
+    z = np.append(x.T.flatten(), [prices[name] for name in unknowns])
+
+    model = make_model(income_tax_params, ss_params, chi_params)
+    errors = equilibrium_errors(z, prices, model, unknowns)
+    print 'Largest equilibrium error at the SS: ', np.absolute(errors).max()
+    lu = la.lu_factor(equilibrium_jacobian(z, prices, model, unknowns))
+
+    # derivatives of the equations with respect to each parameter
+    values = [param_value(name, income_tax_params, ss_params)
+              for name in param_names]
+    steps = [DIFF_STEP * max(abs(value), 1.0) for value in values]
+    dF = np.zeros((len(z), len(param_names)))
+    for k, name in enumerate(param_names):
+        diff = []
+        for step in (steps[k], -steps[k]):
+            model_k = make_model(*(shift_param(name, step, income_tax_params,
+                                               ss_params) + (chi_params,)))
+            diff.append(equilibrium_errors(z, prices, model_k, unknowns))
+        dF[:, k] = (diff[0] - diff[1]) / (2 * steps[k])
+    dz = -la.lu_solve(lu, dF)
+
+    # derivatives of the outcomes along the path of the solution
+    table = pd.DataFrame(index=outcomes, columns=param_names, dtype=float)
+    for k, name in enumerate(param_names):
+        ends = []
+        for sign in (1.0, -1.0):
+            step = sign * steps[k]
+            model_k = make_model(*(shift_param(name, step, income_tax_params,
+                                               ss_params) + (chi_params,)))
+            ends.append(ss_outcomes(z + step * dz[:, k], prices, model_k,
+                                    unknowns))
+        for outcome in outcomes:
+            table.loc[outcome, name] = ((ends[0][outcome] - ends[1][outcome]) /
+                                        (2 * steps[k]))
+
+    dx = dz[:N].T.reshape(len(param_names), J, 2 * S).transpose(0, 2, 1)
+    solution_derivs = {'b': dx[:, :S], 'n': dx[:, S:]}
+    for name in ('r', 'T_H', 'factor'):
+        if name in unknowns:
+            solution_derivs[name] = dz[N + unknowns.index(name)]
+        else:
+            solution_derivs[name] = np.zeros(len(param_names))
+
+    return table, solution_derivs
@@ -0,0 +1,326 @@
+'''
+------------------------------------------------------------------------
+Solves the SS for many wealth tax (and income tax) policies and returns
+a table of outcomes.
+
+The parameters, demographics and baseline solution are set up once and
+shared by all the policies.  Policies are solved in waves of num_workers
+at a time, in an order that keeps consecutive policies close together,
+and each SS solve starts from the solution of the closest policy solved
+so far or passed in as a warm start (the baseline solution for the
+first wave if there are none).  A wave is solved either on a pool of
+num_workers processes or, with batch_size, as one batch by
+SS.run_SS_batch().
+
+This py-file calls the following other file(s):
+            SS.py
+            inequal.py
+------------------------------------------------------------------------
+'''
+
+# Packages
+import itertools
+import multiprocessing
+import numpy as np
+import pandas as pd
+import SS
+import inequal
+
+'''
+------------------------------------------------------------------------
+SWEEP_PARAMS = dictionary, policy parameters a scenario can set, the wealth
+               tax parameters are at these positions of ss_params and
+               d_income is the d parameter of the income tax functions
+------------------------------------------------------------------------
+'''
+SWEEP_PARAMS = {'h_wealth': 22, 'p_wealth': 23, 'm_wealth': 24,
+                'd_income': None}
+
+'''
+------------------------------------------------------------------------
+    Functions
+------------------------------------------------------------------------
+'''
+
+
+def scenario_grid(**axes):
+    '''
+    Returns the list of scenarios for all combinations of the values of
+    each policy parameter, e.g.
+    scenario_grid(h_wealth=[0.1, 0.2], p_wealth=[0.025, 0.05]).
+    '''
+    for name in axes:
+        if name not in SWEEP_PARAMS:
+            raise ValueError("Unknown policy parameter: " + name)
+    names = sorted(axes.keys())
+    return [dict(zip(names, values))
+            for values in itertools.product(*[axes[name] for name in names])]
+
+
+def set_policy(scenario, income_tax_params, ss_params):
+    '''
+    Returns the income tax and SS parameters with the policy parameters
+    of a scenario.  The parameters passed in are not changed.
+
+    Inputs:
+        scenario          = dictionary, policy parameter values keyed by
+                            name (see SWEEP_PARAMS)
+        income_tax_params = length 4 tuple, (analytical_mtrs, etr_params,
+                            mtrx_params, mtry_params)
+        ss_params         = list, parameters from
+                            SS.create_steady_state_parameters()
+
+    Functions called:
+        SS.set_scenario_params
+
+    Returns: income_tax_params, ss_params
+    '''
+    for name in scenario:
+        if name not in SWEEP_PARAMS:
+            raise ValueError("Unknown policy parameter: " + name)
+    return SS.set_scenario_params(scenario, income_tax_params, ss_params)
+
+
+def solve_scenario(args):
+    '''
+    Solves the SS of one scenario.  Takes a single tuple so it can be
+    mapped over a worker pool.
+
+    Inputs:
+        args            = length 3 tuple, (scenario, params,
+                          initial_guesses)
+        scenario        = dictionary, policy parameter values
+        params          = length 7 tuple, (income_tax_params, ss_params,
+                          iterative_params, chi_params, fix_transfers,
+                          baseline_dir, baseline_solution)
+        initial_guesses = dictionary, SS solution to start from
+
+    Functions called:
+        set_policy
+        SS.run_SS
+
+    Returns: scenario, SS solution (None if the solve failed)
+    '''
+    scenario, params, initial_guesses = args
+    income_tax_params, ss_params, iterative_params, chi_params, \
+        fix_transfers, baseline_dir, baseline_solution = params
+    income_tax_params, ss_params = set_policy(scenario, income_tax_params,
+                                              ss_params)
+    try:
+        ss_output = SS.run_SS(income_tax_params, ss_params, iterative_params,
+                              chi_params, False, fix_transfers=fix_transfers,
+                              baseline_dir=baseline_dir,
+                              initial_guesses=initial_guesses,
+                              baseline_solution=baseline_solution)
+    except RuntimeError as err:
+        print 'SS not found for ', scenario, ': ', err
+        ss_output = None
+    return scenario, ss_output
+
+
+def solve_batch(tasks):
+    '''
+    Solves the SS of several scenarios together with SS.run_SS_batch().
+    If the batch fails, each scenario is solved on its own.
+
+    Inputs:
+        tasks = list of (scenario, params, initial_guesses) tuples, as
+                passed to solve_scenario(), all with the same params
+
+    Functions called:
+        SS.run_SS_batch
+        solve_scenario
+
+    Returns: list of (scenario, SS solution) tuples
+    '''
+    income_tax_params, ss_params, iterative_params, chi_params, \
+        fix_transfers, baseline_dir, baseline_solution = tasks[0][1]
+    scenarios = [task[0] for task in tasks]
+    try:
+        ss_outputs = SS.run_SS_batch(scenarios, income_tax_params, ss_params,
+                                     iterative_params, chi_params, False,
+                                     fix_transfers=fix_transfers,
+                                     baseline_dir=baseline_dir,
+                                     initial_guesses=[task[2]
+                                                      for task in tasks],
+                                     baseline_solution=baseline_solution)
+    except RuntimeError as err:
+        print 'Batch SS not found: ', err
+        return [solve_scenario(task) for task in tasks]
+    return zip(scenarios, ss_outputs)
+
+
+def policy_outcomes(ss_output, omega_SS, lambdas):
+    '''
+    Returns the outcomes of a SS solution reported in the sweep table:
+    revenue, K, Y, r, w, transfers and the gini coefficient and top
+    shares of wealth.
+
+    Inputs:
+        ss_output = dictionary, SS solution
+        omega_SS  = [S,] vector, SS population distribution by age
+        lambdas   = [J,] vector, fraction of population in each ability
+                    group
+
+    Functions called:
+        inequal.inequality_measures
+
+    Returns: dictionary, outcomes
+    '''
+    weights = omega_SS.reshape(-1, 1) * lambdas.reshape(1, -1)
+    measures = inequal.inequality_measures(ss_output['bssmat_s'], weights)
+    return {'revenue': ss_output['net_tax_receipts'],
+            'K': ss_output['Kss'], 'Y': ss_output['Yss'],
+            'r': ss_output['rss'], 'w': ss_output['wss'],
+            'T_H': ss_output['T_Hss'],
+            'gini_wealth': float(measures['gini']),
+            'top_10_share': float(measures['top_10_share']),
+            'top_1_share': float(measures['top_1_share']),
+            'ss_flag': ss_output['ss_flag']}
+
+
+def scenario_points(scenarios):
+    '''
+    Returns the scenarios as points in a [0,1] cube (each policy
+    parameter scaled by its range over the scenarios), so that distances
+    between scenarios do not depend on the units of the parameters.
+    '''
+    names = sorted(set(name for scenario in scenarios for name in scenario))
+    points = np.array([[scenario.get(name, np.nan) for name in names]
+                       for scenario in scenarios], dtype=float)
+    low = np.nanmin(points, axis=0)
+    scale = np.nanmax(points, axis=0) - low
+    scale[scale == 0] = 1.0
+    points = (points - low) / scale
+    # parameters a scenario does not set are taken to be far away
+    points[np.isnan(points)] = 2.0
+    return points
+
+
+def solve_order(points):
+    '''
+    Returns an order of the points in which each point is close to the
+    one before it: a nearest-neighbour path from the first point.
+    '''
+    n = points.shape[0]
+    if n == 0:
+        return []
+    order = [0]
+    left = np.ones(n, dtype=bool)
+    left[0] = False
+    for i in xrange(n - 1):
+        dist = ((points - points[order[-1]]) ** 2).sum(axis=1)
+        dist[~left] = np.inf
+        order.append(int(dist.argmin()))
+        left[order[-1]] = False
+    return order
+
+
+def policy_sweep(scenarios, params, num_workers=1, omega_SS=None,
+                 lambdas=None, batch_size=None, warm_starts=None,
+                 progress=None):
+    '''
+    Solves the SS of each scenario and returns a table of outcomes.
+
+    Inputs:
+        scenarios   = list of dictionaries, policy parameter values of
+                      each scenario (e.g. from scenario_grid())
+        params      = length 7 tuple, (income_tax_params, ss_params,
+                      iterative_params, chi_params, fix_transfers,
+                      baseline_dir, baseline_solution)
+        num_workers = integer, number of scenarios solved at once
+        omega_SS    = [S,] vector, SS population distribution by age
+                      (default is the one in ss_params)
+        lambdas     = [J,] vector, fraction of population in each ability
+                      group (default is the one in ss_params)
+        batch_size  = integer, if given, waves of batch_size scenarios are
+                      solved together by SS.run_SS_batch() instead of
+                      on num_workers processes
+        warm_starts = list of (scenario, SS solution) tuples, solutions
+                      already found (e.g. by an earlier sweep) that
+                      scenarios can start from, along with the
+                      solutions found in this sweep
+        progress    = function called with the number of scenarios
+                      solved and the number of scenarios after each wave
+
+    Functions called:
+        scenario_points
+        solve_order
+        solve_scenario
+        solve_batch
+        policy_outcomes
+
+    Objects in function:
+        points    = [N+W,P] array, scaled parameters of the scenarios and
+                    of the W warm starts
+        order     = list, order scenarios are solved in
+        solutions = dictionary, SS solution of each scenario solved (and
+                    of each warm start, after the scenarios)
+        table     = pandas DataFrame, one row of outcomes per scenario
+
+    Returns: table, SS solutions (list in the order of scenarios)
+    '''
+    income_tax_params, ss_params, iterative_params, chi_params, \
+        fix_transfers, baseline_dir, baseline_solution = params
+    if omega_SS is None:
+        omega_SS = ss_params[16]
+    if lambdas is None:
+        lambdas = ss_params[17]
+
+    if warm_starts is None:
+        warm_starts = []
+    N = len(scenarios)
+    points = scenario_points(list(scenarios) +
+                             [scenario for scenario, ss_output in warm_starts])
+    order = solve_order(points[:N])
+    solutions = dict((N + i, ss_output)
+                     for i, (scenario, ss_output) in enumerate(warm_starts))
+    num_workers = max(1, num_workers)
+    pool = None
+    if batch_size is not None:
+        wave_size = max(1, batch_size)
+    else:
+        wave_size = num_workers
+        if num_workers > 1 and len(scenarios) > 1:
+            pool = multiprocessing.Pool(num_workers)
+
+    for start in xrange(0, len(order), wave_size):
+        wave = order[start:start + wave_size]
+        solved = [i for i in solutions if solutions[i] is not None]
+        tasks = []
+        for i in wave:
+            if len(solved) > 0:
+                dist = ((points[solved] - points[i]) ** 2).sum(axis=1)
+                initial_guesses = solutions[solved[int(dist.argmin())]]
+            else:
+                initial_guesses = baseline_solution
+            tasks.append((scenarios[i], params, initial_guesses))
+        if batch_size is not None:
+            results = solve_batch(tasks)
+        elif pool is None:
+            results = [solve_scenario(task) for task in tasks]
+        else:
+            results = pool.map(solve_scenario, tasks)
+        for i, (scenario, ss_output) in zip(wave, results):
+            solutions[i] = ss_output
+        n_solved = start + len(wave)
+        print 'Solved ', n_solved, ' of ', N, ' scenarios'
+        if progress is not None:
+            progress(n_solved, N)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    rows = []
+    for i, scenario in enumerate(scenarios):
+        row = dict(scenario)
+        if solutions[i] is not None:
+            row.update(policy_outcomes(solutions[i], omega_SS, lambdas))
+        rows.append(row)
+    table = pd.DataFrame(rows)
+    if baseline_solution is not None and 'revenue' in table:
+        table['revenue_change'] = (table['revenue'] -
+                                   baseline_solution['net_tax_receipts'])
+
+    return table, [solutions[i] for i in xrange(N)]
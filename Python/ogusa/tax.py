@@ -11,6 +11,11 @@ Functions for taxes in the steady state and along the transition path.
 import numpy as np
 import cPickle as pickle
 
+# Number of parameters in the ratio of polynomials tax functions.  Tax
+# parameter arrays with a different length last axis hold tabulated
+# schedules, see tabulated_tax_params().
+N_FUNC_PARAMS = 10
+
 '''
 ------------------------------------------------------------------------
     Functions
@@ -29,41 +34,371 @@ def replacement_rate_vals(nssmat, wss, factor_ss, params):
         e         = [S,J] array, effective labor units
         S         = integer, length of economic life
         retire    = integer, retirement age
-    Functions called: None
+    Functions called:
+        replacement_rate_coeffs
+        get_replacement_rate
     Objects in function:
-        AIME       = [J,] vector, average indexed monthly earnings by lifetime income group
-        PIA        = [J,] vector, primary insurance amount by lifetime income group
-        maxpayment = scalar, maximum replacement rate
-        theta      = [J,] vector, replacement rates by lifetime income group
+        rr_coeffs = length 3 tuple, parts of the replacement rate that
+                    do not depend on labor supply
+        theta     = [J,] vector, replacement rates by lifetime income group
     Returns: theta
     '''
+    rr_coeffs = replacement_rate_coeffs(wss, factor_ss, params)
+    theta = get_replacement_rate(nssmat, rr_coeffs)
+    return theta
+
+
+def replacement_rate_coeffs(wss, factor_ss, params):
+    '''
+    Computes the parts of the replacement rate calculation that do not
+    depend on labor supply.  These are fixed while the household problem
+    is solved for given prices, so they are computed once and passed to
+    get_replacement_rate() in each evaluation of the Euler errors.
+    Inputs:
+        wss       = scalar, steady state wage rate
+        factor_ss = scalar, factor that converts model income to dollars
+        params    = length 3 tuple, (e, S, retire)
+        e         = [S,J] array or [S,] vector, effective labor units
+        S         = integer, length of economic life
+        retire    = integer, retirement age
+    Functions called: None
+    Objects in function:
+        n_top     = integer, number of highest earning years in AIME
+        aime_wts  = [retire,J] array, contribution of a unit of labor
+                    supply at each age to AIME
+        pia_scale = scalar, converts monthly PIA to a model units
+                    replacement rate
+    Returns: aime_wts, n_top, pia_scale
+    '''
     e, S, retire = params
     if e.ndim == 2:
         dim2 = e.shape[1]
     else:
         dim2 = 1
-    earnings = (e *(wss * nssmat * factor_ss)).reshape(S,dim2)
     # get highest earning 35 years
-    highest_35_earn = (-1.0*np.sort(-1.0*earnings[:retire,:] ,axis=0))[:int(round((S/80)*35))]
-    AIME = highest_35_earn.sum(0) / ((12.0*(S/80))*int(round((S/80)*35)))
-    PIA = np.zeros(dim2)
-    # Bins from data for each level of replacement
-    for j in xrange(dim2):
-        if AIME[j] < 749.0:
-            PIA[j] = .9 * AIME[j]
-        elif AIME[j] < 4517.0:
-            PIA[j] = 674.1 + .32 * (AIME[j] - 749.0)
-        else:
-            PIA[j] = 1879.86 + .15 * (AIME[j] - 4517.0)
+    n_top = int(round((S/80)*35))
+    aime_wts = ((e * wss * factor_ss).reshape(S, dim2)[:retire, :] /
+                ((12.0*(S/80))*n_top))
+    pia_scale = (12.0*S/80) / (factor_ss*wss)
+    return aime_wts, n_top, pia_scale
+
+
+def get_replacement_rate(nssmat, params):
+    '''
+    Calculates replacement rate values for the payroll tax given labor
+    supply and the coefficients from replacement_rate_coeffs().
+    Inputs:
+        nssmat    = [S,J] array or [S,] vector, steady state labor supply
+        params    = length 3 tuple, (aime_wts, n_top, pia_scale)
+        aime_wts  = [retire,J] array, contribution of a unit of labor
+                    supply at each age to AIME
+        n_top     = integer, number of highest earning years in AIME
+        pia_scale = scalar, converts monthly PIA to a model units
+                    replacement rate
+    Functions called: None
+    Objects in function:
+        AIME       = [J,] vector, average indexed monthly earnings by lifetime income group
+        PIA        = [J,] vector, primary insurance amount by lifetime income group
+        maxpayment = scalar, maximum replacement rate
+        theta      = [J,] vector, replacement rates by lifetime income group
+    Returns: theta
+    '''
+    aime_wts, n_top, pia_scale = params
+    retire, dim2 = aime_wts.shape
+    n_work = nssmat.reshape(-1, dim2)[:retire, :]
+    if n_top >= retire:
+        AIME = (aime_wts * n_work).sum(0)
+    else:
+        # only the highest earning years count, partitioning selects
+        # them without a full sort
+        AIME = -np.partition(-aime_wts * n_work, n_top - 1,
+                             axis=0)[:n_top].sum(0)
+    # Bins from data for each level of replacement, the PIA formula is
+    # continuous so it is the sum of the marginal rates on each bin
+    PIA = (.9 * np.minimum(AIME, 749.0) +
+           .32 * np.clip(AIME - 749.0, 0.0, 4517.0 - 749.0) +
+           .15 * np.maximum(AIME - 4517.0, 0.0))
     # Set the maximum monthly replacment rate from SS benefits tables
     maxpayment = 3501.00
-    PIA[PIA > maxpayment] = maxpayment
-    theta = (PIA*(12.0*S/80)) / (factor_ss*wss)
+    PIA = np.minimum(PIA, maxpayment)
+    theta = PIA * pia_scale
     return theta
 
 
 
 
+def compress_tax_params(params):
+    '''
+    Stores tax function parameters with only the dimensions over which
+    they vary.  Any age or year axis along which the parameters are
+    constant is reduced to length one, so parameters that are constant,
+    vary by age, vary by year or vary by age and year all keep the
+    [S,T,#tax params] layout and are resolved by broadcasting.
+
+    Inputs:
+        params = [S,T,#tax params] array, tax function parameters by
+                 age and year
+
+    Functions called: None
+
+    Objects in function:
+        first = [S,T,#tax params] array, parameters at the first index
+                along the axis being checked
+
+    Returns: params
+    '''
+    for axis in xrange(params.ndim - 1):
+        first = params.take([0], axis=axis)
+        if (params == first).all():
+            params = first
+    return params
+
+
+def extend_tax_params(params, length):
+    '''
+    Extends tax function parameters along the year axis to the given
+    number of periods, holding the parameters for the last year fixed
+    thereafter.  Parameters that do not vary by year are returned as
+    they are.
+
+    Inputs:
+        params = [S,BW,#tax params] array, tax function parameters by
+                 age and budget window year
+        length = integer, number of years needed (e.g. T+S)
+
+    Functions called: None
+
+    Objects in function:
+        params_TP = [S,length,#tax params] array, tax function parameters
+                    over the time path
+
+    Returns: params_TP
+    '''
+    if params.shape[1] == 1:
+        return params
+    BW = params.shape[1]
+    params_TP = np.zeros((params.shape[0], length, params.shape[2]))
+    params_TP[:, :BW, :] = params
+    params_TP[:, BW:, :] = params[:, BW - 1:BW, :]
+    return params_TP
+
+
+def get_tax_params(params, s, t):
+    '''
+    Looks up the tax function parameters faced at ages s in years t,
+    e.g. along the diagonal of a cohort's lifetime.  If the parameters
+    vary by neither age nor year a single row is returned, which
+    broadcasts against any household arrays.
+
+    Inputs:
+        params = [S,T,#tax params] array, tax function parameters, possibly
+                 compressed by compress_tax_params()
+        s      = [N,] vector, ages
+        t      = [N,] vector, years
+
+    Functions called: None
+
+    Objects in function:
+        s_idx = [N,] vector, age index into params
+        t_idx = [N,] vector, year index into params
+
+    Returns: [N,#tax params] or [1,#tax params] array
+    '''
+    if params.shape[0] == 1 and params.shape[1] == 1:
+        return params[0]
+    s_idx = np.asarray(s) * (params.shape[0] > 1)
+    t_idx = np.asarray(t) * (params.shape[1] > 1)
+    return params[s_idx, t_idx, :]
+
+
+def tabulated_tax_params(income, rates):
+    '''
+    Builds a tabulated tax schedule that can be used in place of the
+    ratio of polynomials tax function parameters (e.g. ETRs or MTRs
+    from microsimulation).  The rates are interpolated over income with
+    a monotone (Fritsch-Carlson) cubic spline, so the schedule and its
+    derivative are continuous and no new extrema are introduced.  The
+    node slopes are computed here, once, so evaluation only needs a
+    search over the income grid.
+
+    Inputs:
+        income = [N,] vector, increasing income grid (in dollars) shared
+                 by all ages and years
+        rates  = [N,], [S,T,N] array, tax rates at each income grid
+                 point, optionally by age and year
+
+    Functions called: None
+
+    Objects in function:
+        h      = [N-1,] vector, width of each income interval
+        delta  = [S,T,N-1] array, slope of the rates over each interval
+        w1     = [N-2,] vector, weight on the slope to the left of a node
+        w2     = [N-2,] vector, weight on the slope to the right of a node
+        slopes = [S,T,N] array, spline derivatives at the income nodes
+        table  = [S,T,3N] array, income nodes, rates and slopes
+
+    Returns: table
+    '''
+    income = np.asarray(income, dtype=float)
+    rates = np.asarray(rates, dtype=float)
+    if rates.ndim == 1:
+        rates = rates.reshape(1, 1, rates.shape[0])
+    h = np.diff(income)
+    delta = np.diff(rates, axis=-1) / h
+    slopes = np.zeros(rates.shape)
+    slopes[..., 0] = delta[..., 0]
+    slopes[..., -1] = delta[..., -1]
+    # interior nodes use the weighted harmonic mean of the adjacent
+    # slopes, and are flat at local extrema to keep the spline monotone
+    w1 = 2.0 * h[1:] + h[:-1]
+    w2 = h[1:] + 2.0 * h[:-1]
+    same_sign = (delta[..., :-1] * delta[..., 1:]) > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        harmonic = (w1 + w2) / (w1 / delta[..., :-1] + w2 / delta[..., 1:])
+    slopes[..., 1:-1] = np.where(same_sign, harmonic, 0.0)
+    table = np.concatenate((np.broadcast_to(income, rates.shape), rates,
+                            slopes), axis=-1)
+    return compress_tax_params(table)
+
+
+def get_tabulated_rate(I, table):
+    '''
+    Evaluates a tabulated tax schedule and its derivative with respect
+    to income.  Rates are held at their end values outside the income
+    grid.
+
+    Inputs:
+        I     = [T,S,J] array, total income (in dollars)
+        table = [S,T,3N] array, tabulated schedule from
+                tabulated_tax_params(), with any axes that broadcast
+                against I
+
+    Functions called: None
+
+    Objects in function:
+        nodes = [N,] vector, income grid
+        extra = integer, number of dimensions the table has beyond
+                those of I plus the table axis
+        idx   = [T,S,J] array, interval of the income grid containing I
+        h     = [T,S,J] array, width of that interval
+        t     = [T,S,J] array, position of I within the interval
+        rate  = [T,S,J] array, tax rate at I
+        deriv = [T,S,J] array, derivative of the tax rate at I
+
+    Returns: rate, deriv
+    '''
+    N = table.shape[-1] // 3
+    nodes = table[(0,) * (table.ndim - 1)][:N]
+    I = np.asarray(I, dtype=float)
+    # give the table the same number of dimensions as the index array
+    # (adding or dropping leading singleton axes) so that it broadcasts
+    # in the lookups below
+    extra = table.ndim - (I.ndim + 1)
+    if extra > 0:
+        table = table.reshape(table.shape[extra:])
+    elif extra < 0:
+        table = table.reshape((1,) * -extra + table.shape)
+    idx = np.clip(np.searchsorted(nodes, I, side='right') - 1, 0, N - 2)
+    idx = idx[..., np.newaxis]
+    y0 = np.take_along_axis(table, N + idx, axis=-1)[..., 0]
+    y1 = np.take_along_axis(table, N + idx + 1, axis=-1)[..., 0]
+    m0 = np.take_along_axis(table, 2 * N + idx, axis=-1)[..., 0]
+    m1 = np.take_along_axis(table, 2 * N + idx + 1, axis=-1)[..., 0]
+    idx = idx[..., 0]
+    h = nodes[idx + 1] - nodes[idx]
+    t = (np.clip(I, nodes[0], nodes[-1]) - nodes[idx]) / h
+
+    # cubic Hermite basis
+    t2 = t ** 2
+    t3 = t ** 3
+    rate = ((2 * t3 - 3 * t2 + 1) * y0 + (t3 - 2 * t2 + t) * h * m0 +
+            (-2 * t3 + 3 * t2) * y1 + (t3 - t2) * h * m1)
+    deriv = ((6 * t2 - 6 * t) * (y0 - y1) / h + (3 * t2 - 4 * t + 1) * m0 +
+             (3 * t2 - 2 * t) * m1)
+    deriv = np.where((I < nodes[0]) | (I > nodes[-1]), 0.0, deriv)
+    return rate, deriv
+
+
+def wealth_tax_brackets(thresholds, rates, smooth=0.0):
+    '''
+    Builds the table for a bracketed wealth tax.  The table is passed in
+    place of the scalar p_wealth, in which case h_wealth and m_wealth are
+    not used.  The tax owed at each threshold is computed here, once, so
+    evaluating the tax only needs a search over the thresholds.
+
+    Inputs:
+        thresholds = [K,] vector, increasing wealth thresholds (in model
+                     units) at which each bracket starts, the first is
+                     the exemption threshold
+        rates      = [K,] vector, marginal tax rate on wealth in each
+                     bracket
+        smooth     = scalar, width over which the kinks at the
+                     thresholds are smoothed so that the tax is
+                     differentiable, =0 for the exact schedule
+
+    Functions called: None
+
+    Objects in function:
+        tax_at_thresh = [K,] vector, tax owed on wealth equal to each
+                        threshold
+        table         = [K,4] array, thresholds, rates, tax owed at the
+                        thresholds and smoothing width
+
+    Returns: table
+    '''
+    thresholds = np.asarray(thresholds, dtype=float)
+    rates = np.asarray(rates, dtype=float)
+    tax_at_thresh = np.append([0.0],
+                              np.cumsum(rates[:-1] * np.diff(thresholds)))
+    table = np.column_stack((thresholds, rates, tax_at_thresh,
+                             np.ones(thresholds.shape[0]) * smooth))
+    return table
+
+
+def get_bracket_wealth_tax(b, table):
+    '''
+    Evaluates a bracketed wealth tax.
+
+    Inputs:
+        b     = [T,S,J] array, wealth holdings
+        table = [K,4] array, bracket table from wealth_tax_brackets()
+
+    Functions called: None
+
+    Objects in function:
+        thresholds = [K,] vector, wealth thresholds
+        rates      = [K,] vector, marginal tax rates in each bracket
+        smooth     = scalar, smoothing width
+        k          = [T,S,J] array, bracket each household is in (-1 if
+                     below the exemption threshold)
+        z          = [T,S,J,K] array, distance above each threshold in
+                     units of the smoothing width
+        T_W        = [T,S,J] array, wealth tax owed
+        mtr        = [T,S,J] array, marginal tax rate on wealth
+
+    Returns: T_W, mtr
+    '''
+    thresholds = table[:, 0]
+    rates = table[:, 1]
+    smooth = table[0, 3]
+    b = np.asarray(b, dtype=float)
+    if smooth > 0:
+        # each kink becomes a softplus in the distance above the
+        # threshold, the sum of which is the tax
+        rate_change = np.diff(np.append([0.0], rates))
+        z = (b[..., np.newaxis] - thresholds) / smooth
+        T_W = (rate_change * smooth * np.logaddexp(0.0, z)).sum(-1)
+        mtr = (rate_change * 0.5 * (1.0 + np.tanh(0.5 * z))).sum(-1)
+    else:
+        k = np.searchsorted(thresholds, b, side='right') - 1
+        below = k < 0
+        k = np.maximum(k, 0)
+        T_W = np.where(below, 0.0, table[k, 2] + rates[k] *
+                       (b - thresholds[k]))
+        mtr = np.where(below, 0.0, rates[k])
+    return T_W, mtr
+
+
 def tau_wealth(b, params):
     '''
     Calculates the effective tax rate on wealth.
@@ -72,12 +407,16 @@ def tau_wealth(b, params):
         b        = [T,S,J] array, wealth holdings
         params   = length 3 tuple, (h_wealth, p_wealth, m_wealth)
         h_wealth = scalar, parameter of wealth tax function
-        p_wealth = scalar, parameter of wealth tax function
+        p_wealth = scalar, parameter of wealth tax function, or [K,4]
+                   array, bracket table from wealth_tax_brackets()
         m_wealth = scalar, parameter of wealth tax function
 
-    Functions called: None
+    Functions called:
+        get_bracket_wealth_tax
 
     Objects in function:
+        T_W   = [T,S,J] array, wealth tax owed under a bracketed tax
+        mtr   = [T,S,J] array, marginal tax rate under a bracketed tax
         tau_w = [T,S,J] array, effective tax rate on wealth
 
     Returns: tau_w
@@ -85,6 +424,13 @@ def tau_wealth(b, params):
     '''
     h_wealth, p_wealth, m_wealth = params
 
+    if np.ndim(p_wealth) == 2:
+        T_W, mtr = get_bracket_wealth_tax(b, p_wealth)
+        # the average rate at zero wealth is its limit, the marginal rate
+        b_nonzero = np.where(b == 0, 1.0, b)
+        tau_w = np.where(b == 0, mtr, T_W / b_nonzero)
+        return tau_w
+
     h = h_wealth
     m = m_wealth
     p = p_wealth
@@ -100,12 +446,16 @@ def tau_w_prime(b, params):
         b        = [T,S,J] array, wealth holdings
         params   = length 3 tuple, (h_wealth, p_wealth, m_wealth)
         h_wealth = scalar, parameter of wealth tax function
-        p_wealth = scalar, parameter of wealth tax function
+        p_wealth = scalar, parameter of wealth tax function, or [K,4]
+                   array, bracket table from wealth_tax_brackets()
         m_wealth = scalar, parameter of wealth tax function
 
-    Functions called: None
+    Functions called:
+        get_bracket_wealth_tax
 
     Objects in function:
+        T_W         = [T,S,J] array, wealth tax owed under a bracketed tax
+        mtr         = [T,S,J] array, marginal tax rate under a bracketed tax
         tau_w_prime = [T,S,J] array, marginal tax rate on wealth from wealth tax
 
     Returns: tau_w_prime
@@ -113,6 +463,14 @@ def tau_w_prime(b, params):
     '''
     h_wealth, p_wealth, m_wealth = params
 
+    if np.ndim(p_wealth) == 2:
+        # derivative of the average rate, (mtr - T_W/b)/b
+        T_W, mtr = get_bracket_wealth_tax(b, p_wealth)
+        b_nonzero = np.where(b == 0, 1.0, b)
+        tau_w_prime = np.where(b == 0, 0.0,
+                               (mtr - T_W / b_nonzero) / b_nonzero)
+        return tau_w_prime
+
     h = h_wealth
     m = m_wealth
     p = p_wealth
@@ -120,6 +478,41 @@ def tau_w_prime(b, params):
     return tau_w_prime
 
 
+def mtr_wealth(b, params):
+    '''
+    Calculates the marginal tax rate on wealth, the derivative of the
+    wealth tax owed, tau_w_prime * b + tau_wealth.  A bracketed tax is
+    evaluated once for both terms.
+
+    Inputs:
+        b        = [T,S,J] array, wealth holdings
+        params   = length 3 tuple, (h_wealth, p_wealth, m_wealth)
+        h_wealth = scalar, parameter of wealth tax function
+        p_wealth = scalar, parameter of wealth tax function, or [K,4]
+                   array, bracket table from wealth_tax_brackets()
+        m_wealth = scalar, parameter of wealth tax function
+
+    Functions called:
+        get_bracket_wealth_tax
+        tau_w_prime
+        tau_wealth
+
+    Objects in function:
+        T_W   = [T,S,J] array, wealth tax owed under a bracketed tax
+        mtr_w = [T,S,J] array, marginal tax rate on wealth
+
+    Returns: mtr_w
+    '''
+    h_wealth, p_wealth, m_wealth = params
+
+    if np.ndim(p_wealth) == 2:
+        T_W, mtr_w = get_bracket_wealth_tax(b, p_wealth)
+        return mtr_w
+
+    mtr_w = tau_w_prime(b, params) * b + tau_wealth(b, params)
+    return mtr_w
+
+
 def tau_income(r, w, b, n, factor, params):
     '''
     Calculate personal income tax liability.
@@ -157,50 +550,23 @@ def tau_income(r, w, b, n, factor, params):
     '''
     e, etr_params = params
 
-    if etr_params.ndim == 4:
-        A = etr_params[:,:,:,0]
-        B = etr_params[:,:,:,1]
-        C = etr_params[:,:,:,2]
-        D = etr_params[:,:,:,3]
-        E = etr_params[:,:,:,4]
-        F = etr_params[:,:,:,5]
-        max_x = etr_params[:,:,:,6]
-        min_x = etr_params[:,:,:,7]
-        max_y = etr_params[:,:,:,8]
-        min_y = etr_params[:,:,:,9]
-    if etr_params.ndim == 3:
-        A = etr_params[:,:,0]
-        B = etr_params[:,:,1]
-        C = etr_params[:,:,2]
-        D = etr_params[:,:,3]
-        E = etr_params[:,:,4]
-        F = etr_params[:,:,5]
-        max_x = etr_params[:,:,6]
-        min_x = etr_params[:,:,7]
-        max_y = etr_params[:,:,8]
-        min_y = etr_params[:,:,9]
-    if etr_params.ndim == 2:
-        A = etr_params[:,0]
-        B = etr_params[:,1]
-        C = etr_params[:,2]
-        D = etr_params[:,3]
-        E = etr_params[:,4]
-        F = etr_params[:,5]
-        max_x = etr_params[:,6]
-        min_x = etr_params[:,7]
-        max_y = etr_params[:,8]
-        min_y = etr_params[:,9]
-    if etr_params.ndim == 1:
-        A = etr_params[0]
-        B = etr_params[1]
-        C = etr_params[2]
-        D = etr_params[3]
-        E = etr_params[4]
-        F = etr_params[5]
-        max_x = etr_params[6]
-        min_x = etr_params[7]
-        max_y = etr_params[8]
-        min_y = etr_params[9]
+    if etr_params.shape[-1] != N_FUNC_PARAMS:
+        I = (w*e*n)*factor + (r*b)*factor
+        tau = get_tabulated_rate(I, etr_params)[0]
+        return tau
+
+    # tax function parameters may have singleton axes where they do not
+    # vary (see compress_tax_params), these broadcast against income
+    A = etr_params[..., 0]
+    B = etr_params[..., 1]
+    C = etr_params[..., 2]
+    D = etr_params[..., 3]
+    E = etr_params[..., 4]
+    F = etr_params[..., 5]
+    max_x = etr_params[..., 6]
+    min_x = etr_params[..., 7]
+    max_y = etr_params[..., 8]
+    min_y = etr_params[..., 9]
 
     x = (w*e*n)*factor
     y = (r*b)*factor
@@ -254,39 +620,21 @@ def MTR_capital(r, w, b, n, factor, params):
 
     e, etr_params, mtry_params, analytical_mtrs = params
 
-    if mtry_params.ndim == 3:
-        A = mtry_params[:,:,0]
-        B = mtry_params[:,:,1]
-        C = mtry_params[:,:,2]
-        D = mtry_params[:,:,3]
-        E = mtry_params[:,:,4]
-        F = mtry_params[:,:,5]
-        max_x = mtry_params[:,:,6]
-        min_x = mtry_params[:,:,7]
-        max_y = mtry_params[:,:,8]
-        min_y = mtry_params[:,:,9]
-    if mtry_params.ndim == 2:
-        A = mtry_params[:,0]
-        B = mtry_params[:,1]
-        C = mtry_params[:,2]
-        D = mtry_params[:,3]
-        E = mtry_params[:,4]
-        F = mtry_params[:,5]
-        max_x = mtry_params[:,6]
-        min_x = mtry_params[:,7]
-        max_y = mtry_params[:,8]
-        min_y = mtry_params[:,9]
-    if mtry_params.ndim == 1:
-        A = mtry_params[0]
-        B = mtry_params[1]
-        C = mtry_params[2]
-        D = mtry_params[3]
-        E = mtry_params[4]
-        F = mtry_params[5]
-        max_x = mtry_params[6]
-        min_x = mtry_params[7]
-        max_y = mtry_params[8]
-        min_y = mtry_params[9]
+    if mtry_params.shape[-1] != N_FUNC_PARAMS:
+        I = (w*e*n)*factor + (r*b)*factor
+        return get_tabulated_mtr(I, etr_params, mtry_params,
+                                 analytical_mtrs)
+
+    A = mtry_params[..., 0]
+    B = mtry_params[..., 1]
+    C = mtry_params[..., 2]
+    D = mtry_params[..., 3]
+    E = mtry_params[..., 4]
+    F = mtry_params[..., 5]
+    max_x = mtry_params[..., 6]
+    min_x = mtry_params[..., 7]
+    max_y = mtry_params[..., 8]
+    min_y = mtry_params[..., 9]
 
     x = (w*e*n)*factor
     y = (r*b)*factor
@@ -344,39 +692,21 @@ def MTR_labor(r, w, b, n, factor, params):
 
     e, etr_params, mtrx_params, analytical_mtrs = params
 
-    if etr_params.ndim == 3:
-        A = etr_params[:,:,0]
-        B = etr_params[:,:,1]
-        C = etr_params[:,:,2]
-        D = etr_params[:,:,3]
-        E = etr_params[:,:,4]
-        F = etr_params[:,:,5]
-        max_x = etr_params[:,:,6]
-        min_x = etr_params[:,:,7]
-        max_y = etr_params[:,:,8]
-        min_y = etr_params[:,:,9]
-    if etr_params.ndim == 2:
-        A = etr_params[:,0]
-        B = etr_params[:,1]
-        C = etr_params[:,2]
-        D = etr_params[:,3]
-        E = etr_params[:,4]
-        F = etr_params[:,5]
-        max_x = etr_params[:,6]
-        min_x = etr_params[:,7]
-        max_y = etr_params[:,8]
-        min_y = etr_params[:,9]
-    if etr_params.ndim == 1:
-        A = etr_params[0]
-        B = etr_params[1]
-        C = etr_params[2]
-        D = etr_params[3]
-        E = etr_params[4]
-        F = etr_params[5]
-        max_x = etr_params[6]
-        min_x = etr_params[7]
-        max_y = etr_params[8]
-        min_y = etr_params[9]
+    if mtrx_params.shape[-1] != N_FUNC_PARAMS:
+        I = (w*e*n)*factor + (r*b)*factor
+        return get_tabulated_mtr(I, etr_params, mtrx_params,
+                                 analytical_mtrs)
+
+    A = etr_params[..., 0]
+    B = etr_params[..., 1]
+    C = etr_params[..., 2]
+    D = etr_params[..., 3]
+    E = etr_params[..., 4]
+    F = etr_params[..., 5]
+    max_x = etr_params[..., 6]
+    min_x = etr_params[..., 7]
+    max_y = etr_params[..., 8]
+    min_y = etr_params[..., 9]
 
     x = (w*e*n)*factor
     y = (r*b)*factor
@@ -395,6 +725,37 @@ def MTR_labor(r, w, b, n, factor, params):
     return mtr
 
 
+def get_tabulated_mtr(I, etr_params, mtr_params, analytical_mtrs):
+    '''
+    Generates marginal tax rates from tabulated schedules.  Analytical
+    MTRs are the derivative of total taxes, ETR(I)*I, with respect to
+    income; otherwise the tabulated MTRs are used directly.
+
+    Inputs:
+        I               = [T,S,J] array, total income (in dollars)
+        etr_params      = [S,T,3N] array, tabulated effective tax rates
+        mtr_params      = [S,T,3N] array, tabulated marginal tax rates
+        analytical_mtrs = boolean, =True if use analytical mtrs rather
+                          than tabulated mtrs
+
+    Functions called:
+        get_tabulated_rate
+
+    Objects in function:
+        etr   = [T,S,J] array, effective tax rate
+        deriv = [T,S,J] array, derivative of the effective tax rate
+        mtr   = [T,S,J] array, marginal tax rate
+
+    Returns: mtr
+    '''
+    if analytical_mtrs:
+        etr, deriv = get_tabulated_rate(I, etr_params)
+        mtr = etr + deriv * I
+    else:
+        mtr = get_tabulated_rate(I, mtr_params)[0]
+    return mtr
+
+
 def get_lump_sum(r, w, b, n, BQ, factor, params):
     '''
     Gives lump sum transfer value.
@@ -426,16 +787,11 @@ def get_lump_sum(r, w, b, n, BQ, factor, params):
         J           = integer, number of lifetime income groups
 
     Functions called:
-        tau_income
-        tau_wealth
+        get_tax_receipts
 
     Objects in function:
-        I    = [T,S,J] array, total income
-        T_I  = [T,S,J] array, total income taxes
-        T_P  = [T,S,J] array, total payroll taxes
-        T_W  = [T,S,J] array, total wealth taxes
-        T_BQ = [T,S,J] array, total bequest taxes
-        T_H  = [T,] vector, lump sum transfer amount(s)
+        receipts = [T,S,J] array, net tax receipts by household
+        T_H      = [T,] vector, lump sum transfer amount(s)
 
     Returns: T_H
 
@@ -444,34 +800,86 @@ def get_lump_sum(r, w, b, n, BQ, factor, params):
     e, lambdas, omega, method, etr_params, theta, tau_bq, \
         tau_payroll, h_wealth, p_wealth, m_wealth, retire, T, S, J = params
 
+    receipts_params = (e, lambdas, method, etr_params, theta, tau_bq,
+                       tau_payroll, h_wealth, p_wealth, m_wealth, retire,
+                       T, S, J)
+    receipts = get_tax_receipts(r, w, b, n, BQ, factor, receipts_params)
+    if method == 'SS':
+        T_H = (omega * lambdas * receipts).sum()
+    elif method == 'TPI':
+        T_H = (omega * lambdas * receipts).sum(1).sum(1)
+    return T_H
+
+
+def get_tax_receipts(r, w, b, n, BQ, factor, params):
+    '''
+    Gives net tax receipts from each household, before aggregation.
+    Aggregate receipts are the population weighted sum of these, see
+    get_lump_sum() and aggregates.get_aggregates().
+
+    Inputs:
+        r           = [T,] vector, interest rate
+        w           = [T,] vector, wage rate
+        b           = [T,S,J] array, wealth holdings
+        n           = [T,S,J] array, labor supply
+        BQ          = [T,J] array, bequest amounts
+        factor      = scalar, model income scaling factor
+        params      = length 14 tuple, (e, lambdas, method, etr_params,
+                                        theta, tau_bq, tau_payroll, h_wealth,
+                                        p_wealth, m_wealth, retire, T, S, J)
+        e           = [T,S,J] array, effective labor units
+        lambdas     = [J,] vector, population weights by lifetime income group
+        method      = string, 'SS' or 'TPI'
+        etr_params  = [T,S,J] array, effective tax rate function parameters
+        theta       = [J,] vector, replacement rate values by lifetime income group
+        tau_bq      = scalar, bequest tax rate
+        tau_payroll = scalar, payroll tax rate
+        h_wealth    = scalar, wealth tax function parameter
+        p_wealth    = scalar, wealth tax function parameter
+        m_wealth    = scalar, wealth tax function parameter
+        retire      = integer, retirement age
+        T           = integer, number of periods in transition path
+        S           = integer, number of age groups
+        J           = integer, number of lifetime income groups
+
+    Functions called:
+        tau_income
+        tau_wealth
+
+    Objects in function:
+        I        = [T,S,J] array, total income
+        T_I      = [T,S,J] array, total income taxes
+        T_P      = [T,S,J] array, total payroll taxes
+        T_W      = [T,S,J] array, total wealth taxes
+        T_BQ     = [T,S,J] array, total bequest taxes
+        receipts = [T,S,J] array, net tax receipts by household
+
+    Returns: receipts
+
+    '''
+
+    e, lambdas, method, etr_params, theta, tau_bq, tau_payroll, \
+        h_wealth, p_wealth, m_wealth, retire, T, S, J = params
+
     I = r * b + w * e * n
 
-    if I.ndim == 2:
-        T_I = np.zeros((S,J))
-        for j in xrange(J):
-            TI_params = (e[:,j], etr_params)
-            T_I[:,j] = tau_income(r, w, b[:,j], n[:,j], factor, TI_params) * I[:,j]
-    if I.ndim == 3:
-        T_I = np.zeros((T,S,J))
-        for j in xrange(J):
-            if etr_params.ndim == 3:
-                tau_inc_params3D = etr_params[:,j,:]
-            if etr_params.ndim == 4:
-                tau_inc_params3D = etr_params[:,:,j,:]
-            TI_params = (e[:,:,j], tau_inc_params3D)
-            T_I[:,:,j] = tau_income(r[:,:,j], w[:,:,j], b[:,:,j], n[:,:,j], factor, TI_params) * I[:,:,j]
+    # tax function parameters that do not vary by lifetime income group
+    # get a singleton J axis so they broadcast across all j at once
+    if etr_params.ndim == I.ndim:
+        etr_params = np.expand_dims(etr_params, -2)
+    TI_params = (e, etr_params)
+    T_I = tau_income(r, w, b, n, factor, TI_params) * I
     T_P = tau_payroll * w * e * n
     TW_params = (h_wealth, p_wealth, m_wealth)
     T_W = tau_wealth(b, TW_params) * b
     if method == 'SS':
         T_P[retire:] -= theta * w
         T_BQ = tau_bq * BQ / lambdas
-        T_H = (omega * lambdas * (T_I + T_P + T_BQ + T_W)).sum()
     elif method == 'TPI':
         T_P[:, retire:, :] -= theta.reshape(1, 1, J) * w[:,retire:,:]
         T_BQ = tau_bq.reshape(1, 1, J) * BQ / lambdas
-        T_H = (omega * lambdas * (T_I + T_P + T_BQ + T_W)).sum(1).sum(1)
-    return T_H
+    receipts = T_I + T_P + T_BQ + T_W
+    return receipts
 
 
 def total_taxes(r, w, b, n, BQ, factor, T_H, j, shift, params):
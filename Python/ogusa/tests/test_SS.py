@@ -0,0 +1,65 @@
+'''
+------------------------------------------------------------------------
+Tests of the batched SS solve in SS.py against solving each scenario on
+its own, starting from the saved baseline solution.
+------------------------------------------------------------------------
+'''
+
+import cPickle as pickle
+import os
+import numpy as np
+import pytest
+from ogusa import SS, tax
+
+cur_path = os.path.split(os.path.abspath(__file__))[0]
+BASELINE_DIR = os.path.join(cur_path, '..', '..', 'OUTPUT_BASELINE',
+                            'sigma2.0')
+
+
+@pytest.fixture(scope='module')
+def ss_setup():
+    with open(os.path.join(BASELINE_DIR, 'run_parameters.pkl'), "rb") as f:
+        sim_params = pickle.load(f)
+    income_tax_params, ss_params, iterative_params, chi_params = \
+        SS.create_steady_state_parameters(**sim_params)
+    baseline_solution = SS.load_SS_solution(BASELINE_DIR)
+    chi_params = (baseline_solution['chi_b'], baseline_solution['chi_n'])
+    return (income_tax_params, ss_params, [250, 1e-9], chi_params,
+            baseline_solution)
+
+
+def solve(scenarios, ss_setup):
+    income_tax_params, ss_params, iterative_params, chi_params, \
+        baseline_solution = ss_setup
+    batched = SS.run_SS_batch(scenarios, income_tax_params, ss_params,
+                              iterative_params, chi_params, False,
+                              fix_transfers=True,
+                              initial_guesses=baseline_solution,
+                              baseline_solution=baseline_solution)
+    single = []
+    for scenario in scenarios:
+        income_tax_params_k, ss_params_k = SS.set_scenario_params(
+            scenario, income_tax_params, ss_params)
+        single.append(SS.run_SS(income_tax_params_k, ss_params_k,
+                                iterative_params, chi_params, False,
+                                fix_transfers=True,
+                                initial_guesses=baseline_solution,
+                                baseline_solution=baseline_solution))
+    return batched, single
+
+
+def test_batch_matches_single(ss_setup):
+    scenarios = [{}, {'p_wealth': 0.001}]
+    batched, single = solve(scenarios, ss_setup)
+    for ss_batch, ss_single in zip(batched, single):
+        assert np.allclose(ss_batch['rss'], ss_single['rss'], rtol=1e-6)
+        assert np.allclose(ss_batch['bssmat_splus1'],
+                           ss_single['bssmat_splus1'], atol=1e-5)
+
+
+def test_batch_with_bracket_wealth_tax(ss_setup):
+    table = tax.wealth_tax_brackets([0.5, 2.0], [0.001, 0.002])
+    scenarios = [{'p_wealth': 0.001}, {'p_wealth': table}]
+    batched, single = solve(scenarios, ss_setup)
+    for ss_batch, ss_single in zip(batched, single):
+        assert np.allclose(ss_batch['rss'], ss_single['rss'])
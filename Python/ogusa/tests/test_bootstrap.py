@@ -0,0 +1,31 @@
+'''
+------------------------------------------------------------------------
+Tests of the weighted bootstrap in bootstrap.py.
+------------------------------------------------------------------------
+'''
+
+import numpy as np
+from ogusa import bootstrap
+
+
+def weighted_mean(mult, data):
+    '''
+    Moment function returning the mean of the data in each replicate.
+    '''
+    values, = data
+    return (np.dot(mult, values) / mult.sum(1)).reshape(-1, 1)
+
+
+def test_parallel_matches_serial():
+    np.random.seed(0)
+    values = np.random.lognormal(size=500)
+    args = (weighted_mean, (values,), values.shape[0], 50)
+    serial = bootstrap.boot_moments(*args, seed=7, block_size=8,
+                                    num_workers=1)
+    parallel = bootstrap.boot_moments(*args, seed=7, block_size=8,
+                                      num_workers=3)
+    assert serial.shape == (50, 1)
+    assert np.array_equal(serial, parallel)
+    # a different seed gives different replicates
+    other = bootstrap.boot_moments(*args, seed=8, block_size=8)
+    assert not np.array_equal(serial, other)
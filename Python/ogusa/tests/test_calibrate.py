@@ -0,0 +1,44 @@
+'''
+------------------------------------------------------------------------
+Tests of the evaluation log used by the calibration in calibrate.py.
+------------------------------------------------------------------------
+'''
+
+import numpy as np
+from ogusa import calibrate
+
+
+def test_solve_moments_reuses_logged_evaluations(monkeypatch):
+    J, S = 2, 3
+    ss_params = (J, S) + (None,) * 14 + (np.ones(S) / S, np.ones(J) / J) + \
+        (None,) * 10
+    params = (None, ss_params, None, None)
+    data_moments = np.zeros(J + 2 + S)
+    W = np.identity(J + 2 + S)
+    solves = []
+
+    def run_SS(*args, **kwargs):
+        solves.append(args[3])
+        return {'ss_flag': 0}
+
+    monkeypatch.setattr(calibrate.SS, 'run_SS', run_SS)
+    monkeypatch.setattr(calibrate, 'calc_moments',
+                        lambda *args: list(np.ones(J + 2 + S)))
+
+    eval_store = calibrate.load_eval_log(None)
+    chi = np.arange(1.0, J + S + 1.0)
+    record, ss_output = calibrate.solve_moments(chi, params, eval_store,
+                                                data_moments, W)
+    assert len(solves) == 1
+    assert ss_output is not None
+    assert record['distance'] == J + 2 + S
+
+    # the same chi is not solved again, and the distance is computed
+    # from the data moments passed in
+    record, ss_output = calibrate.solve_moments(list(chi), params,
+                                                eval_store, data_moments + 1,
+                                                W)
+    assert len(solves) == 1
+    assert ss_output is None
+    assert record['distance'] == 0.0
+    assert eval_store['evals'][calibrate.eval_key(chi)]['distance'] == J + 2 + S
@@ -0,0 +1,100 @@
+'''
+------------------------------------------------------------------------
+Tests of the SharedDirBackend queue and run_worker() in experiments.py,
+with a stand-in for run_node that writes a file instead of solving the
+model.
+------------------------------------------------------------------------
+'''
+
+import multiprocessing
+import os
+import time
+import experiments
+
+NODE = (2.0, 'baseline', 'SS')
+
+
+def stand_in_run(node, user_params):
+    '''
+    Stands in for run_node: waits user_params['wait'] seconds, then
+    writes a file named after the run to user_params['out'].
+    '''
+    time.sleep(user_params.get('wait', 0.0))
+    with open(os.path.join(user_params['out'], '%s_%s_%s' % node), "w") as f:
+        f.write('done')
+
+
+def start_worker(queue_dir):
+    proc = multiprocessing.Process(target=experiments.run_worker,
+                                   args=(queue_dir, 0.05, 1, 0.2))
+    proc.start()
+    return proc
+
+
+def wait_for(path, timeout=10.0):
+    start = time.time()
+    while not os.path.exists(path):
+        assert time.time() - start < timeout
+        time.sleep(0.02)
+
+
+def test_claim_and_completion(tmpdir, monkeypatch):
+    monkeypatch.setattr(experiments, 'run_node', stand_in_run)
+    queue_dir = str(tmpdir.join('queue'))
+    backend = experiments.SharedDirBackend(queue_dir)
+    task = backend.submit(NODE, {'out': str(tmpdir)})
+    assert backend.poll(task) is None
+    assert experiments.run_worker(queue_dir, poll_time=0.05,
+                                  max_tasks=1) == 1
+    assert backend.poll(task) == 'done'
+    assert os.path.exists(str(tmpdir.join('2.0_baseline_SS')))
+    assert os.listdir(os.path.join(queue_dir, 'pending')) == []
+    assert os.listdir(os.path.join(queue_dir, 'running')) == []
+
+
+def test_stale_claim_reclaimed(tmpdir):
+    queue_dir = str(tmpdir.join('queue'))
+    backend = experiments.SharedDirBackend(queue_dir, stale_time=0.2)
+    task = backend.submit(NODE, {'out': str(tmpdir)})
+    # claimed by a worker that died before its first heartbeat
+    os.rename(os.path.join(queue_dir, 'pending', task),
+              os.path.join(queue_dir, 'running', task))
+    assert backend.poll(task) is None
+    time.sleep(0.3)
+    assert backend.poll(task) == 'failed'
+    assert os.path.exists(os.path.join(queue_dir, 'failed', task))
+
+
+def test_live_worker_not_reclaimed(tmpdir, monkeypatch):
+    monkeypatch.setattr(experiments, 'run_node', stand_in_run)
+    queue_dir = str(tmpdir.join('queue'))
+    backend = experiments.SharedDirBackend(queue_dir, stale_time=0.5)
+    task = backend.submit(NODE, {'out': str(tmpdir), 'wait': 1.5})
+    worker = start_worker(queue_dir)
+    claimed = os.path.join(queue_dir, 'running', task)
+    wait_for(claimed)
+    # an old modification time (e.g. clock skew between machines) does
+    # not make a run with a live worker stale
+    os.utime(claimed, (0, 0))
+    result = None
+    while result is None:
+        result = backend.poll(task)
+        time.sleep(0.05)
+    worker.join()
+    assert result == 'done'
+
+
+def test_worker_stops_reclaimed_run(tmpdir, monkeypatch):
+    monkeypatch.setattr(experiments, 'run_node', stand_in_run)
+    queue_dir = str(tmpdir.join('queue'))
+    backend = experiments.SharedDirBackend(queue_dir)
+    task = backend.submit(NODE, {'out': str(tmpdir), 'wait': 5.0})
+    worker = start_worker(queue_dir)
+    claimed = os.path.join(queue_dir, 'running', task)
+    wait_for(claimed + '.alive')
+    # the scheduler takes the run to be lost
+    os.rename(claimed, os.path.join(queue_dir, 'failed', task))
+    worker.join(2.0)
+    assert not worker.is_alive()
+    assert not os.path.exists(str(tmpdir.join('2.0_baseline_SS')))
+    assert backend.poll(task) == 'failed'
@@ -0,0 +1,45 @@
+'''
+------------------------------------------------------------------------
+Tests of the inequality measures in inequal.py.
+------------------------------------------------------------------------
+'''
+
+import numpy as np
+from ogusa import inequal
+
+
+def test_var_log_excludes_nonpositive():
+    dist = np.array([[-1.0, 0.0, 1.0, 2.0], [4.0, 8.0, 0.0, 3.0]])
+    weights = np.array([[0.1, 0.2, 0.1, 0.1], [0.1, 0.2, 0.1, 0.1]])
+    pos = dist > 0
+    ln_dist = np.log(dist[pos] * 2.0)
+    mean = np.average(ln_dist, weights=weights[pos])
+    var = np.average((ln_dist - mean) ** 2, weights=weights[pos])
+    assert np.allclose(inequal.var_log(dist, weights, 2.0), var)
+    # changing the non-positive values does not change the result
+    dist[~pos] = -5.0
+    assert np.allclose(inequal.var_log(dist, weights, 2.0), var)
+
+
+def test_gini_and_top_1():
+    # 100 households with equal weights and wealth 1, ..., 100
+    dist = np.arange(1.0, 101.0).reshape(10, 10)
+    weights = np.ones((10, 10)) / 100.0
+    # the gini coefficient is the mean absolute difference over twice
+    # the mean
+    diffs = np.abs(dist.reshape(-1, 1) - dist.reshape(1, -1))
+    assert np.allclose(inequal.gini(dist, weights),
+                       diffs.mean() / (2.0 * dist.mean()))
+    # the top 1% share starts at the household nearest the 99th
+    # percentile
+    assert np.allclose(inequal.top_1(dist, weights), (99.0 + 100.0) / 5050.0)
+
+    equal = np.ones((10, 10))
+    assert np.allclose(inequal.gini(equal, weights), 0.0)
+
+    # a batch of distributions gives the same results as each one alone
+    batch = np.array([dist, equal, dist[::-1] ** 2])
+    assert np.allclose(inequal.gini(batch, weights),
+                       [inequal.gini(d, weights) for d in batch])
+    assert np.allclose(inequal.top_1(batch, weights),
+                       [inequal.top_1(d, weights) for d in batch])
@@ -0,0 +1,61 @@
+'''
+------------------------------------------------------------------------
+Tests of the static revenue scoring in scoring.py, using parameters as
+built by parameters.get_parameters().
+------------------------------------------------------------------------
+'''
+
+import numpy as np
+import pytest
+from ogusa import parameters, scoring
+
+
+@pytest.fixture(scope='module')
+def sim_params():
+    return parameters.get_parameters(baseline=True, reform=0, guid='',
+                                     user_modifiable=False)
+
+
+def make_solutions(sim_params):
+    '''
+    Builds a baseline SS and TPI solution with the shapes of the model
+    output.
+    '''
+    S, J, T = sim_params['S'], sim_params['J'], sim_params['T']
+    np.random.seed(0)
+    bssmat_s = np.random.uniform(0.1, 2.0, size=(S, J))
+    nssmat = np.random.uniform(0.2, 0.6, size=(S, J))
+    ss_solution = {'rss': 0.06, 'wss': 1.2, 'factor_ss': 1.5e5,
+                   'bssmat_s': bssmat_s, 'nssmat': nssmat}
+    tpi_solution = {'r': np.linspace(0.05, 0.06, T),
+                    'w': np.linspace(1.1, 1.2, T),
+                    'bmat_s': np.tile(bssmat_s, (T, 1, 1)),
+                    'n_mat': np.tile(nssmat, (T, 1, 1))}
+    return ss_solution, tpi_solution
+
+
+def test_static_score_compressed_params(sim_params):
+    # the default tax parameters are stored with one age and one year
+    assert sim_params['etr_params'].shape[:2] == (1, 1)
+    ss_solution, tpi_solution = make_solutions(sim_params)
+    policies = [{}, {'p_wealth': 0.01}, {'d_income': 0.3}]
+    table, incidence = scoring.static_score(policies, sim_params,
+                                            ss_solution, tpi_solution)
+    assert np.allclose(table['revenue_change'][0], 0.0)
+    assert np.allclose(incidence['path'][0], 0.0)
+    assert (table['revenue_change'][1:] > 0).all()
+
+
+def test_static_score_matches_full_params(sim_params):
+    ss_solution, tpi_solution = make_solutions(sim_params)
+    S, BW = sim_params['S'], sim_params['BW']
+    full_params = dict(sim_params)
+    full_params['etr_params'] = np.tile(sim_params['etr_params'],
+                                        (S, BW, 1))
+    policies = [{'p_wealth': 0.01}, {'d_income': 0.3}]
+    table, incidence = scoring.static_score(policies, sim_params,
+                                            ss_solution, tpi_solution)
+    table_full, incidence_full = scoring.static_score(
+        policies, full_params, ss_solution, tpi_solution)
+    assert np.allclose(table['revenue'], table_full['revenue'])
+    assert np.allclose(incidence['path_age'], incidence_full['path_age'])
@@ -0,0 +1,50 @@
+'''
+------------------------------------------------------------------------
+Tests of the SS sensitivities in sensitivity.py against finite
+differences of SS solves, starting from the saved baseline solution.
+------------------------------------------------------------------------
+'''
+
+import cPickle as pickle
+import os
+import numpy as np
+from ogusa import SS, sensitivity
+
+cur_path = os.path.split(os.path.abspath(__file__))[0]
+BASELINE_DIR = os.path.join(cur_path, '..', '..', 'OUTPUT_BASELINE',
+                            'sigma2.0')
+
+
+def test_derivative_matches_finite_difference():
+    with open(os.path.join(BASELINE_DIR, 'run_parameters.pkl'), "rb") as f:
+        sim_params = pickle.load(f)
+    income_tax_params, ss_params, iterative_params, chi_params = \
+        SS.create_steady_state_parameters(**sim_params)
+    baseline_solution = SS.load_SS_solution(BASELINE_DIR)
+    chi_params = (baseline_solution['chi_b'], baseline_solution['chi_n'])
+
+    def solve(p_wealth):
+        income_tax_params_k, ss_params_k = SS.set_scenario_params(
+            {'p_wealth': p_wealth}, income_tax_params, ss_params)
+        ss_output = SS.run_SS(income_tax_params_k, ss_params_k,
+                              [400, 1e-12], chi_params, False,
+                              fix_transfers=True,
+                              initial_guesses=baseline_solution,
+                              baseline_solution=baseline_solution)
+        return income_tax_params_k, ss_params_k, ss_output
+
+    p_wealth, step = 0.001, 1e-5
+    income_tax_params_k, ss_params_k, ss_output = solve(p_wealth)
+    table, solution_derivs = sensitivity.ss_sensitivities(
+        ['p_wealth'], income_tax_params_k, ss_params_k, chi_params,
+        ss_output, fix_transfers=True, outcomes=['K', 'r', 'revenue'])
+
+    up = solve(p_wealth + step)[2]
+    down = solve(p_wealth - step)[2]
+    for outcome, key in [('K', 'Kss'), ('r', 'rss'),
+                         ('revenue', 'net_tax_receipts')]:
+        diff = (up[key] - down[key]) / (2 * step)
+        assert np.allclose(table.loc[outcome, 'p_wealth'], diff, rtol=1e-3)
+    diff = (up['bssmat_splus1'] - down['bssmat_splus1']) / (2 * step)
+    assert np.allclose(solution_derivs['b'][0], diff,
+                       atol=1e-2 * np.absolute(diff).max())
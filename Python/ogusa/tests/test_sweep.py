@@ -0,0 +1,57 @@
+'''
+------------------------------------------------------------------------
+Tests of the scenario grid, solve order and policy parameters in
+sweep.py.
+------------------------------------------------------------------------
+'''
+
+import numpy as np
+import pytest
+from ogusa import SS, sweep
+
+
+def test_solve_order_is_nearest_neighbour():
+    scenarios = sweep.scenario_grid(h_wealth=[0.1, 0.3, 0.2],
+                                    p_wealth=[0.01, 0.03, 0.02])
+    assert len(scenarios) == 9
+    assert set((s['h_wealth'], s['p_wealth']) for s in scenarios) == \
+        set((h, p) for h in [0.1, 0.3, 0.2] for p in [0.01, 0.03, 0.02])
+
+    points = sweep.scenario_points(scenarios)
+    order = sweep.solve_order(points)
+    assert sorted(order) == range(len(scenarios))
+    # each scenario is the closest to the one before of those left
+    for i in xrange(1, len(order)):
+        dist = ((points[order[i:]] - points[order[i - 1]]) ** 2).sum(1)
+        assert np.isclose(dist[0], dist.min())
+
+    # along one axis the order goes through the values in turn
+    scenarios = sweep.scenario_grid(p_wealth=[0.0, 0.03, 0.01, 0.02])
+    assert sweep.solve_order(sweep.scenario_points(scenarios)) == \
+        [0, 2, 3, 1]
+
+
+def test_set_policy_matches_set_scenario_params():
+    S = 4
+    etr_params = np.ones((S, 1, 10))
+    income_tax_params = (True, etr_params, etr_params.copy(),
+                         etr_params.copy())
+    ss_params = range(28)
+    scenario = {'h_wealth': 0.2, 'p_wealth': 0.03, 'm_wealth': 1.5,
+                'd_income': 0.4}
+
+    itp_sweep, ssp_sweep = sweep.set_policy(scenario, income_tax_params,
+                                            ss_params)
+    itp_ss, ssp_ss = SS.set_scenario_params(scenario, income_tax_params,
+                                            ss_params)
+    assert ssp_sweep == ssp_ss
+    assert ssp_sweep[22:25] == [0.2, 0.03, 1.5]
+    for params_sweep, params_ss in zip(itp_sweep[1:], itp_ss[1:]):
+        assert np.array_equal(params_sweep, params_ss)
+        assert np.all(params_sweep[..., 3] == 0.4)
+    # the parameters passed in are not changed
+    assert ss_params == range(28)
+    assert np.all(etr_params == 1.0)
+
+    with pytest.raises(ValueError):
+        sweep.set_policy({'beta': 0.9}, income_tax_params, ss_params)
@@ -0,0 +1,101 @@
+'''
+------------------------------------------------------------------------
+Tests of the tax functions in tax.py.
+------------------------------------------------------------------------
+'''
+
+import numpy as np
+from ogusa import tax
+
+
+def etr_params_by_age(S, T):
+    '''
+    Builds ratio of polynomials ETR parameters with the [S,T,#tax
+    params] layout that vary by age but not by year.
+    '''
+    params = np.zeros((S, T, tax.N_FUNC_PARAMS))
+    params[..., 0] = 1e-10
+    params[..., 1] = 1e-5
+    params[..., 2] = 1.0
+    params[..., 3] = np.linspace(0.25, 0.4, S).reshape(S, 1)
+    return params
+
+
+def test_compressed_params_match_full():
+    S, T = 8, 5
+    full = etr_params_by_age(S, T)
+    compressed = tax.compress_tax_params(full)
+    assert compressed.shape == (S, 1, tax.N_FUNC_PARAMS)
+
+    np.random.seed(0)
+    r = 0.06
+    w = 1.2
+    b = np.random.uniform(0.1, 2.0, size=(S, T))
+    n = np.random.uniform(0.2, 0.6, size=(S, T))
+    e = np.random.uniform(0.5, 2.0, size=(S, T))
+    factor = 5e4
+    assert np.allclose(tax.tau_income(r, w, b, n, factor, (e, compressed)),
+                       tax.tau_income(r, w, b, n, factor, (e, full)))
+
+    s = np.arange(S)
+    t = np.arange(S) % T
+    assert np.array_equal(tax.get_tax_params(compressed, s, t),
+                          tax.get_tax_params(full, s, t))
+
+
+def test_tabulated_rates_match_functional_form():
+    # tabulate the ETRs of the functional form on a fine income grid
+    etr_params = etr_params_by_age(1, 1)[0, 0]
+    income = np.linspace(0.0, 4e5, 401)
+    ones = np.ones(income.shape)
+    rates = tax.tau_income(0.0, income, 0.0, ones, 1.0, (ones, etr_params))
+    table = tax.tabulated_tax_params(income, rates)
+
+    # between the grid points the spline is close to the functional
+    # form, and so are its analytical MTRs
+    I = np.array([1.25e4, 5.55e4, 1.2345e5, 3.105e5])
+    ones = np.ones(I.shape)
+    etr = tax.tau_income(0.0, I, 0.0, ones, 1.0, (ones, table))
+    assert np.allclose(etr, tax.tau_income(0.0, I, 0.0, ones, 1.0,
+                                           (ones, etr_params)),
+                       atol=1e-6)
+    mtr_params = (ones, table, table, True)
+    mtr = tax.MTR_labor(0.0, I, 0.0, ones, 1.0, mtr_params)
+    mtr_params = (ones, etr_params, etr_params, True)
+    assert np.allclose(mtr, tax.MTR_labor(0.0, I, 0.0, ones, 1.0,
+                                          mtr_params), atol=1e-5)
+
+
+def test_bracket_wealth_tax():
+    b = np.array([0.0, 0.3, 0.5, 1.0, 2.0, 3.5])
+
+    # a single bracket from zero is the functional form with m = 0
+    table = tax.wealth_tax_brackets([0.0], [0.01])
+    assert np.allclose(tax.tau_wealth(b[1:], (1.0, table, 0.0)),
+                       tax.tau_wealth(b[1:], (1.0, 0.01, 0.0)))
+
+    # the marginal rate of the functional form is the derivative of the
+    # tax owed
+    params = (0.3, 0.01, 1.5)
+    db = 1e-6
+    deriv = (tax.tau_wealth(b + db, params) * (b + db) -
+             tax.tau_wealth(b, params) * b) / db
+    assert np.allclose(tax.mtr_wealth(b, params), deriv, atol=1e-8)
+
+    # tax owed at sample points, computed by hand
+    table = tax.wealth_tax_brackets([0.5, 2.0], [0.01, 0.02])
+    T_W = np.array([0.0, 0.0, 0.0, 0.005, 0.015, 0.045])
+    mtr = np.array([0.0, 0.0, 0.01, 0.01, 0.02, 0.02])
+    assert np.allclose(tax.tau_wealth(b, (1.0, table, 1.0)) * b, T_W)
+    assert np.allclose(tax.mtr_wealth(b, (1.0, table, 1.0)), mtr)
+    b_off = b[1:] + 0.1
+    params = (1.0, table, 1.0)
+    assert np.allclose(tax.mtr_wealth(b_off, params),
+                       tax.tau_w_prime(b_off, params) * b_off +
+                       tax.tau_wealth(b_off, params))
+
+    # a smoothed schedule approaches the exact one away from the kinks
+    smoothed = tax.wealth_tax_brackets([0.5, 2.0], [0.01, 0.02],
+                                       smooth=1e-4)
+    assert np.allclose(tax.tau_wealth(b_off, (1.0, smoothed, 1.0)),
+                       tax.tau_wealth(b_off, params), atol=1e-6)
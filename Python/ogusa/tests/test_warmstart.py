@@ -0,0 +1,98 @@
+'''
+------------------------------------------------------------------------
+Tests of the interpolation weights, the overridden key parameters and
+the index lock in warmstart.py, with a library of made-up runs.
+------------------------------------------------------------------------
+'''
+
+import cPickle as pickle
+import os
+import time
+import numpy as np
+from ogusa import warmstart
+
+DIMS = {'S': 80, 'J': 7, 'T': 240}
+
+
+def make_params(**kwargs):
+    sim_params = dict(DIMS, sigma=2.0, h_wealth=0.3, p_wealth=0.025,
+                      m_wealth=2.0, etr_params=np.ones((80, 1, 10)),
+                      chi_b_guess=np.ones(7), chi_n_guess=np.ones(80))
+    sim_params.update(kwargs)
+    return sim_params
+
+
+def save_run(output_dir, sim_params, rss):
+    '''
+    Saves a run with parameters sim_params and an SS solution with
+    interest rate rss, and returns its directory.
+    '''
+    os.makedirs(os.path.join(output_dir, 'SS'))
+    with open(os.path.join(output_dir, 'run_parameters.pkl'), "wb") as f:
+        pickle.dump(sim_params, f)
+    solution = {'bssmat_splus1': rss * np.ones((80, 7)),
+                'nssmat': rss * np.ones((80, 7)), 'rss': rss,
+                'T_Hss': rss, 'factor_ss': rss}
+    with open(os.path.join(output_dir, warmstart.STAGE_FILES['SS']),
+              "wb") as f:
+        pickle.dump(solution, f)
+    return os.path.abspath(output_dir)
+
+
+def test_nearest_runs_weights():
+    library = {'runs': {}}
+    for name, sigma in [('a', 1.0), ('b', 2.0), ('c', 4.0)]:
+        library['runs'][name] = dict(
+            DIMS, stages=['SS'],
+            params=warmstart.param_vector(make_params(sigma=sigma)))
+    # a closer run with other dimensions is not used
+    library['runs']['d'] = dict(
+        DIMS, S=40, stages=['SS'],
+        params=warmstart.param_vector(make_params(sigma=1.3)))
+
+    def nearest(sigma):
+        params = warmstart.param_vector(make_params(sigma=sigma))
+        return warmstart.nearest_runs(library, params, 'SS', DIMS)
+
+    assert nearest(2.0) == [('b', 1.0)]
+    # weights are the inverse of the distances, normalized
+    neighbours = nearest(1.25)
+    assert [name for name, weight in neighbours] == ['a', 'b']
+    assert np.allclose([weight for name, weight in neighbours],
+                       [0.75, 0.25])
+    assert warmstart.nearest_runs(library, {}, 'TPI', DIMS) == []
+
+
+def test_warm_start_overrides(tmpdir):
+    library_dir = str(tmpdir.join('library'))
+    for p_wealth, rss in [(0.01, 0.05), (0.03, 0.07)]:
+        output_dir = save_run(str(tmpdir.join(str(p_wealth))),
+                              make_params(p_wealth=p_wealth), rss)
+        warmstart.add_run(library_dir, output_dir)
+
+    sim_params = make_params(p_wealth=0.01)
+    assert warmstart.warm_start(library_dir, sim_params)['rss'] == 0.05
+    guess = warmstart.warm_start(library_dir, sim_params,
+                                 overrides={'p_wealth': 0.03})
+    assert guess['rss'] == 0.07
+    assert np.all(guess['bssmat_splus1'] == 0.07)
+    # the parameters of the run are not changed
+    assert sim_params['p_wealth'] == 0.01
+
+
+def test_lock_library_takes_over_stale_lock(tmpdir, monkeypatch):
+    library_dir = str(tmpdir)
+    path = os.path.join(library_dir, warmstart.LOCK_FILE)
+    # left by a process that died holding it
+    open(path, "w").close()
+    stale_time = time.time() - warmstart.LOCK_STALE - 1.0
+    os.utime(path, (stale_time, stale_time))
+    assert warmstart.lock_library(library_dir) == path
+    assert time.time() - os.path.getmtime(path) < warmstart.LOCK_STALE
+
+    # a lock that is held is waited for until it is stale
+    monkeypatch.setattr(warmstart, 'LOCK_STALE', 0.3)
+    start = time.time()
+    assert warmstart.lock_library(library_dir, poll_time=0.02) == path
+    assert time.time() - start > 0.3
+    os.remove(path)
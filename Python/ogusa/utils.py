@@ -116,6 +116,24 @@ def read_file(path, fname):
         return open(os.path.join(path, fname))
 
 
+def read_start_values(path):
+    '''
+    Reads the default starting values of a solver from a saved solution.
+    The file is read on each call, rather than once at import, so that
+    importing the solvers does not depend on the working directory and
+    concurrent solves never share (and change) the same arrays.
+
+    Inputs:
+        path = string, path of the pickled SS or TPI results
+
+    Functions called: None
+
+    Returns: dictionary, a fresh copy of the saved results
+    '''
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
 def pickle_file_compare(fname1, fname2, tol=1e-3, exceptions={}, relative=False):
     '''
     Read two pickle files and unpickle each. We assume that each resulting
@@ -0,0 +1,374 @@
+'''
+------------------------------------------------------------------------
+Library of SS and TPI solutions used to start new runs.
+
+Each completed run is indexed by a vector of its key parameters (sigma,
+the Frisch elasticity, the wealth tax parameters, the d parameter of
+the income tax functions and the scale of the chi parameters).  A
+bracketed wealth tax is indexed by its top rate and exemption
+threshold.  A new
+run starts from a weighted average of the solutions of the runs
+closest to it in these parameters (each parameter scaled by its range
+over the library), rather than from one fixed set of starting values.
+
+The index is a JSON file in the library directory; the solutions stay
+in the output directories of the runs.  Runs are added to the index
+under a lock file, so runs finishing at the same time do not drop each
+other's entries.
+
+This py-file calls the following other file(s):
+            tax.py
+            output_dir/run_parameters.pkl
+            output_dir/SS/SS_vars.pkl
+            output_dir/TPI/TPI_vars.pkl
+
+This py-file creates the following other file(s):
+            library_dir/warm_start_library.json
+            library_dir/warm_start_library.lock (while the index is
+                being updated)
+------------------------------------------------------------------------
+'''
+
+# Packages
+import cPickle as pickle
+import errno
+import json
+import os
+import time
+import numpy as np
+import tax
+
+'''
+------------------------------------------------------------------------
+LIBRARY_FILE   = string, name of the index file in the library directory
+LOCK_FILE      = string, name of the lock file of the index
+LOCK_STALE     = scalar, seconds after which a lock is taken to have been
+                 left by a process that died holding it
+KEY_PARAMS     = list, parameters runs are indexed by
+STAGE_FILES    = dictionary, solution file of each stage of a run
+SS_GUESS_KEYS  = list, SS results interpolated for a starting guess
+TPI_GUESS_KEYS = list, TPI results interpolated for a starting guess
+------------------------------------------------------------------------
+'''
+LIBRARY_FILE = "warm_start_library.json"
+LOCK_FILE = "warm_start_library.lock"
+LOCK_STALE = 60.0
+KEY_PARAMS = ['sigma', 'frisch', 'h_wealth', 'p_wealth', 'm_wealth',
+              'wealth_threshold', 'd_income', 'chi_b_scale', 'chi_n_scale']
+STAGE_FILES = {'SS': os.path.join('SS', 'SS_vars.pkl'),
+               'TPI': os.path.join('TPI', 'TPI_vars.pkl')}
+SS_GUESS_KEYS = ['bssmat_splus1', 'nssmat', 'rss', 'T_Hss', 'factor_ss']
+TPI_GUESS_KEYS = ['r', 'K', 'L', 'Y', 'T_H', 'BQ', 'G', 'b_mat', 'n_mat']
+
+'''
+------------------------------------------------------------------------
+    Functions
+------------------------------------------------------------------------
+'''
+
+
+def wealth_params(h_wealth, p_wealth, m_wealth):
+    '''
+    Returns the wealth tax key parameters.  A bracket table (from
+    tax.wealth_tax_brackets()) in place of p_wealth is indexed by its
+    top marginal rate, as p_wealth, and its exemption threshold; h_wealth
+    and m_wealth, which it does not use, are NaN.
+
+    Inputs:
+        h_wealth = scalar, wealth tax parameter h
+        p_wealth = scalar, wealth tax parameter p, or [K,4] array, bracket
+                   table
+        m_wealth = scalar, wealth tax parameter m
+
+    Functions called: None
+
+    Returns: dictionary, h_wealth, p_wealth, m_wealth and
+             wealth_threshold (NaN for the scalar tax)
+    '''
+    p_wealth = np.asarray(p_wealth, dtype=float)
+    if p_wealth.ndim == 2:
+        return {'h_wealth': np.nan, 'p_wealth': float(p_wealth[-1, 1]),
+                'm_wealth': np.nan, 'wealth_threshold': float(p_wealth[0, 0])}
+    return {'h_wealth': float(h_wealth), 'p_wealth': float(p_wealth),
+            'm_wealth': float(m_wealth), 'wealth_threshold': np.nan}
+
+
+def param_vector(sim_params):
+    '''
+    Returns the key parameters of a run.
+
+    Inputs:
+        sim_params = dictionary, parameters of the run as saved in
+                     run_parameters.pkl (with the user parameters in
+                     sim_params['run_params'])
+
+    Functions called:
+        wealth_params
+
+    Objects in function:
+        etr_params = [S,BW,#tax params] array, effective tax rate function
+                     parameters, d is taken from the last year of the
+                     budget window (the SS year)
+
+    Returns: dictionary, key parameters (NaN if not known)
+    '''
+    run_params = sim_params.get('run_params', {})
+    etr_params = np.asarray(sim_params['etr_params'])
+    if etr_params.shape[-1] == tax.N_FUNC_PARAMS:
+        d_income = float(etr_params[:, -1, 3].mean())
+    else:
+        d_income = np.nan
+    params = wealth_params(sim_params['h_wealth'], sim_params['p_wealth'],
+                           sim_params['m_wealth'])
+    params.update({'sigma': float(sim_params['sigma']),
+                   'frisch': float(run_params.get('frisch', np.nan)),
+                   'd_income': d_income,
+                   'chi_b_scale': float(np.log(sim_params['chi_b_guess']).mean()),
+                   'chi_n_scale': float(np.log(sim_params['chi_n_guess']).mean())})
+    return params
+
+
+def load_library(library_dir):
+    '''
+    Returns the index of the library in library_dir, or an empty index.
+    '''
+    path = os.path.join(library_dir, LIBRARY_FILE)
+    if not os.path.exists(path):
+        return {'runs': {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_library(library, library_dir):
+    '''
+    Saves the index of the library, writing a temporary file and then
+    renaming it so the index is never left half written.
+    '''
+    if not os.path.isdir(library_dir):
+        os.makedirs(library_dir)
+    path = os.path.join(library_dir, LIBRARY_FILE)
+    with open(path + '.tmp', "w") as f:
+        json.dump(library, f, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def lock_library(library_dir, poll_time=0.05):
+    '''
+    Waits for and takes the lock on the index of the library, by
+    creating the lock file (which fails if it exists).  A lock older
+    than LOCK_STALE seconds is removed.  Returns the path of the lock
+    file, to remove to release the lock.
+    '''
+    path = os.path.join(library_dir, LOCK_FILE)
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return path
+        except OSError as oe:
+            if oe.errno != errno.EEXIST:
+                raise
+        try:
+            if time.time() - os.path.getmtime(path) > LOCK_STALE:
+                os.remove(path)
+                continue
+        except OSError:
+            # released meanwhile
+            continue
+        time.sleep(poll_time)
+
+
+def add_run(library_dir, output_dir):
+    '''
+    Adds the solutions saved in output_dir to the library.  A run that
+    is already in the library is indexed again (e.g. after its TPI is
+    solved).
+
+    Inputs:
+        library_dir = string, directory of the library
+        output_dir  = string, directory of the run, with
+                      run_parameters.pkl and SS (and TPI) results
+
+    Functions called:
+        param_vector
+        lock_library
+        load_library
+        save_library
+
+    Objects in function:
+        entry = dictionary, key parameters, dimensions and stages solved
+                of the run
+
+    Returns: None
+    '''
+    param_path = os.path.join(output_dir, "run_parameters.pkl")
+    if not os.path.exists(param_path):
+        return
+    with open(param_path, "rb") as f:
+        sim_params = pickle.load(f)
+    stages = [stage for stage in sorted(STAGE_FILES)
+              if os.path.exists(os.path.join(output_dir,
+                                             STAGE_FILES[stage]))]
+    if len(stages) == 0:
+        return
+    entry = {'params': param_vector(sim_params),
+             'S': int(sim_params['S']), 'J': int(sim_params['J']),
+             'T': int(sim_params['T']), 'stages': stages}
+    try:
+        os.makedirs(library_dir)
+    except OSError:
+        pass
+    lock = lock_library(library_dir)
+    try:
+        library = load_library(library_dir)
+        library['runs'][os.path.abspath(output_dir)] = entry
+        save_library(library, library_dir)
+    finally:
+        os.remove(lock)
+
+
+def scan(library_dir, roots):
+    '''
+    Adds every run saved under the directories in roots (a directory
+    with run_parameters.pkl and SS/SS_vars.pkl) to the library.
+
+    Inputs:
+        library_dir = string, directory of the library
+        roots       = list, directories to search
+
+    Functions called:
+        add_run
+
+    Returns: None
+    '''
+    for root in roots:
+        for path, dirnames, filenames in os.walk(root):
+            if ('run_parameters.pkl' in filenames and
+                    os.path.exists(os.path.join(path, STAGE_FILES['SS']))):
+                add_run(library_dir, path)
+
+
+def nearest_runs(library, params, stage, dims, num_neighbours=2):
+    '''
+    Returns the runs of the library closest to params that have solved
+    stage and have the same dimensions, with the weights used to
+    interpolate between them.
+
+    Inputs:
+        library        = dictionary, index from load_library()
+        params         = dictionary, key parameters of the new run
+        stage          = string, 'SS' or 'TPI'
+        dims           = dictionary, S, J and T of the new run
+        num_neighbours = integer, number of runs to interpolate between
+
+    Functions called: None
+
+    Objects in function:
+        points  = [N,P] array, key parameters of the runs
+        point   = [P,] vector, key parameters of the new run
+        scale   = [P,] vector, range of each parameter over the runs and
+                  the new run
+        dist    = [N,] vector, scaled distance of each run to the new run
+        weights = [num_neighbours,] vector, inverse distance weights
+
+    Returns: list of (output_dir, weight) tuples, empty if there are no
+             runs to start from
+    '''
+    runs = [(output_dir, entry) for output_dir, entry in
+            sorted(library['runs'].items())
+            if stage in entry['stages'] and
+            all(entry[key] == dims[key] for key in dims)]
+    if len(runs) == 0:
+        return []
+    points = np.array([[entry['params'].get(name, np.nan)
+                        for name in KEY_PARAMS] for output_dir, entry in runs],
+                      dtype=float)
+    point = np.array([params.get(name, np.nan) for name in KEY_PARAMS],
+                     dtype=float)
+    both = np.append(points, point.reshape(1, -1), axis=0)
+    scale = np.nanmax(both, axis=0) - np.nanmin(both, axis=0)
+    scale[~(scale > 0)] = 1.0
+    diff = (points - point) / scale
+    # a parameter known for one of the two runs only counts as far apart
+    diff[np.isnan(points) != np.isnan(point)] = 1.0
+    diff[np.isnan(diff)] = 0.0
+    dist = np.sqrt((diff ** 2).sum(axis=1))
+
+    order = np.argsort(dist, kind='mergesort')[:num_neighbours]
+    if dist[order[0]] == 0:
+        # exact match
+        return [(runs[order[0]][0], 1.0)]
+    weights = 1.0 / dist[order]
+    weights /= weights.sum()
+    return [(runs[i][0], float(weight)) for i, weight in zip(order, weights)]
+
+
+def interpolate(solutions, weights, keys):
+    '''
+    Returns the weighted average of the results in keys of several
+    solutions.
+    '''
+    guess = {}
+    for key in keys:
+        guess[key] = sum(weight * np.asarray(solution[key], dtype=float)
+                         for solution, weight in zip(solutions, weights))
+        if np.ndim(guess[key]) == 0:
+            guess[key] = float(guess[key])
+    return guess
+
+
+def warm_start(library_dir, sim_params, stage='SS', num_neighbours=2,
+               overrides=None):
+    '''
+    Returns a starting guess for a run from the solutions in the library
+    closest to it.
+
+    Inputs:
+        library_dir    = string, directory of the library
+        sim_params     = dictionary, parameters of the new run (as saved
+                         in run_parameters.pkl)
+        stage          = string, 'SS' or 'TPI'
+        num_neighbours = integer, number of solutions to interpolate
+                         between
+        overrides      = dictionary, key parameters of the new run that
+                         differ from sim_params (e.g. the wealth tax
+                         parameters of a policy solved against the
+                         baseline parameters)
+
+    Functions called:
+        load_library
+        param_vector
+        wealth_params
+        nearest_runs
+        interpolate
+
+    Returns: dictionary, SS results (SS_GUESS_KEYS) or TPI results
+             (TPI_GUESS_KEYS) to pass as initial_guesses, or None if the
+             library has no solution to start from
+    '''
+    library = load_library(library_dir)
+    dims = dict((key, int(sim_params[key])) for key in ('S', 'J', 'T'))
+    params = param_vector(sim_params)
+    if overrides is not None:
+        wealth = dict((name, overrides.get(name, sim_params[name]))
+                      for name in ('h_wealth', 'p_wealth', 'm_wealth'))
+        params.update((name, value) for name, value in overrides.items()
+                      if name not in wealth)
+        params.update(wealth_params(**wealth))
+    neighbours = nearest_runs(library, params, stage, dims, num_neighbours)
+    solutions = []
+    weights = []
+    for output_dir, weight in neighbours:
+        path = os.path.join(output_dir, STAGE_FILES[stage])
+        if not os.path.exists(path):
+            # the run was removed since it was indexed
+            continue
+        with open(path, "rb") as f:
+            solutions.append(pickle.load(f))
+        weights.append(weight)
+    if len(solutions) == 0:
+        return None
+    weights = np.array(weights) / np.sum(weights)
+    print 'Starting ', stage, ' from ', [output_dir for output_dir, weight
+                                         in neighbours]
+    keys = SS_GUESS_KEYS if stage == 'SS' else TPI_GUESS_KEYS
+    return interpolate(solutions, weights, keys)
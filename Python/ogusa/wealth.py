@@ -7,6 +7,8 @@ Returns the wealth for all ages of a certain percentile.
 This py-file calls the following other file(s):
             data/wealth/scf2007to2013_wealth_age_all_percentiles.csv
             utils.py
+            bootstrap.py
+            inequal.py
 
 This py-file creates the following other file(s):
     (make sure that an OUTPUT folder exists)
@@ -25,6 +27,8 @@ This py-file creates the following other file(s):
 import numpy as np
 import pandas as pd
 import utils
+import bootstrap
+import inequal
 import os
 from scipy import stats
 import cPickle as pickle
@@ -97,7 +101,8 @@ def wealth_data_graphs(data, output_dir):
         outputdir, '/Demographics/distribution_of_wealth_data_log'))
 
 
-def VCV_moments(scf, n, bin_weights, J):
+def VCV_moments(scf, n, bin_weights, J, seed=0, method='poisson',
+                num_workers=1):
     '''
     ------------------------------------------------------------------------
         Compute Variance-Covariance matrix for wealth moments by
@@ -108,25 +113,95 @@ def VCV_moments(scf, n, bin_weights, J):
             n           = interger, number of bootstrap iterations to run
             bin_weights = ability weights (Jx1 array)
             J           = number of ability groups (scalar)
+            seed        = integer, seed for the bootstrap
+            method      = string, 'poisson' or 'multinomial' bootstrap
+                          weights
+            num_workers = integer, number of processes
         Objects created in the function:
-            wealth_moments_boot = [n,S] array, bootstrapped wealth moments
-            boot = pandas DF, boostrapped dataframe
+            boot_data = tuple, SCF data sorted by net worth
+            wealth_moments_boot = [n,J+2] array, bootstrapped wealth moments
             VCV  = [J+2,J+2] array, variance-covariance matrix of wealth moments
         Output:
             VCV
 
     ------------------------------------------------------------------------
     '''
-    wealth_moments_boot = np.zeros((n,J+2))
-    for i in range(n):
-        boot = scf[np.random.randint(2, size=len(scf.index)).astype(bool)]
-        wealth_moments_boot[i,:] = compute_wealth_moments(boot, bin_weights, J)
+    # sort once, the order is the same in every replicate
+    scf_sorted = scf.sort_values(by='networth', ascending=True)
+    networth = scf_sorted['networth'].values.astype(float)
+    wgt = scf_sorted['wgt'].values.astype(float)
+    boot_data = (networth, wgt, bin_weights.cumsum())
+    wealth_moments_boot = bootstrap.boot_moments(
+        boot_wealth_moments, boot_data, len(networth), n, seed, method,
+        num_workers=num_workers)
 
     VCV = np.cov(wealth_moments_boot.T)
 
     return VCV
 
 
+def boot_wealth_moments(mult, data):
+    '''
+    ------------------------------------------------------------------------
+    Computes the wealth moments in compute_wealth_moments() for a block
+    of bootstrap replicates at once.
+
+    Inputs:
+        mult     = [B,N] array, multiplicity of each observation in each
+                   replicate
+        data     = length 3 tuple, (networth, wgt, cum_bins)
+        networth = [N,] vector, net worth sorted in ascending order
+        wgt      = [N,] vector, sampling weights
+        cum_bins = [J,] vector, cumulative ability weights
+    Objects created in the function:
+        wd = dictionary, indexed wealth distribution of each replicate
+
+    Returns:
+        [B,J+2] array of wealth moments
+    ------------------------------------------------------------------------
+    '''
+    networth, wgt, cum_bins = data
+
+    wd = inequal.weighted_dist(networth, mult * wgt, presorted=True)
+
+    return wealth_moments_from_dist(wd, cum_bins)
+
+
+def wealth_moments_from_dist(wd, cum_bins):
+    '''
+    ------------------------------------------------------------------------
+    Computes the wealth moments from an indexed wealth distribution.
+
+    Inputs:
+        wd       = dictionary, wealth distribution from
+                   inequal.weighted_dist()
+        cum_bins = [J,] vector, cumulative ability weights
+    Objects created in the function:
+        wealth        = [...,J] array, share of wealth held below each
+                        cutoff
+        wealth_share  = [...,J] array, share of wealth held by each
+                        percentile group
+        gini_coeff    = [...] array, gini coefficient
+        var_ln_wealth = [...] array, variance of log of positive wealth
+
+    Returns:
+        [...,J+2] array of wealth moments
+    ------------------------------------------------------------------------
+    '''
+    # calculate percentile shares (percentiles based on lambdas input)
+    wealth = inequal.dist_share_below(wd, inequal.dist_index(wd, cum_bins))
+    wealth_share = np.diff(np.concatenate(
+        (np.zeros(wealth.shape[:-1] + (1,)), wealth), axis=-1), axis=-1)
+
+    # compute gini coeff
+    gini_coeff = inequal.dist_gini(wd)
+
+    # compute variance in logs
+    var_ln_wealth = inequal.dist_var_log(wd, ddof=1)
+
+    return np.concatenate((wealth_share, gini_coeff[..., np.newaxis],
+                           var_ln_wealth[..., np.newaxis]), axis=-1)
+
 
 '''
 ------------------------------------------------------------------------
@@ -140,64 +215,14 @@ def compute_wealth_moments(scf, bin_weights, J):
         scf         = pandas DF, raw data from SCF
         bin_weights = ability weights (Jx1 array)
         J = number of ability groups (scalar)
-        flag_graphs = whether or not to graph distribution (bool)
     Objects created in the function:
+        wd = dictionary, indexed wealth distribution
 
     Returns:
         [J+2,] array of wealth moments
     ------------------------------------------------------------------------
     '''
-
-
-    # calculate percentile shares (percentiles based on lambdas input)
-    scf.sort_values(by='networth', ascending=True, inplace=True)
-    scf['weight_networth'] = scf['wgt']*scf['networth']
-    total_weight_wealth = scf.weight_networth.sum()
-    cumsum = scf.wgt.cumsum()
-    pct_wealth = np.zeros((bin_weights.shape[0],))
-    top_pct_wealth = np.zeros((bin_weights.shape[0],))
-    wealth = np.zeros((bin_weights.shape[0],))
-    cum_weights = bin_weights.cumsum()
-    for i in range(bin_weights.shape[0]):
-        cutoff = scf.wgt.sum() / (1./cum_weights[i])
-        pct_wealth[i] = scf.networth[cumsum >= cutoff].iloc[0]
-        top_pct_wealth[i] = 1 - ((scf.weight_networth[cumsum < cutoff].sum())/total_weight_wealth)
-        wealth[i] = ((scf.weight_networth[cumsum < cutoff].sum())/total_weight_wealth)
-
-
-    wealth_share = np.zeros((bin_weights.shape[0],))
-    wealth_share[0] = wealth[0]
-    wealth_share[1:] = wealth[1:]-wealth[0:-1]
-
-    # compute 90/10 ratio, top 10% share, top 1% share
-    cutoff = scf.wgt.sum() / (1./.1)
-    pct_10 = scf.networth[cumsum >= cutoff].iloc[0]
-    cutoff = scf.wgt.sum() / (1./.9)
-    pct_90 = scf.networth[cumsum >= cutoff].iloc[0]
-    top_10_share = 1 - ((scf.weight_networth[cumsum < cutoff].sum())/total_weight_wealth)
-    ratio_90_10 = pct_90/pct_10
-    cutoff = scf.wgt.sum() / (1./.99)
-    pct_99 = scf.networth[cumsum >= cutoff].iloc[0]
-    top_1_share = 1 - ((scf.weight_networth[cumsum < cutoff].sum())/total_weight_wealth)
-
-
-    # compute gini coeff
-    scf.sort_values(by='networth', ascending=True, inplace=True)
-    p = (scf.wgt.cumsum()/scf.wgt.sum()).as_matrix()
-    nu = ((scf.wgt*scf.networth).cumsum()).as_matrix()
-    nu = nu/nu[-1]
-    gini_coeff = (nu[1:]*p[:-1]).sum() - (nu[:-1] * p[1:]).sum()
-
-
-    # compute variance in logs
-    df = scf.drop(scf[scf['networth'] <=0.0].index)
-    df['ln_networth'] = np.log(df['networth'])
-    df.sort_values(by='ln_networth', ascending=True, inplace=True)
-    weight_mean = ((df.ln_networth*df.wgt).sum())/(df.wgt.sum())
-    var_ln_wealth = ((df.wgt*((df.ln_networth-weight_mean)**2)).sum())*(1./(df.wgt.sum()-1))
-
-
-    wealth_moments = np.append([wealth_share], [gini_coeff,var_ln_wealth])
-
+    wd = inequal.weighted_dist(scf['networth'].values, scf['wgt'].values)
+    wealth_moments = wealth_moments_from_dist(wd, bin_weights.cumsum())
 
     return wealth_moments
@@ -1,4 +1,5 @@
 import ogusa
+import numpy as np
 import os
 import sys
 from multiprocessing import Process
@@ -7,9 +8,10 @@ import time
 #import postprocess
 #from execute import runner # change here for small jobs
 from execute import runner, runner_SS
+import experiments
 
 
-def run_micro_macro(user_params):
+def run_micro_macro(user_params, num_workers=None, continuation=False):
 
     start_time = time.time()
 
@@ -44,80 +46,163 @@ def run_micro_macro(user_params):
 
     sigma_list = [2.0, 1.1, 1.0, 2.0, 2.1, 3.1, 3.2]
 
-    '''
-    Loop over value of sigma and run all baselines and reforms
-    '''
-    for item in sigma_list:
-        print 'item= ', item
-        # parameters that may update at each iteration
-        user_params = {'frisch': 1.5, 'sigma': item}
-
-        # set up directories to save output to
-        baseline_dir = "./OUTPUT_BASELINE" + '/sigma' + str(item)
-        wealth_dir = "./OUTPUT_WEALTH_REFORM" + '/sigma' + str(item)
-        income_dir = "./OUTPUT_INCOME_REFORM" + '/sigma' + str(item)
-
-
-        '''
-        ------------------------------------------------------------------------
-            Run SS for Baseline first
-        ------------------------------------------------------------------------
+    if continuation:
         '''
-        # output_base = baseline_dir
-        # input_dir = baseline_dir
-        # kwargs={'output_base':output_base, 'baseline_dir':baseline_dir,
-        #         'baseline':True, 'reform':0, 'fix_transfers':False, 'user_params':user_params,
-        #         'guid':'baseline_sigma_'+str(item),'calibrate_model':False}
-        # runner_SS(**kwargs)
-
-
-        '''
-        ------------------------------------------------------------------------
-            Run baseline TPI
-        ------------------------------------------------------------------------
+        Solve for each value of sigma by continuation: each solution is
+        the starting guess for the next value of sigma, and the step is
+        halved when a solve fails.
         '''
-        # output_base = baseline_dir
-        # input_dir = baseline_dir
-        # kwargs={'output_base':output_base, 'baseline_dir':baseline_dir,
-        #         'baseline':True,'reform':0,'fix_transfers':False, 'user_params':user_params,
-        #         'guid':'baseline_sigma_'+str(item),'calibrate_model':False}
-        # runner(**kwargs)
-        # quit()
-
-
+        solve_sigma_continuation(
+            sigma_list,
+            lambda sigma, guesses: run_sigma(sigma, guesses, user_params))
+    else:
         '''
-        ------------------------------------------------------------------------
-            Run wealth tax reform (needs to be run before income tax reform
-            because it determines the SS revenue target)
-        ------------------------------------------------------------------------
+        Run the baselines and reforms for all values of sigma as a graph
+        of dependent runs, independent runs at the same time, skipping
+        runs that are up to date.
         '''
-        output_base = wealth_dir
-        input_dir = wealth_dir
-        guid_iter = 'reform_' + str(0)
-        kwargs={'output_base':output_base, 'baseline_dir':baseline_dir,
-                'baseline':False, 'reform':2, 'fix_transfers':True, 'user_params':user_params,
-                'guid':'wealth_tax_reform2','calibrate_model':False}
-        runner(**kwargs)
-        quit()
+        status = experiments.run_grid(experiments.build_grid(sigma_list),
+                                      num_workers=num_workers,
+                                      user_params=user_params)
+        for node in sorted(status.keys()):
+            print node, ': ', status[node]
 
-        '''
-        ------------------------------------------------------------------------
-            Run income tax reform
-        ------------------------------------------------------------------------
-        '''
-        # output_base = income_dir
-        # input_dir = income_dir
-        # guid_iter = 'reform_' + str(0)
-        # kwargs={'output_base':output_base, 'baseline_dir':baseline_dir,
-        #         'baseline':False, 'reform':1, 'fix_transfers':True, 'user_params':user_params,
-        #         'guid':'wealth_tax_reform1','calibrate_model':False}
-        # runner(**kwargs)
-        # quit()
+    # run post process script to create tables/figures for paper
+    #postprocess('directories')
 
 
+def sigma_path(sigma_list, sigma_start=2.0, decimals=8):
+    '''
+    Orders the values of sigma for continuation.  Duplicates are
+    dropped, the path starts at the value closest to sigma_start and
+    goes up through the larger values and then down through the smaller
+    ones (each branch starting again from the first solution).
+
+    Inputs:
+        sigma_list  = list, values of sigma to solve for
+        sigma_start = scalar, value of sigma to start from
+        decimals    = integer, values of sigma equal to this many decimals
+                      are duplicates
+
+    Returns: list of (sigma, sigma to start from) tuples, the sigma to
+             start from is None for the first value
+    '''
+    sigmas = sorted(set(round(item, decimals) for item in sigma_list))
+    if len(sigmas) == 0:
+        return []
+    first = min(sigmas, key=lambda x: abs(x - sigma_start))
+    up = [item for item in sigmas if item > first]
+    down = [item for item in reversed(sigmas) if item < first]
+    path = [(first, None)]
+    for branch in (up, down):
+        prev = first
+        for item in branch:
+            path.append((item, prev))
+            prev = item
+    return path
+
+
+def solve_sigma_continuation(sigma_list, solve_func, sigma_start=2.0,
+                             max_halvings=4):
+    '''
+    Solves the model for each value of sigma, starting each solve from
+    the solution at the previous value of sigma on the path.  If a solve
+    fails, the solution is first found at the midpoint of the step,
+    halving the step up to max_halvings times.
+
+    Inputs:
+        sigma_list   = list, values of sigma to solve for
+        solve_func   = function, takes sigma and the solution to start
+                       from (None for the default starting values) and
+                       returns the solution, raises RuntimeError if the
+                       solve fails
+        sigma_start  = scalar, value of sigma to start from
+        max_halvings = integer, maximum number of times a step is halved
+
+    Returns: dictionary, solutions keyed by sigma (including the
+             intermediate values of sigma)
+    '''
+    solutions = {}
+
+    def step(sigma, sigma_from, depth):
+        if sigma in solutions:
+            return
+        guesses = None if sigma_from is None else solutions[sigma_from]
+        try:
+            solutions[sigma] = solve_func(sigma, guesses)
+            return
+        except RuntimeError as err:
+            if sigma_from is None or depth >= max_halvings:
+                raise
+            print 'Solve failed at sigma = ', sigma, ': ', err
+        sigma_mid = round(0.5 * (sigma + sigma_from), 8)
+        print 'Solving at intermediate sigma = ', sigma_mid
+        step(sigma_mid, sigma_from, depth + 1)
+        step(sigma, sigma_mid, depth + 1)
+
+    for sigma, sigma_from in sigma_path(sigma_list, sigma_start):
+        print 'sigma = ', sigma
+        step(sigma, sigma_from, 0)
+
+    return solutions
+
+
+def run_sigma(sigma, guesses=None, user_params={}):
+    '''
+    Runs the baseline and both reforms at one value of sigma.
+
+    Inputs:
+        sigma       = scalar, coefficient of relative risk aversion
+        guesses     = dictionary, solutions at a nearby value of sigma
+                      keyed by 'baseline', 'wealth' and 'income', each an
+                      (SS, TPI) tuple, or None
+        user_params = dictionary, parameters other than sigma passed to
+                      the runner (e.g. frisch, default 1.5)
+
+    Returns: dictionary, (SS, TPI) solutions keyed by 'baseline',
+             'wealth' and 'income'
+    '''
+    # parameters that may update at each iteration
+    params = {'frisch': 1.5}
+    params.update(user_params)
+    params['sigma'] = sigma
+
+    # set up directories to save output to
+    baseline_dir = "./OUTPUT_BASELINE" + '/sigma' + str(sigma)
+    wealth_dir = "./OUTPUT_WEALTH_REFORM" + '/sigma' + str(sigma)
+    income_dir = "./OUTPUT_INCOME_REFORM" + '/sigma' + str(sigma)
+
+    # baseline first, then the wealth tax reform (which determines the
+    # SS revenue target for the income tax reform), then the income tax
+    # reform
+    runs = [('baseline', {'output_base': baseline_dir, 'baseline': True,
+                          'reform': 0, 'fix_transfers': False,
+                          'guid': 'baseline_sigma_' + str(sigma)}),
+            ('wealth', {'output_base': wealth_dir, 'baseline': False,
+                        'reform': 2, 'fix_transfers': True,
+                        'guid': 'wealth_tax_reform2'}),
+            ('income', {'output_base': income_dir, 'baseline': False,
+                        'reform': 1, 'fix_transfers': True,
+                        'guid': 'wealth_tax_reform1'})]
+
+    solutions = {}
+    for name, kwargs in runs:
+        ss_guesses, tpi_guesses = (None, None) if guesses is None \
+            else guesses[name]
+        kwargs.update({'baseline_dir': baseline_dir,
+                       'user_params': params, 'calibrate_model': False,
+                       'ss_guesses': ss_guesses, 'tpi_guesses': tpi_guesses})
+        ss_output, tpi_output = runner(**kwargs)
+        if ss_output['ss_flag'] != 0:
+            raise RuntimeError("Steady state not found for " + name +
+                               " at sigma = " + str(sigma))
+        if not np.all(np.isfinite(tpi_output['K'])):
+            raise RuntimeError("Transition path not found for " + name +
+                               " at sigma = " + str(sigma))
+        solutions[name] = (ss_output, tpi_output)
+
+    return solutions
 
-    # run post process script to create tables/figures for paper
-    #postprocess('directories')
 
 if __name__ == "__main__":
     run_micro_macro(user_params={})
@@ -0,0 +1,610 @@
+'''
+------------------------------------------------------------------------
+Local model server: a long running process that solves wealth tax (and
+income tax) policies against a baseline, so that a what-if question
+does not pay for starting Python, importing the model, setting up the
+parameters (demographics, ability profiles, the elliptical utility
+estimation) and loading the baseline again each time.
+
+Jobs are posted as JSON to a small HTTP interface on a local port and
+kept in a SQLite job queue in server_dir, so queued jobs survive a
+restart of the server.  One worker thread runs the jobs in order.  It
+keeps the setup of each baseline (the parameters and baseline solution,
+keyed by baseline_dir and user parameters) in memory, and every SS
+solution it finds, so a new policy starts from the closest policy
+already solved (or, with library_dir, from the warm start library).
+
+Jobs (the body of POST /jobs):
+    {"kind": "sweep", "baseline_dir": ..., "scenarios": [...],
+     "user_params": {...}, "fix_transfers": true, "batch_size": null}
+        solves the SS of each scenario (dictionaries of wealth tax and
+        income tax d parameters, see ogusa.sweep.SWEEP_PARAMS), result
+        is the table of outcomes from ogusa.sweep.policy_sweep()
+    {"kind": "score", "baseline_dir": ..., "scenarios": [...],
+     "use_tpi": true}
+        scores the scenarios statically, result is the table from
+        ogusa.scoring.static_score()
+
+HTTP interface:
+    POST   /jobs             queue a job, returns {"id": ...}
+    GET    /jobs             list the jobs
+    GET    /jobs/<id>        status and progress of a job
+    GET    /jobs/<id>/log    output of a job, from byte ?offset=N on
+                             (poll with the returned offset to follow a
+                             running job)
+    GET    /jobs/<id>/result result of a finished job
+    DELETE /jobs/<id>        cancel a queued job
+
+The SS solutions of each sweep (the incidence arrays of each score) are
+also pickled in server_dir/results.
+
+This py-file calls the following other file(s):
+            execute.py
+            ogusa/sweep.py
+            ogusa/scoring.py
+            ogusa/warmstart.py
+
+This py-file creates the following other file(s):
+            server_dir/jobs.sqlite
+            server_dir/logs/<id>.log
+            server_dir/results/<id>.json
+            server_dir/results/<id>.pkl
+------------------------------------------------------------------------
+'''
+
+# Packages
+import BaseHTTPServer
+import SocketServer
+import collections
+import cPickle as pickle
+import importlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import urlparse
+
+'''
+------------------------------------------------------------------------
+DB_FILE     = string, name of the job database in server_dir
+JOB_KINDS   = tuple, kinds of jobs the server runs
+JOB_COLUMNS = list, columns of the jobs table returned to clients
+MAX_SETUPS  = integer, number of baseline setups kept in memory
+MAX_SOLVED  = integer, number of SS solutions kept for each setup to
+              start new scenarios from
+PRELOAD     = tuple, modules imported before the server takes requests
+------------------------------------------------------------------------
+'''
+DB_FILE = "jobs.sqlite"
+JOB_KINDS = ('sweep', 'score')
+JOB_COLUMNS = ['id', 'kind', 'status', 'progress', 'error', 'created',
+               'started', 'finished']
+MAX_SETUPS = 4
+MAX_SOLVED = 64
+PRELOAD = ('execute', 'ogusa.SS', 'ogusa.sweep', 'ogusa.scoring',
+           'ogusa.warmstart')
+
+
+'''
+------------------------------------------------------------------------
+    Job queue
+------------------------------------------------------------------------
+'''
+
+
+class JobQueue(object):
+    '''
+    Queue of jobs kept in a SQLite database.  Each method opens its own
+    connection, so the queue can be used from the threads serving
+    requests and from the worker.
+
+    A job is 'queued', then 'running', then 'done' or 'failed' (or
+    'cancelled' before it starts).
+
+    Attributes:
+        path = string, path of the database
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        conn = self.connect()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'kind TEXT, spec TEXT, status TEXT, '
+                         'progress TEXT, error TEXT, created REAL, '
+                         'started REAL, finished REAL)')
+            # jobs that were running when the server stopped start again
+            conn.execute("UPDATE jobs SET status = 'queued', started = NULL "
+                         "WHERE status = 'running'")
+        conn.close()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30.0)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def submit(self, spec):
+        '''
+        Adds a job to the queue, returns its id.
+        '''
+        conn = self.connect()
+        with conn:
+            cur = conn.execute('INSERT INTO jobs (kind, spec, status, '
+                               'progress, created) VALUES (?, ?, ?, ?, ?)',
+                               (spec['kind'], json.dumps(spec), 'queued',
+                                '', time.time()))
+            job_id = cur.lastrowid
+        conn.close()
+        return job_id
+
+    def claim(self):
+        '''
+        Marks the oldest queued job as running and returns its id and
+        spec, or None if no job is queued.
+        '''
+        conn = self.connect()
+        job = None
+        with conn:
+            row = conn.execute("SELECT id, spec FROM jobs WHERE status = "
+                               "'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', "
+                             "started = ? WHERE id = ?",
+                             (time.time(), row['id']))
+                job = (row['id'], json.loads(row['spec']))
+        conn.close()
+        return job
+
+    def update(self, job_id, **values):
+        '''
+        Sets columns of a job, e.g. update(job_id, progress='1 of 4').
+        '''
+        names = sorted(values)
+        conn = self.connect()
+        with conn:
+            conn.execute('UPDATE jobs SET ' +
+                         ', '.join(name + ' = ?' for name in names) +
+                         ' WHERE id = ?',
+                         [values[name] for name in names] + [job_id])
+        conn.close()
+
+    def cancel(self, job_id):
+        '''
+        Cancels a queued job, returns True if it was queued.
+        '''
+        conn = self.connect()
+        with conn:
+            cur = conn.execute("UPDATE jobs SET status = 'cancelled', "
+                               "finished = ? WHERE id = ? AND "
+                               "status = 'queued'", (time.time(), job_id))
+            cancelled = cur.rowcount > 0
+        conn.close()
+        return cancelled
+
+    def get(self, job_id=None):
+        '''
+        Returns a job (None if there is no such job), or all the jobs if
+        job_id is None, as dictionaries of JOB_COLUMNS.
+        '''
+        conn = self.connect()
+        query = 'SELECT ' + ', '.join(JOB_COLUMNS) + ' FROM jobs'
+        if job_id is None:
+            rows = conn.execute(query + ' ORDER BY id').fetchall()
+        else:
+            rows = conn.execute(query + ' WHERE id = ?',
+                                (job_id,)).fetchall()
+        conn.close()
+        jobs = [dict(zip(JOB_COLUMNS, tuple(row))) for row in rows]
+        if job_id is None:
+            return jobs
+        return jobs[0] if len(jobs) > 0 else None
+
+
+'''
+------------------------------------------------------------------------
+    Worker
+------------------------------------------------------------------------
+'''
+
+
+class JobOutput(object):
+    '''
+    Stands in for sys.stdout: what the worker thread prints goes to the
+    log file of the job it is running, everything else to the console.
+
+    Attributes:
+        stream  = file, the console
+        worker  = threading.Thread, the worker thread
+        log     = file, log of the running job (None between jobs)
+    '''
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.worker = None
+        self.log = None
+
+    def write(self, text):
+        if (self.log is not None and
+                threading.current_thread() is self.worker):
+            self.log.write(text)
+            self.log.flush()
+        else:
+            self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class ModelWorker(object):
+    '''
+    Runs the jobs of the queue, one at a time.  Setups of the baselines
+    used by recent jobs, and the SS solutions found for them, are kept
+    in memory.
+
+    Attributes:
+        queue       = JobQueue
+        server_dir  = string, directory of the server files
+        library_dir = string, directory of a warm start library (or None)
+        output      = JobOutput, where the output of jobs is sent
+        setups      = OrderedDict, for each setup key (in order of last
+                      use) a dictionary with the params tuple,
+                      sim_params, and the last MAX_SOLVED (scenario, SS
+                      solution) tuples solved
+        scores      = OrderedDict, baseline results loaded for scoring
+                      in order of last use
+    '''
+
+    def __init__(self, queue, server_dir, library_dir=None, output=None,
+                 poll_time=1.0):
+        self.queue = queue
+        self.server_dir = server_dir
+        self.library_dir = library_dir
+        self.output = output
+        self.poll_time = poll_time
+        self.setups = collections.OrderedDict()
+        self.scores = collections.OrderedDict()
+        self.stopped = threading.Event()
+
+    def cached(self, cache, key, make):
+        '''
+        Returns cache[key], made with make() if it is not there.  Only
+        the MAX_SETUPS most recently used entries are kept.
+        '''
+        if key in cache:
+            value = cache.pop(key)
+        else:
+            value = make()
+        cache[key] = value
+        while len(cache) > MAX_SETUPS:
+            cache.popitem(last=False)
+        return value
+
+    def sweep_setup(self, spec):
+        '''
+        Returns the setup of the baseline of a sweep job.
+        '''
+        from execute import sweep_setup
+
+        args = (spec['baseline_dir'], spec.get('analytical_mtrs', True),
+                spec.get('fix_transfers', True), spec.get('user_params', {}))
+
+        def make():
+            print 'Setting up ', args
+            params, sim_params = sweep_setup(*args)
+            return {'params': params, 'sim_params': sim_params,
+                    'solved': collections.deque(maxlen=MAX_SOLVED)}
+        return self.cached(self.setups, json.dumps(args, sort_keys=True),
+                           make)
+
+    def library_start(self, setup, scenarios):
+        '''
+        Returns a warm start for the first scenario from the warm start
+        library, as a (scenario, SS solution) tuple, or None.
+        '''
+        from ogusa import warmstart
+
+        if self.library_dir is None or len(scenarios) == 0:
+            return None
+        guess = warmstart.warm_start(self.library_dir, setup['sim_params'],
+                                     'SS', overrides=scenarios[0])
+        if guess is None:
+            return None
+        return (scenarios[0], guess)
+
+    def run_sweep(self, job_id, spec):
+        '''
+        Solves the SS of the scenarios of a job.  Each scenario starts
+        from the closest scenario solved for the same baseline setup.
+
+        Returns: dictionary, table of outcomes as a list of rows, and
+                 list of SS solutions
+        '''
+        from ogusa import sweep
+
+        setup = self.sweep_setup(spec)
+        scenarios = spec['scenarios']
+        warm_starts = list(setup['solved'])
+        if len(warm_starts) == 0:
+            start = self.library_start(setup, scenarios)
+            if start is not None:
+                warm_starts.append(start)
+
+        def progress(n_solved, n_total):
+            self.queue.update(job_id, progress='%d of %d scenarios solved'
+                              % (n_solved, n_total))
+
+        table, ss_outputs = sweep.policy_sweep(
+            scenarios, setup['params'], num_workers=spec.get('num_workers', 1),
+            batch_size=spec.get('batch_size'), warm_starts=warm_starts,
+            progress=progress)
+        setup['solved'].extend((scenario, ss_output) for scenario, ss_output
+                               in zip(scenarios, ss_outputs)
+                               if ss_output is not None)
+        return json.loads(table.to_json(orient='records')), ss_outputs
+
+    def run_score(self, job_id, spec):
+        '''
+        Scores the scenarios of a job statically on its baseline.
+
+        Returns: dictionary, table of scores as a list of rows, and the
+                 incidence arrays
+        '''
+        from execute import score_setup
+        from ogusa import scoring
+
+        args = (spec['baseline_dir'], spec.get('use_tpi', True))
+        baseline = self.cached(self.scores, json.dumps(args),
+                               lambda: score_setup(*args))
+        table, incidence = scoring.static_score(spec['scenarios'],
+                                                *baseline)
+        return json.loads(table.to_json(orient='records')), incidence
+
+    def run_job(self, job_id, spec):
+        '''
+        Runs a job, saving its log, result and solutions.
+        '''
+        log_path = os.path.join(self.server_dir, 'logs', '%d.log' % job_id)
+        result_path = os.path.join(self.server_dir, 'results',
+                                   '%d' % job_id)
+        with open(log_path, "a") as log:
+            if self.output is not None:
+                self.output.log = log
+            try:
+                if spec['kind'] == 'sweep':
+                    rows, solutions = self.run_sweep(job_id, spec)
+                else:
+                    rows, solutions = self.run_score(job_id, spec)
+                with open(result_path + '.pkl.tmp', "wb") as f:
+                    pickle.dump(solutions, f)
+                os.rename(result_path + '.pkl.tmp', result_path + '.pkl')
+                with open(result_path + '.json.tmp', "w") as f:
+                    json.dump({'id': job_id, 'table': rows,
+                               'solutions': result_path + '.pkl'}, f)
+                os.rename(result_path + '.json.tmp', result_path + '.json')
+                self.queue.update(job_id, status='done',
+                                  finished=time.time())
+            except Exception:
+                error = traceback.format_exc()
+                log.write(error)
+                self.queue.update(job_id, status='failed', error=error,
+                                  finished=time.time())
+            finally:
+                if self.output is not None:
+                    self.output.log = None
+
+    def run(self):
+        '''
+        Runs queued jobs until stop() is called.
+        '''
+        while not self.stopped.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self.stopped.wait(self.poll_time)
+                continue
+            self.run_job(*job)
+
+    def stop(self):
+        self.stopped.set()
+
+
+'''
+------------------------------------------------------------------------
+    HTTP interface
+------------------------------------------------------------------------
+'''
+
+
+class ModelServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    HTTP server for the job queue, each request handled in its own
+    thread.
+
+    Attributes:
+        queue      = JobQueue
+        server_dir = string, directory of the server files
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, queue, server_dir):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ModelHandler)
+        self.queue = queue
+        self.server_dir = server_dir
+
+
+class ModelHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Handles the requests of the HTTP interface (see the top of this
+    file).
+    '''
+
+    def send_json(self, obj, code=200):
+        body = json.dumps(obj)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self):
+        '''
+        Returns the job id and the rest of the path of a request to
+        /jobs/<id>/..., with job id None for /jobs.  Raises ValueError
+        for other paths.
+        '''
+        url = urlparse.urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if len(parts) == 0 or parts[0] != 'jobs' or len(parts) > 3:
+            raise ValueError('Unknown path: ' + url.path)
+        job_id = int(parts[1]) if len(parts) > 1 else None
+        action = parts[2] if len(parts) > 2 else None
+        return job_id, action, urlparse.parse_qs(url.query)
+
+    def do_GET(self):
+        try:
+            job_id, action, query = self.route()
+        except ValueError as err:
+            return self.send_json({'error': str(err)}, 404)
+        queue = self.server.queue
+        if job_id is None:
+            return self.send_json(queue.get())
+        job = queue.get(job_id)
+        if job is None:
+            return self.send_json({'error': 'No job %d' % job_id}, 404)
+        if action is None:
+            return self.send_json(job)
+        if action == 'log':
+            offset = int(query.get('offset', ['0'])[0])
+            path = os.path.join(self.server.server_dir, 'logs',
+                                '%d.log' % job_id)
+            text = ''
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    f.seek(offset)
+                    text = f.read()
+            return self.send_json({'status': job['status'], 'text': text,
+                                   'offset': offset + len(text)})
+        if action == 'result':
+            if job['status'] != 'done':
+                return self.send_json({'error': 'Job %d is %s' %
+                                       (job_id, job['status'])}, 409)
+            path = os.path.join(self.server.server_dir, 'results',
+                                '%d.json' % job_id)
+            with open(path, "r") as f:
+                return self.send_json(json.load(f))
+        return self.send_json({'error': 'Unknown action: ' + action}, 404)
+
+    def do_POST(self):
+        try:
+            job_id, action, query = self.route()
+        except ValueError as err:
+            return self.send_json({'error': str(err)}, 404)
+        if job_id is not None:
+            return self.send_json({'error': 'POST to /jobs'}, 404)
+        try:
+            length = int(self.headers.getheader('Content-Length', 0))
+            spec = json.loads(self.rfile.read(length))
+            if spec.get('kind') not in JOB_KINDS:
+                raise ValueError('Unknown job kind: ' + str(spec.get('kind')))
+            for key in ('baseline_dir', 'scenarios'):
+                if key not in spec:
+                    raise ValueError('Job has no ' + key)
+        except ValueError as err:
+            return self.send_json({'error': str(err)}, 400)
+        self.send_json({'id': self.server.queue.submit(spec)}, 201)
+
+    def do_DELETE(self):
+        try:
+            job_id, action, query = self.route()
+        except ValueError as err:
+            return self.send_json({'error': str(err)}, 404)
+        if job_id is None or action is not None:
+            return self.send_json({'error': 'DELETE /jobs/<id>'}, 404)
+        if not self.server.queue.cancel(job_id):
+            return self.send_json({'error': 'Job %d is not queued' % job_id},
+                                  409)
+        self.send_json({'id': job_id, 'status': 'cancelled'})
+
+    def log_message(self, format, *args):
+        # keep the console for the output of the model
+        pass
+
+
+'''
+------------------------------------------------------------------------
+    Functions
+------------------------------------------------------------------------
+'''
+
+
+def serve(server_dir="./SERVER", port=8765, host='127.0.0.1',
+          library_dir=None):
+    '''
+    Runs the server until it is interrupted.  Imports the model once,
+    then answers requests on host:port while the worker runs the jobs.
+
+    Inputs:
+        server_dir  = string, directory of the job database, logs and
+                      results
+        port        = integer, port to listen on
+        host        = string, address to listen on (the default only
+                      accepts connections from this machine)
+        library_dir = string, directory of a warm start library to start
+                      new policies from, or None
+
+    Functions called:
+        ogusa.utils.mkdirs
+        execute.sweep_setup (by the worker)
+        ogusa.sweep.policy_sweep (by the worker)
+        ogusa.scoring.static_score (by the worker)
+
+    Objects in function:
+        queue  = JobQueue
+        worker = ModelWorker
+        httpd  = ModelServer
+
+    Returns: None
+    '''
+    # import the model before taking requests, so the first job does not
+    # wait for it
+    for name in PRELOAD:
+        importlib.import_module(name)
+    from ogusa import utils
+
+    for name in ('logs', 'results'):
+        utils.mkdirs(os.path.join(server_dir, name))
+
+    queue = JobQueue(os.path.join(server_dir, DB_FILE))
+    output = JobOutput(sys.stdout)
+    sys.stdout = output
+    worker = ModelWorker(queue, server_dir, library_dir, output)
+    thread = threading.Thread(target=worker.run)
+    thread.daemon = True
+    output.worker = thread
+    thread.start()
+
+    httpd = ModelServer((host, port), queue, server_dir)
+    print 'Serving on ', host, ':', port
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        worker.stop()
+        sys.stdout = output.stream
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3:
+        serve(sys.argv[1], int(sys.argv[2]), library_dir=sys.argv[3])
+    elif len(sys.argv) > 2:
+        serve(sys.argv[1], int(sys.argv[2]))
+    elif len(sys.argv) > 1:
+        serve(sys.argv[1])
+    else:
+        serve()
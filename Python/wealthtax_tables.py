@@ -342,10 +342,11 @@ for tax_run in ('base','wealth','income'):
     income = ((wss[tax_run]*e*n[tax_run]) + (rss[tax_run]*bssmat[tax_run]))
     var_dict = {'b':bssmat[tax_run],'y':income,'c':c[tax_run],'n':n[tax_run]}
     for key,value in var_dict.iteritems():
-        inequality[key,tax_run,'$var(log(x_{j,s}))$'] = inequal.var_log(value, weights,factor['base'])
-        inequality[key,tax_run,'90/10 ratio'] = inequal.ninety_ten(value, weights)
-        inequality[key,tax_run,'Top 10% share'] = inequal.top_10(value, weights)
-        inequality[key,tax_run,'Top 1% share'] = inequal.top_1(value, weights)
+        measures = inequal.inequality_measures(value, weights, factor=factor['base'])
+        inequality[key,tax_run,'$var(log(x_{j,s}))$'] = measures['var_log']
+        inequality[key,tax_run,'90/10 ratio'] = measures['ratio_90_10']
+        inequality[key,tax_run,'Top 10% share'] = measures['top_10_share']
+        inequality[key,tax_run,'Top 1% share'] = measures['top_1_share']
 
 # write to workbook
 worksheet = workbook.add_worksheet('Alt Inequality')